@@ -0,0 +1,378 @@
+"""
+Pannello di amministrazione Flet del server.
+
+Il pannello è un iscritto opzionale al bus degli eventi (eventi.py): il server
+non importa Flet e gli aggiornamenti grafici avvengono sul thread del bus, mai su
+quello che inoltra le mosse. I pulsanti di moderazione chiamano le funzioni del
+server passate al costruttore. Senza pannello (--headless) il server gira
+identico, senza pagina né aggiornamenti grafici.
+
+Gli eventi non aggiornano subito la pagina: marcano come "sporchi" i controlli
+toccati e un thread li invia tutti insieme con un solo update, al massimo
+FREQUENZA_AGGIORNAMENTO volte al secondo, qualunque sia il numero di partite.
+
+La memoria della pagina resta limitata anche dopo giorni di attività: le schede
+vengono costruite solo per le sessioni della pagina visibile (lista paginata e
+filtrabile), mosse e chat di ogni sessione sono buffer circolari di lunghezza
+fissa, e le partite concluse passano in una tabella riassuntiva compatta.
+"""
+
+import collections
+import os
+import threading
+import time
+
+import flet as ft
+
+# Aggiornamenti della pagina al secondo (5-10 Hz bastano a un occhio umano)
+FREQUENZA_AGGIORNAMENTO = float(os.environ.get("ADMIN_FREQUENZA_HZ", "8"))
+
+SESSIONI_PER_PAGINA = 10
+MAX_RIGHE_LOG = 50  # mosse e messaggi chat tenuti per ogni sessione
+MAX_CONCLUSE = 100  # righe della tabella delle partite concluse
+MAX_AVVISI = 100
+
+
+class StatoSessione:
+    """Dati di una sessione attiva per il pannello, indipendenti dai controlli Flet."""
+
+    __slots__ = ("sessione", "bianco", "nero", "mosse", "chat", "n_mosse", "limitati")
+
+    def __init__(self, sessione):
+        self.sessione = sessione
+        self.bianco = sessione.giocatori[0][1]
+        self.nero = sessione.giocatori[1][1]
+        self.mosse = collections.deque(maxlen=MAX_RIGHE_LOG)
+        self.chat = collections.deque(maxlen=MAX_RIGHE_LOG)
+        self.n_mosse = 0
+        self.limitati = 0  # messaggi rifiutati per i limiti di frequenza
+
+    def corrisponde(self, filtro) -> bool:
+        return (
+            not filtro
+            or filtro in self.bianco.lower()
+            or filtro in self.nero.lower()
+            or filtro == str(self.sessione.id)
+        )
+
+
+def descrivi_durata(durata):
+    return "No time" if durata == 0 else f"{int(durata // 60)}' per lato"
+
+
+class PannelloAdmin:
+    def __init__(self, pagina: ft.Page, titolo, modalita, chiudi_sessione, banna_giocatore,
+                 frequenza=FREQUENZA_AGGIORNAMENTO):
+        self.pagina = pagina
+        # Azioni di moderazione del server: chiudi_sessione(sessione), banna_giocatore(sessione, indice)
+        self.chiudi_sessione = chiudi_sessione
+        self.banna_giocatore = banna_giocatore
+
+        self.attive = collections.OrderedDict()  # sessione.id -> StatoSessione, in ordine di inizio
+        self.concluse = collections.deque(maxlen=MAX_CONCLUSE)  # righe (id, bianco, nero, durata, mosse, esito)
+        self.ui_sessioni = {}  # solo sessioni visibili: sessione.id -> dict con i controlli della scheda
+        self.filtro = ""
+        self.numero_pagina = 0
+        self.totale_limitati = 0
+        self.disconnessi_flood = 0
+
+        # Controlli modificati dall'ultimo update; il lock li protegge anche durante l'invio
+        self._sporchi = set()
+        self._vista_sporca = False  # lista delle sessioni visibili da ricostruire
+        self._concluse_sporche = False
+        self._lock = threading.Lock()
+        self._intervallo = 1.0 / frequenza
+
+        pagina.title = titolo
+
+        # Pannello superiore di info generali
+        self.testo_limiti = ft.Text(self._descrivi_limiti(), size=12, color="grey")
+        intestazione = ft.Column(
+            [
+                ft.Text(titolo, size=24, weight="bold"),
+                ft.Text(f"Modalità: {modalita}", size=12, color="grey"),
+                self.testo_limiti,
+                ft.Text("Sessioni attive e strumenti di moderazione:", size=16),
+            ],
+            spacing=5,
+        )
+
+        self.campo_filtro = ft.TextField(
+            label="Filtra per nickname o #id", width=260, dense=True, on_change=self._cambia_filtro
+        )
+        self.testo_paginazione = ft.Text("")
+        navigazione = ft.Row(
+            [
+                self.campo_filtro,
+                ft.IconButton(ft.Icons.CHEVRON_LEFT, on_click=lambda e: self._cambia_pagina(-1)),
+                self.testo_paginazione,
+                ft.IconButton(ft.Icons.CHEVRON_RIGHT, on_click=lambda e: self._cambia_pagina(1)),
+            ],
+            spacing=10,
+        )
+
+        self.contenitore_sessioni = ft.Column(spacing=10)
+
+        self.tabella_concluse = ft.DataTable(
+            columns=[
+                ft.DataColumn(ft.Text("#")),
+                ft.DataColumn(ft.Text("Bianco")),
+                ft.DataColumn(ft.Text("Nero")),
+                ft.DataColumn(ft.Text("Tempo")),
+                ft.DataColumn(ft.Text("Mosse"), numeric=True),
+                ft.DataColumn(ft.Text("Esito")),
+            ],
+            rows=[],
+            heading_row_height=30,
+            data_row_min_height=24,
+            data_row_max_height=24,
+        )
+        self.lista_avvisi = ft.ListView(spacing=2, padding=5, auto_scroll=True, height=100)
+
+        pagina.scroll = ft.ScrollMode.AUTO
+        pagina.add(
+            intestazione,
+            navigazione,
+            ft.Divider(),
+            self.contenitore_sessioni,
+            ft.Divider(),
+            ft.Text("Partite concluse:", weight="bold"),
+            self.tabella_concluse,
+            ft.Text("Avvisi:", weight="bold"),
+            ft.Container(content=self.lista_avvisi, border=ft.border.all(1, "grey"), border_radius=5),
+        )
+        self._ricostruisci_vista()
+        threading.Thread(target=self._ciclo_aggiornamento, name="admin-update", daemon=True).start()
+
+    def _descrivi_limiti(self):
+        return (
+            f"Messaggi oltre i limiti di frequenza: {self.totale_limitati} - "
+            f"disconnessi per flood: {self.disconnessi_flood}"
+        )
+
+    def _segna(self, controllo):
+        self._sporchi.add(controllo)
+
+    def _ciclo_aggiornamento(self):
+        while True:
+            time.sleep(self._intervallo)
+            with self._lock:
+                if self._vista_sporca:
+                    self._vista_sporca = False
+                    self._ricostruisci_vista()
+                if self._concluse_sporche:
+                    self._concluse_sporche = False
+                    self._ricostruisci_concluse()
+                if not self._sporchi:
+                    continue
+                sporchi, self._sporchi = self._sporchi, set()
+                if self.contenitore_sessioni in sporchi:
+                    # L'update del contenitore copre già tutte le schede visibili
+                    for ui in self.ui_sessioni.values():
+                        sporchi.discard(ui["lista_mosse"])
+                        sporchi.discard(ui["lista_chat"])
+                        sporchi.discard(ui["testo_limiti"])
+            # Fuori dal lock: un client Flet lento non deve bloccare i gestori del bus
+            try:
+                # Un solo messaggio verso il client Flet per tutte le modifiche accumulate
+                self.pagina.update(*sporchi)
+            except Exception as errore:
+                print(f"Errore aggiornamento pannello admin: {errore}")
+
+    # --- Vista paginata (chiamate con il lock preso) ---
+
+    def _visibili(self):
+        filtro = self.filtro
+        corrispondenti = [stato for stato in self.attive.values() if stato.corrisponde(filtro)]
+        pagine = max(1, -(-len(corrispondenti) // SESSIONI_PER_PAGINA))
+        self.numero_pagina = min(self.numero_pagina, pagine - 1)
+        inizio = self.numero_pagina * SESSIONI_PER_PAGINA
+        return corrispondenti[inizio:inizio + SESSIONI_PER_PAGINA], len(corrispondenti), pagine
+
+    def _ricostruisci_vista(self):
+        """Mostra solo le schede della pagina corrente; quelle già costruite vengono riusate."""
+        visibili, totale, pagine = self._visibili()
+        ui_visibili = {}
+        for stato in visibili:
+            sid = stato.sessione.id
+            ui_visibili[sid] = self.ui_sessioni.pop(sid, None) or self._crea_scheda(stato)
+        # Le schede uscite dalla vista non vanno più aggiornate (né tenute in memoria)
+        for ui in self.ui_sessioni.values():
+            self._sporchi.discard(ui["lista_mosse"])
+            self._sporchi.discard(ui["lista_chat"])
+            self._sporchi.discard(ui["testo_limiti"])
+        self.ui_sessioni = ui_visibili
+        self.contenitore_sessioni.controls = [ui["card"] for ui in ui_visibili.values()]
+        self.testo_paginazione.value = (
+            f"Pagina {self.numero_pagina + 1}/{pagine} - {totale} sessioni"
+            + (f" (su {len(self.attive)})" if self.filtro else "")
+        )
+        self._segna(self.contenitore_sessioni)
+        self._segna(self.testo_paginazione)
+
+    def _ricostruisci_concluse(self):
+        self.tabella_concluse.rows = [
+            ft.DataRow(cells=[ft.DataCell(ft.Text(str(valore), size=12)) for valore in riga])
+            for riga in reversed(self.concluse)
+        ]
+        self._segna(self.tabella_concluse)
+
+    def _crea_scheda(self, stato):
+        """Crea la scheda grafica di una sessione visibile, a partire dai suoi buffer."""
+        sessione = stato.sessione
+
+        titolo = ft.Text(
+            f"Sessione #{sessione.id} - {stato.bianco} (Bianco) vs {stato.nero} (Nero) - "
+            f"{descrivi_durata(sessione.durata)}",
+            weight="bold",
+        )
+        testo_limiti = ft.Text(f"Messaggi limitati: {stato.limitati}", size=12, color="grey")
+
+        # UI Mosse e Chat, precompilate con le ultime righe del buffer
+        lista_mosse = ft.ListView(
+            controls=[ft.Text(riga, size=12) for riga in stato.mosse],
+            spacing=2, padding=5, auto_scroll=True, height=100,
+        )
+        lista_chat = ft.ListView(
+            controls=[ft.Text(riga, size=12) for riga in stato.chat],
+            spacing=2, padding=5, auto_scroll=True, height=100,
+        )
+
+        def chiudi_sessione_admin(e):
+            self.chiudi_sessione(sessione)
+
+        def banna_bianco(e):
+            self.banna_giocatore(sessione, 0)
+
+        def banna_nero(e):
+            self.banna_giocatore(sessione, 1)
+
+        pulsanti = ft.Row(
+            [
+                ft.ElevatedButton("Chiudi sessione", on_click=chiudi_sessione_admin),
+                ft.TextButton("Banna Bianco", on_click=banna_bianco),
+                ft.TextButton("Banna Nero", on_click=banna_nero),
+            ],
+            spacing=10,
+        )
+
+        card = ft.Card(
+            content=ft.Container(
+                content=ft.Column(
+                    [
+                        titolo,
+                        testo_limiti,
+                        pulsanti,
+                        ft.Text("Mosse:", weight="bold"),
+                        ft.Container(content=lista_mosse, border=ft.border.all(1, "grey"), border_radius=5, height=100),
+                        ft.Text("Chat:", weight="bold"),
+                        ft.Container(content=lista_chat, border=ft.border.all(1, "grey"), border_radius=5, height=100),
+                    ],
+                    spacing=5,
+                ),
+                padding=10,
+            )
+        )
+
+        return {
+            "card": card,
+            "lista_mosse": lista_mosse,
+            "lista_chat": lista_chat,
+            "testo_limiti": testo_limiti,
+        }
+
+    def _aggiungi_riga(self, buffer, sessione, chiave, riga):
+        """Aggiunge una riga al buffer circolare e, se la scheda è visibile, alla sua lista."""
+        buffer.append(riga)
+        ui = self.ui_sessioni.get(sessione.id)
+        if not ui:
+            return
+        lista = ui[chiave]
+        lista.controls.append(ft.Text(riga, size=12))
+        if len(lista.controls) > MAX_RIGHE_LOG:
+            del lista.controls[0]
+        self._segna(lista)
+
+    # --- Controlli della pagina (thread di Flet) ---
+
+    def _cambia_filtro(self, e):
+        with self._lock:
+            self.filtro = (e.control.value or "").strip().lower().lstrip("#")
+            self.numero_pagina = 0
+            self._vista_sporca = True
+
+    def _cambia_pagina(self, passo):
+        with self._lock:
+            self.numero_pagina = max(0, self.numero_pagina + passo)
+            self._vista_sporca = True
+
+    # --- Eventi del server (thread del bus) ---
+
+    def sessione_iniziata(self, sessione):
+        with self._lock:
+            self.attive[sessione.id] = StatoSessione(sessione)
+            self._vista_sporca = True
+
+    def mossa(self, sessione, nickname, mossa):
+        """Aggiunge una mossa al log della sessione."""
+        with self._lock:
+            stato = self.attive.get(sessione.id)
+            if not stato:
+                return
+            stato.n_mosse += 1
+            self._aggiungi_riga(stato.mosse, sessione, "lista_mosse", f"{nickname}: {mossa}")
+
+    def chat(self, sessione, mittente, messaggio):
+        """Aggiunge un messaggio al log chat della sessione."""
+        with self._lock:
+            stato = self.attive.get(sessione.id)
+            if not stato:
+                return
+            self._aggiungi_riga(stato.chat, sessione, "lista_chat", f"[{mittente}]: {messaggio}")
+
+    def limite(self, sessione, nickname, tipo, disconnesso):
+        """Messaggio rifiutato per i limiti di frequenza (ed eventuale disconnessione)."""
+        with self._lock:
+            self.totale_limitati += 1
+            if disconnesso:
+                self.disconnessi_flood += 1
+                self.lista_avvisi.controls.append(
+                    ft.Text(f"Flood: {nickname} disconnesso (troppi messaggi {tipo})", size=12)
+                )
+                if len(self.lista_avvisi.controls) > MAX_AVVISI:
+                    del self.lista_avvisi.controls[0]
+                self._segna(self.lista_avvisi)
+            self.testo_limiti.value = self._descrivi_limiti()
+            self._segna(self.testo_limiti)
+            stato = self.attive.get(sessione.id)
+            if not stato:
+                return
+            stato.limitati += 1
+            ui = self.ui_sessioni.get(sessione.id)
+            if ui:
+                ui["testo_limiti"].value = f"Messaggi limitati: {stato.limitati}"
+                self._segna(ui["testo_limiti"])
+
+    def sessione_chiusa(self, sessione, testo):
+        """Sposta la sessione dalla lista delle attive alla tabella delle concluse."""
+        with self._lock:
+            stato = self.attive.pop(sessione.id, None)
+            if not stato:
+                return
+            self.concluse.append((
+                sessione.id, stato.bianco, stato.nero,
+                descrivi_durata(sessione.durata), stato.n_mosse, testo,
+            ))
+            self._vista_sporca = True
+            self._concluse_sporche = True
+
+    def partita_finita(self, sessione, risultato, terminazione):
+        self.sessione_chiusa(sessione, f"Partita finita: {risultato} ({terminazione})")
+
+    def avviso(self, testo):
+        """Messaggi generici del server (connessioni rifiutate, tempo scaduto, ...)."""
+        with self._lock:
+            self.lista_avvisi.controls.append(ft.Text(testo, size=12))
+            if len(self.lista_avvisi.controls) > MAX_AVVISI:
+                del self.lista_avvisi.controls[0]
+            self._segna(self.lista_avvisi)
@@ -0,0 +1,115 @@
+"""
+Archivio PGN delle partite concluse.
+
+Il server chiama ArchivioPGN.partita_finita direttamente per ogni partita conclusa,
+come fa con il giornale, e non tramite il bus degli eventi: il bus scarta gli
+eventi quando è pieno, l'archivio non deve perdere nessuna partita. La chiamata
+mette la partita in una coda illimitata e ritorna subito; un thread di scrittura
+dedicato prepara il testo PGN (giocatori, tempo di gioco, risultato, motivo della
+fine) e accumula le partite arrivate
+nell'ultimo INTERVALLO_SCRITTURA e le scrive con un solo write + fsync, quindi
+il costo dell'archivio non dipende dal numero di partite e non tocca mai i thread
+di gioco. I file sono solo in append e ruotano quando superano DIMENSIONE_MASSIMA.
+"""
+
+import datetime
+import os
+import pathlib
+import queue
+import threading
+import time
+
+import chess.pgn
+
+# Cartella dei dati persistenti (montata come volume nel container)
+CARTELLA_DATI = pathlib.Path(
+    os.environ.get("CARTELLA_DATI", pathlib.Path(__file__).resolve().parent.parent / "data")
+)
+
+DIMENSIONE_MASSIMA = 16 * 1024 * 1024  # byte per file prima di passare al successivo
+INTERVALLO_SCRITTURA = 1.0  # secondi di partite raccolte in un solo fsync
+MAX_PARTITE_PER_BLOCCO = 1000
+
+
+def partita_pgn(sessione, risultato, terminazione, data=None) -> str:
+    """Testo PGN di una sessione conclusa."""
+    partita = chess.pgn.Game.from_board(sessione.scacchiera)
+    data = data or datetime.date.today()
+    partita.headers["Event"] = "Thread-Chess"
+    partita.headers["Site"] = "Thread-Chess server"
+    partita.headers["Date"] = data.strftime("%Y.%m.%d")
+    partita.headers["Round"] = str(sessione.id)
+    partita.headers["White"] = sessione.giocatori[0][1]
+    partita.headers["Black"] = sessione.giocatori[1][1]
+    partita.headers["Result"] = risultato
+    partita.headers["TimeControl"] = str(sessione.durata) if sessione.durata else "-"
+    partita.headers["Termination"] = terminazione
+    return str(partita) + "\n\n"
+
+
+class ArchivioPGN:
+    def __init__(self, cartella=CARTELLA_DATI, dimensione_massima=DIMENSIONE_MASSIMA,
+                 intervallo=INTERVALLO_SCRITTURA):
+        self.cartella = pathlib.Path(cartella) / "partite"
+        self.cartella.mkdir(parents=True, exist_ok=True)
+        self.dimensione_massima = dimensione_massima
+        self.intervallo = intervallo
+        self._coda = queue.Queue()
+        self._file = None
+        self._giorno = None
+        self._indice = 0
+        self.partite_scritte = 0
+        self.fsync = 0
+        threading.Thread(target=self._ciclo, name="archivio-pgn", daemon=True).start()
+
+    def partita_finita(self, sessione, risultato, terminazione):
+        """Accoda la partita (coda illimitata: non blocca e non scarta); il PGN lo prepara il thread."""
+        if not sessione.iniziata:
+            return
+        self._coda.put((sessione, risultato, terminazione, datetime.date.today()))
+
+    # --- Thread di scrittura ---
+
+    def _ciclo(self):
+        while True:
+            blocco = [self._coda.get()]
+            # Raccoglie le altre partite che arrivano nell'intervallo (group commit)
+            scadenza = time.monotonic() + self.intervallo
+            try:
+                while len(blocco) < MAX_PARTITE_PER_BLOCCO:
+                    blocco.append(self._coda.get(timeout=max(0.0, scadenza - time.monotonic())))
+            except queue.Empty:
+                pass
+            try:
+                testo = "".join(partita_pgn(*partita) for partita in blocco)
+                self._scrivi(testo.encode("utf-8"))
+                self.partite_scritte += len(blocco)
+            except OSError as errore:
+                print(f"Errore archivio PGN: {errore}")
+
+    def _scrivi(self, dati):
+        giorno = datetime.date.today().strftime("%Y%m%d")
+        if (
+            self._file is None
+            or giorno != self._giorno
+            or (self._file.tell() and self._file.tell() + len(dati) > self.dimensione_massima)
+        ):
+            self._ruota(giorno)
+        self._file.write(dati)
+        self._file.flush()
+        os.fsync(self._file.fileno())
+        self.fsync += 1
+
+    def _ruota(self, giorno):
+        """Chiude il file corrente e apre il successivo (o riprende l'ultimo non pieno del giorno)."""
+        if self._file is not None:
+            self._file.close()
+        indice = self._indice + 1 if giorno == self._giorno else 0
+        while True:
+            percorso = self.cartella / f"partite-{giorno}-{indice:03d}.pgn"
+            if not percorso.exists() or percorso.stat().st_size < self.dimensione_massima:
+                break
+            indice += 1
+        self._giorno = giorno
+        self._indice = indice
+        self._file = open(percorso, "ab")
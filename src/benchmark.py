@@ -0,0 +1,435 @@
+"""
+Microbenchmark delle funzioni calde del server, per confrontare una modifica a
+server.py con dei numeri invece che a occhio.
+
+Ogni benchmark esegue la funzione vera di server.py (non una copia) su un corpus
+di posizioni: le partite reali di benchmark_partite.pgn (fisse, nel repository),
+partite casuali riproducibili (--seme), partite lunghe per i controlli che
+dipendono dalla lunghezza della partita e, se indicato con --pgn, altre partite
+(es. l'archivio PGN). Il risultato è il tempo per operazione in µs (migliore e
+mediana su --ripetizioni giri, dopo un giro di riscaldamento, con il garbage
+collector spento e la preparazione esclusa).
+
+Con --aggiorna-base i risultati vengono salvati nel file di base,
+benchmark_base.json accanto a questo file e versionato con il codice; altrimenti
+ogni benchmark viene confrontato con la base e quelli la cui mediana è più lenta
+oltre la --soglia, e di almeno --pavimento µs, vengono segnalati come regressioni
+(codice di uscita 1). La base registra anche i parametri del corpus (--seme,
+--partite, --lunghe, --pgn): con parametri diversi il confronto viene saltato,
+con un avviso. I numeri dipendono dalla
+macchina: chi cambia server.py aggiorna la base sulla propria macchina prima della
+modifica, oppure confronta con quella versionata misurata nello stesso ambiente.
+
+Uso:
+    python benchmark.py --aggiorna-base          # prima della modifica
+    python benchmark.py                          # dopo: confronto con la base
+    python benchmark.py --solo moves_fredda,is_game_over_lunghe --pgn ../data
+"""
+
+import argparse
+import gc
+import json
+import pathlib
+import platform
+import random
+import statistics
+import sys
+import time
+
+import chess
+import chess.pgn
+
+import cache_mosse
+import server
+import sessioni
+
+BASE_PREDEFINITA = pathlib.Path(__file__).with_name("benchmark_base.json")
+# Corpus fisso di partite reali, sempre incluso
+PARTITE_REALI = pathlib.Path(__file__).with_name("benchmark_partite.pgn")
+SOGLIA = 0.15  # rallentamento oltre il quale un benchmark è una regressione
+# Rallentamento minimo in µs/op per una regressione: sotto, per le funzioni da pochi µs, è rumore
+PAVIMENTO_RUMORE = 0.5
+RIPETIZIONI = 9  # giri misurati, dopo un giro di riscaldamento
+PARTITE = 100  # partite casuali del corpus
+SEMIMOSSE = 120  # lunghezza massima delle partite casuali
+PARTITE_LUNGHE = 10
+LUNGHEZZA_LUNGA = 400  # semimosse delle partite lunghe (modalità senza timer)
+
+# Nickname: validi, con caratteri non ammessi, troppo lunghi, con parole vietate
+NICKNAME = [
+    "mario", "Luigi_99", "alice", "bob", "Scacchista_2025", "x", "CavalloPazzo",
+    "re nero", "torre#1", "pedone!", "è_lui", "", "nome_davvero_troppo_lungo",
+    "merda", "stronzo_88", "il_bastardo", "XxCazzoxX", "ok_ok_ok",
+]
+
+# Finali con materiale insufficiente per l'aggiudicazione del tempo scaduto
+FINALI_INSUFFICIENTI = [
+    "8/8/4k3/8/8/3K4/8/8 w - - 0 60",
+    "8/8/4k3/8/8/3KN3/8/8 w - - 0 60",
+    "8/8/4kb2/8/8/3K4/8/8 b - - 0 60",
+]
+
+
+# --- Corpus ---
+
+def partite_casuali(n, semimosse, generatore):
+    """Partite a mosse casuali (liste di chess.Move), fino a fine partita o a semimosse."""
+    partite = []
+    for _ in range(n):
+        scacchiera = chess.Board()
+        while len(scacchiera.move_stack) < semimosse and not scacchiera.is_game_over():
+            scacchiera.push(generatore.choice(list(scacchiera.legal_moves)))
+        partite.append(list(scacchiera.move_stack))
+    return partite
+
+
+def partite_lunghe(n, semimosse, generatore):
+    """Partite casuali che evitano la fine partita finché possono, per arrivare a semimosse."""
+    partite = []
+    for _ in range(n):
+        scacchiera = chess.Board()
+        while len(scacchiera.move_stack) < semimosse:
+            mosse = list(scacchiera.legal_moves)
+            generatore.shuffle(mosse)
+            for mossa in mosse:
+                scacchiera.push(mossa)
+                if not scacchiera.is_game_over():
+                    break
+                scacchiera.pop()
+            else:
+                break
+        partite.append(list(scacchiera.move_stack))
+    return partite
+
+
+def partite_pgn(percorso):
+    """Partite reali da un file .pgn o da tutti i .pgn di una cartella (es. l'archivio)."""
+    percorso = pathlib.Path(percorso)
+    file_pgn = sorted(percorso.rglob("*.pgn")) if percorso.is_dir() else [percorso]
+    partite = []
+    for nome in file_pgn:
+        with open(nome, encoding="utf-8", errors="replace") as f:
+            while True:
+                partita = chess.pgn.read_game(f)
+                if partita is None:
+                    break
+                mosse = list(partita.mainline_moves())
+                if mosse:
+                    partite.append(mosse)
+    return partite
+
+
+class Corpus:
+    def __init__(self, partite, lunghe):
+        self.partite = partite
+        self.lunghe = lunghe
+        # Una posizione ogni 4 semimosse di ogni partita (con la sua storia)
+        self.posizioni = []
+        for mosse in partite:
+            for fine in range(0, len(mosse) + 1, 4):
+                self.posizioni.append(mosse[:fine])
+        # Posizioni dalla seconda metà delle partite lunghe
+        self.posizioni_lunghe = []
+        for mosse in lunghe:
+            for fine in range(len(mosse) // 2, len(mosse) + 1, 10):
+                self.posizioni_lunghe.append(mosse[:fine])
+        self._sessioni = {}
+
+    def sessioni(self, nome):
+        """
+        Sessioni senza timer per le posizioni "posizioni" o "posizioni_lunghe", costruite
+        una volta sola: rigiocare le partite costava più dei giri misurati. Solo per i
+        benchmark che non le modificano; la tabella delle mosse legali viene azzerata.
+        """
+        if nome not in self._sessioni:
+            self._sessioni[nome] = [sessione_di_prova(0, mosse) for mosse in getattr(self, nome)]
+        sessioni_prova = self._sessioni[nome]
+        for sessione in sessioni_prova:
+            sessione.mosse_legali = None
+        return sessioni_prova
+
+
+def sessione_di_prova(durata, mosse=()):
+    """Sessione avviata con due connessioni che scartano i messaggi."""
+    sessione = sessioni.Sessione((sessioni.ConnessioneAssente(), "bianco", durata))
+    sessione.avvia((sessioni.ConnessioneAssente(), "nero", durata))
+    for mossa in mosse:
+        sessione.gioca(mossa)
+    return sessione
+
+
+# --- Benchmark: ognuno prepara i dati e ritorna (operazioni, secondi misurati) ---
+
+def bench_nickname_valido(corpus):
+    nickname = NICKNAME * 50
+    inizio = time.perf_counter()
+    for nome in nickname:
+        server.nickname_valido(nome)
+    return len(nickname), time.perf_counter() - inizio
+
+
+def _richieste_moves(corpus):
+    """(sessione, casella) per ogni pezzo del giocatore al tratto, come i tocchi del client."""
+    richieste = []
+    for sessione in corpus.sessioni("posizioni"):
+        scacchiera = sessione.scacchiera
+        for casella in chess.SquareSet(scacchiera.occupied_co[scacchiera.turn]):
+            richieste.append((sessione, casella))
+    return richieste
+
+
+def _moves(richieste):
+    """Il ramo MOVES| di elabora_messaggio_partita, senza rete."""
+    for sessione, casella in richieste:
+        pezzo = sessione.scacchiera.piece_at(casella)
+        if pezzo and pezzo.color == sessione.scacchiera.turn:
+            mosse_valide = server.mosse_legali_sessione(sessione).da_casella(casella)
+            risposta = f"MOVES|{','.join(chess.square_name(m.to_square) for m in mosse_valide)}"
+            server.protocollo.codifica(risposta)
+
+
+def bench_moves_fredda(corpus):
+    """MOVES| su posizioni mai viste: generazione delle mosse legali."""
+    richieste = _richieste_moves(corpus)
+    originale = server.cache_mosse_legali
+    server.cache_mosse_legali = cache_mosse.CacheMosse()
+    try:
+        inizio = time.perf_counter()
+        _moves(richieste)
+        return len(richieste), time.perf_counter() - inizio
+    finally:
+        server.cache_mosse_legali = originale
+
+
+def bench_moves_calda(corpus):
+    """MOVES| su posizioni già nella cache condivisa (aperture comuni)."""
+    richieste = _richieste_moves(corpus)
+    _moves(richieste)
+    for sessione, _ in richieste:
+        sessione.mosse_legali = None
+    inizio = time.perf_counter()
+    _moves(richieste)
+    return len(richieste), time.perf_counter() - inizio
+
+
+def bench_validazione_push(corpus):
+    """Validazione e push di ogni mossa delle partite del corpus, con la cache vuota."""
+    sessioni_prova = [(sessione_di_prova(0), mosse) for mosse in corpus.partite]
+    originale = server.cache_mosse_legali
+    server.cache_mosse_legali = cache_mosse.CacheMosse()
+    operazioni = 0
+    try:
+        inizio = time.perf_counter()
+        for sessione, mosse in sessioni_prova:
+            for mossa in mosse:
+                if mossa in server.mosse_legali_sessione(sessione).mosse:
+                    sessione.gioca(mossa)
+            operazioni += len(mosse)
+        return operazioni, time.perf_counter() - inizio
+    finally:
+        server.cache_mosse_legali = originale
+
+
+def bench_aggiorna_timer(corpus):
+    sessioni_prova = [sessione_di_prova(600, mosse) for mosse in corpus.posizioni[:500]]
+    inizio = time.perf_counter()
+    for _ in range(20):
+        for sessione in sessioni_prova:
+            server.aggiorna_timer(sessione)
+    return 20 * len(sessioni_prova), time.perf_counter() - inizio
+
+
+def bench_invia_tempo(corpus):
+    """Costruzione e invio di TIME| (metà dei giocatori con protocollo binario)."""
+    sessioni_prova = [sessione_di_prova(180) for _ in range(500)]
+    binari = [sessione.giocatori[1][0] for sessione in sessioni_prova[::2]]
+    server.client_binari.update(binari)
+    try:
+        inizio = time.perf_counter()
+        for _ in range(5):
+            for sessione in sessioni_prova:
+                server.invia_tempo_ai_giocatori(sessione)
+        return 5 * len(sessioni_prova), time.perf_counter() - inizio
+    finally:
+        server.client_binari.difference_update(binari)
+
+
+def _fine_partita(sessioni_prova):
+    scacchiere = [sessione.scacchiera for sessione in sessioni_prova]
+    inizio = time.perf_counter()
+    for scacchiera in scacchiere:
+        scacchiera.is_game_over()
+    return len(scacchiere), time.perf_counter() - inizio
+
+
+def bench_is_game_over(corpus):
+    """Controllo di fine partita dopo ogni mossa, sulle posizioni del corpus."""
+    return _fine_partita(corpus.sessioni("posizioni"))
+
+
+def bench_is_game_over_lunghe(corpus):
+    """Lo stesso controllo nella seconda metà di partite lunghe (modalità senza timer)."""
+    return _fine_partita(corpus.sessioni("posizioni_lunghe"))
+
+
+def _esito(sessioni_prova):
+    for sessione in sessioni_prova:
+        server.mosse_legali_sessione(sessione)
+        sessione.mosse_legali = None  # tabella già in cache: si misura il controllo, non la generazione
+    inizio = time.perf_counter()
+    for sessione in sessioni_prova:
+        server.esito_partita(sessione)
+    return len(sessioni_prova), time.perf_counter() - inizio
+
+
+def bench_esito_partita(corpus):
+    """Il controllo di fine partita del server (stato incrementale della sessione)."""
+    return _esito(corpus.sessioni("posizioni"))
+
+
+def bench_esito_partita_lunghe(corpus):
+    return _esito(corpus.sessioni("posizioni_lunghe"))
+
+
+def bench_gestisci_timeout(corpus):
+    """Aggiudicazione del tempo scaduto (materiale, notifiche, chiusura della sessione)."""
+    sessioni_prova = []
+    for mosse in corpus.posizioni[:300]:
+        sessioni_prova.append(sessione_di_prova(60, mosse))
+    for fen in FINALI_INSUFFICIENTI * 20:
+        sessione = sessione_di_prova(60)
+        sessione.scacchiera.set_fen(fen)
+        sessione.materiale_insufficiente = sessione.scacchiera.is_insufficient_material()
+        sessioni_prova.append(sessione)
+    for sessione in sessioni_prova:
+        sessione.tempo_bianco = 0.0
+        server.sessioni_gioco.aggiungi(sessione)
+    inizio = time.perf_counter()
+    for sessione in sessioni_prova:
+        server.gestisci_timeout(sessione, "WHITE")
+    return len(sessioni_prova), time.perf_counter() - inizio
+
+
+BENCHMARK = {
+    "nickname_valido": bench_nickname_valido,
+    "moves_fredda": bench_moves_fredda,
+    "moves_calda": bench_moves_calda,
+    "validazione_push": bench_validazione_push,
+    "aggiorna_timer": bench_aggiorna_timer,
+    "invia_tempo": bench_invia_tempo,
+    "is_game_over": bench_is_game_over,
+    "is_game_over_lunghe": bench_is_game_over_lunghe,
+    "esito_partita": bench_esito_partita,
+    "esito_partita_lunghe": bench_esito_partita_lunghe,
+    "gestisci_timeout": bench_gestisci_timeout,
+}
+
+
+def misura(nomi, corpus, ripetizioni):
+    """
+    Microsecondi per operazione di ogni benchmark: {nome: (migliore, mediana)}.
+
+    I giri sono a turno (un giro di ogni benchmark, poi il successivo), così un
+    rallentamento passeggero della macchina pesa su tutti invece che su uno solo.
+    Il primo giro è di riscaldamento (cache, allocatore) e non conta; durante la
+    misura il garbage collector è spento, come in timeit.
+    """
+    tempi = {nome: [] for nome in nomi}
+    for giro in range(ripetizioni + 1):
+        for nome in nomi:
+            gc.collect()
+            gc.disable()
+            try:
+                operazioni, secondi = BENCHMARK[nome](corpus)
+            finally:
+                gc.enable()
+            if giro:
+                tempi[nome].append(secondi / operazioni * 1e6)
+    return {nome: (min(valori), statistics.median(valori)) for nome, valori in tempi.items()}
+
+
+def ambiente():
+    return {
+        "python": platform.python_version(), "chess": chess.__version__,
+        "sistema": platform.system(), "processore": platform.machine(),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Microbenchmark delle funzioni calde del server")
+    parser.add_argument("--solo", help="benchmark da eseguire, separati da virgola")
+    parser.add_argument("--ripetizioni", type=int, default=RIPETIZIONI)
+    parser.add_argument("--partite", type=int, default=PARTITE, help="partite casuali del corpus")
+    parser.add_argument("--lunghe", type=int, default=PARTITE_LUNGHE, help="partite lunghe del corpus")
+    parser.add_argument("--seme", type=int, default=1, help="seme del corpus casuale")
+    parser.add_argument("--pgn", help="altro file o cartella .pgn da aggiungere al corpus (es. l'archivio)")
+    parser.add_argument("--base", default=str(BASE_PREDEFINITA), help="file dei risultati di base")
+    parser.add_argument("--aggiorna-base", action="store_true", help="salva questi risultati come base")
+    parser.add_argument("--soglia", type=float, default=SOGLIA,
+                        help="rallentamento relativo segnalato come regressione (0.15 = +15%%)")
+    parser.add_argument("--pavimento", type=float, default=PAVIMENTO_RUMORE,
+                        help="rallentamento minimo in µs/op per una regressione")
+    opzioni = parser.parse_args()
+
+    nomi = opzioni.solo.split(",") if opzioni.solo else list(BENCHMARK)
+    sconosciuti = [nome for nome in nomi if nome not in BENCHMARK]
+    if sconosciuti:
+        parser.error(f"benchmark sconosciuti: {', '.join(sconosciuti)} (disponibili: {', '.join(BENCHMARK)})")
+
+    generatore = random.Random(opzioni.seme)
+    partite = partite_pgn(PARTITE_REALI) + partite_casuali(opzioni.partite, SEMIMOSSE, generatore)
+    if opzioni.pgn:
+        partite += partite_pgn(opzioni.pgn)
+    corpus = Corpus(partite, partite_lunghe(opzioni.lunghe, LUNGHEZZA_LUNGA, generatore))
+    print(f"Corpus: {len(corpus.partite)} partite, {len(corpus.posizioni)} posizioni, "
+          f"{len(corpus.posizioni_lunghe)} posizioni da partite lunghe")
+
+    # Parametri del corpus: una base misurata su un altro corpus non è confrontabile
+    parametri = {
+        "seme": opzioni.seme, "partite": opzioni.partite, "lunghe": opzioni.lunghe, "pgn": opzioni.pgn,
+    }
+    base = {}
+    contenuto = {}
+    percorso_base = pathlib.Path(opzioni.base)
+    if percorso_base.exists():
+        with open(percorso_base, encoding="utf-8") as f:
+            contenuto = json.load(f)
+        if contenuto.get("corpus") != parametri:
+            print(f"Attenzione: base misurata con un altro corpus ({contenuto.get('corpus')}), "
+                  f"confronto saltato: rieseguire con gli stessi parametri o con --aggiorna-base")
+            contenuto = {}
+    if contenuto and not opzioni.aggiorna_base:
+        base = contenuto.get("risultati", {})
+        if contenuto.get("ambiente") != ambiente():
+            print(f"Attenzione: base misurata in un altro ambiente ({contenuto.get('ambiente')})")
+
+    risultati = {}
+    regressioni = []
+    print(f"{'benchmark':<22}{'migliore':>12}{'mediana':>12}{'base':>12}{'delta':>9}")
+    for nome, (migliore, mediana) in misura(nomi, corpus, opzioni.ripetizioni).items():
+        # Il confronto usa la mediana: il migliore di un solo campione oscilla troppo
+        risultati[nome] = round(mediana, 4)
+        riga = f"{nome:<22}{migliore:>12.3f}{mediana:>12.3f}"
+        if nome in base:
+            delta = mediana / base[nome] - 1
+            riga += f"{base[nome]:>12.3f}{delta:>+9.1%}"
+            if delta > opzioni.soglia and mediana - base[nome] > opzioni.pavimento:
+                riga += "  REGRESSIONE"
+                regressioni.append(nome)
+        print(riga)
+
+    if opzioni.aggiorna_base:
+        percorso_base.parent.mkdir(parents=True, exist_ok=True)
+        # Con --solo si aggiornano solo quei benchmark, se la base è dello stesso corpus
+        precedenti = contenuto.get("risultati", {})
+        precedenti.update(risultati)
+        with open(percorso_base, "w", encoding="utf-8") as f:
+            json.dump({"ambiente": ambiente(), "corpus": parametri, "risultati": precedenti}, f, indent=2)
+        print(f"Base salvata in {percorso_base}")
+    elif regressioni:
+        print(f"Regressioni oltre il {opzioni.soglia:.0%}: {', '.join(regressioni)}")
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""
+Cache condivisa delle mosse legali, indicizzata per hash Zobrist della posizione.
+
+Per ogni posizione la TabellaMosse raccoglie le mosse legali una sola volta,
+raggruppate per casella di partenza: le richieste MOVES| (una per ogni tocco di
+un pezzo) e la validazione delle mosse la consultano senza rigenerare
+scacchiera.legal_moves. La cache è un LRU limitato e condiviso tra tutte le
+sessioni, così le posizioni d'apertura più comuni non vengono mai ricalcolate.
+"""
+
+import collections
+import threading
+
+import chess
+import chess.polyglot
+
+CAPACITA_PREDEFINITA = 10_000  # posizioni tenute in memoria (qualche KB ciascuna)
+
+_zobrist = chess.polyglot.ZobristHasher(chess.polyglot.POLYGLOT_RANDOM_ARRAY)
+
+
+def chiave_posizione(scacchiera: chess.Board) -> int:
+    """
+    Hash Zobrist della posizione, con la casella en passant solo se la presa è legale
+    (Polyglot la include anche se il pedone è inchiodato). Due posizioni hanno la
+    stessa chiave quando python-chess le considera la stessa posizione per le
+    ripetizioni, e quindi anche le stesse mosse legali.
+    """
+    valore = _zobrist(scacchiera)
+    if scacchiera.ep_square is not None and not scacchiera.has_legal_en_passant():
+        valore ^= _zobrist.hash_ep_square(scacchiera)
+    return valore
+
+
+class TabellaMosse:
+    """Mosse legali di una posizione, indicizzate per casella di partenza."""
+
+    __slots__ = ("mosse", "per_casella")
+
+    def __init__(self, scacchiera: chess.Board):
+        per_casella = {}
+        for mossa in scacchiera.legal_moves:
+            per_casella.setdefault(mossa.from_square, []).append(mossa)
+        self.per_casella = {casella: tuple(mosse) for casella, mosse in per_casella.items()}
+        self.mosse = frozenset(mossa for mosse in self.per_casella.values() for mossa in mosse)
+
+    def da_casella(self, casella) -> tuple:
+        return self.per_casella.get(casella, ())
+
+
+class CacheMosse:
+    def __init__(self, capacita=CAPACITA_PREDEFINITA):
+        self._capacita = capacita
+        self._tabelle = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.hit = 0
+        self.miss = 0
+
+    def tabella(self, scacchiera: chess.Board, chiave=None) -> TabellaMosse:
+        """
+        Ritorna la TabellaMosse della posizione. `chiave` è chiave_posizione() se già
+        nota al chiamante (es. Sessione.chiave), altrimenti viene calcolata qui.
+        """
+        if chiave is None:
+            chiave = chiave_posizione(scacchiera)
+        with self._lock:
+            tabella = self._tabelle.get(chiave)
+            if tabella is not None:
+                self._tabelle.move_to_end(chiave)
+                self.hit += 1
+                return tabella
+            self.miss += 1
+
+        # Generazione fuori dal lock: le altre sessioni non aspettano
+        tabella = TabellaMosse(scacchiera)
+        with self._lock:
+            self._tabelle[chiave] = tabella
+            if len(self._tabelle) > self._capacita:
+                self._tabelle.popitem(last=False)
+        return tabella
+
+    def statistiche(self) -> dict:
+        with self._lock:
+            return {"hit": self.hit, "miss": self.miss, "posizioni": len(self._tabelle)}
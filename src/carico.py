@@ -0,0 +1,377 @@
+"""
+Generatore di carico: N bot senza interfaccia che parlano lo stesso protocollo del
+client (main.py) per misurare la capacità del server prima di un torneo.
+
+Ogni bot si presenta con "nickname|secondi" (più "|BIN1" con --binario), passa dal
+matchmaking del server, saluta in chat e gioca: prima di ogni mossa chiede le mosse
+del pezzo con "MOVES|casella", poi invia la mossa UCI. Le mosse sono casuali oppure
+prese da un file di partite (--partite, una partita per riga in UCI separate da
+spazi). Un bot gioca partite una dopo l'altra fino alla fine del test; oltre
+--mosse-max semimosse abbandona con "RESIGN|".
+
+Misure riportate:
+- latenza di inoltro di una mossa (dall'invio del bot che muove alla ricezione
+  dell'avversario, entrambi in questo processo) con p50/p95/p99;
+- tempo di matchmaking (dall'handshake a START|) e latenza delle risposte a MOVES|;
+- mosse e partite al secondo;
+- RSS e thread del processo server (da /proc, solo Linux), il massimo osservato.
+
+Uso (server già avviato):
+    python carico.py --bot 200 --modalita 0,60,180,300,600,1200 --ritmo 0.5 --durata 60
+Oppure avviando qui un server headless da misurare:
+    python carico.py --avvia-server --modalita-server asyncio --bot 1000
+"""
+
+import argparse
+import asyncio
+import collections
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+
+import chess
+
+import protocollo
+
+INDIRIZZO = "127.0.0.1"
+PORTA = 5000
+MODALITA = (0, 60, 180, 300, 600, 1200)
+ATTESA_MOVES = 5.0  # secondi massimi di attesa della risposta a MOVES|
+
+
+def percentile(valori, p):
+    """Percentile p (0-100) con il metodo del rango più vicino; None senza valori."""
+    if not valori:
+        return None
+    ordinati = sorted(valori)
+    indice = max(0, min(len(ordinati) - 1, round(p / 100 * len(ordinati)) - 1))
+    return ordinati[indice]
+
+
+def carica_partite(percorso):
+    """Partite scriptate: una per riga, mosse UCI separate da spazi (righe vuote e # ignorate)."""
+    partite = []
+    with open(percorso, encoding="utf-8") as f:
+        for riga in f:
+            riga = riga.strip()
+            if riga and not riga.startswith("#"):
+                partite.append(riga.split())
+    return partite
+
+
+class Risultati:
+    """Misure raccolte da tutti i bot (un solo event loop: nessun lock)."""
+
+    def __init__(self):
+        self.inoltro = []  # secondi, per mossa
+        self.matchmaking = []  # secondi, per partita
+        self.moves = []  # secondi, per risposta a MOVES|
+        self.mosse = 0
+        self.fini = 0  # partite concluse viste da un bot (due per partita)
+        self.esiti = collections.Counter()
+        self.errori = collections.Counter()
+        self.rss_massimo = None  # kB
+        self.thread_massimi = None
+        # (nickname, semimossa) -> perf_counter() dell'invio, consumato dall'avversario
+        self.invii = {}
+
+    def riepilogo(self, durata):
+        def statistiche(valori):
+            return {
+                "n": len(valori),
+                "p50_ms": _ms(percentile(valori, 50)),
+                "p95_ms": _ms(percentile(valori, 95)),
+                "p99_ms": _ms(percentile(valori, 99)),
+                "max_ms": _ms(max(valori) if valori else None),
+            }
+
+        return {
+            "durata_s": round(durata, 2),
+            "inoltro_mosse": statistiche(self.inoltro),
+            "matchmaking": statistiche(self.matchmaking),
+            "risposte_moves": statistiche(self.moves),
+            "mosse_al_secondo": round(self.mosse / durata, 1) if durata else 0,
+            "partite_al_secondo": round(self.fini / 2 / durata, 2) if durata else 0,
+            "partite_finite": self.fini // 2,
+            "esiti": dict(self.esiti),
+            "errori": dict(self.errori),
+            "rss_server_kb": self.rss_massimo,
+            "thread_server": self.thread_massimi,
+        }
+
+
+def _ms(secondi):
+    return None if secondi is None else round(secondi * 1000, 3)
+
+
+class Bot:
+    def __init__(self, nickname, durata, opzioni, risultati, partite):
+        self.nickname = nickname
+        self.durata = durata
+        self.opzioni = opzioni
+        self.risultati = risultati
+        self.partite = partite
+        self.writer = None
+        self.scacchiera = None
+        self.colore = None
+        self.avversario = None
+        self.risposta_moves = None
+        self.turno = None
+        self.abbandono = False
+
+    async def esegui(self, scadenza):
+        """Gioca partite una dopo l'altra fino alla scadenza (almeno una)."""
+        while True:
+            try:
+                await self.partita()
+            except (OSError, asyncio.IncompleteReadError) as errore:
+                self.risultati.errori[type(errore).__name__] += 1
+                await asyncio.sleep(1)
+            if time.monotonic() >= scadenza:
+                return
+
+    async def partita(self):
+        opzioni = self.opzioni
+        reader, self.writer = await asyncio.open_connection(opzioni.host, opzioni.port)
+        self.scacchiera = chess.Board()
+        self.colore = None
+        self.avversario = None
+        self.abbandono = False
+        inizio = time.perf_counter()
+        handshake = f"{self.nickname}|{self.durata}"
+        if opzioni.binario:
+            handshake += f"|{protocollo.CAPACITA_BINARIA}"
+        self.invia(handshake)
+        try:
+            async for messaggio in protocollo.leggi_messaggi_async(reader):
+                if isinstance(messaggio, chess.Move):
+                    self.ricevi_mossa(messaggio)
+                elif isinstance(messaggio, protocollo.TempoBinario):
+                    continue
+                elif messaggio.startswith("START|"):
+                    self.risultati.matchmaking.append(time.perf_counter() - inizio)
+                    self.colore = chess.WHITE if messaggio.split("|")[1] == "WHITE" else chess.BLACK
+                    # Il saluto rivela all'avversario il nostro nickname (CHAT|nick|testo)
+                    self.invia("CHAT|ciao")
+                    if self.colore == chess.WHITE:
+                        self.avvia_turno()
+                elif messaggio.startswith("CHAT|"):
+                    mittente = messaggio.split("|")[1]
+                    if mittente != self.nickname:
+                        self.avversario = mittente
+                elif messaggio.startswith("MOVES|"):
+                    if self.risposta_moves is not None and not self.risposta_moves.done():
+                        self.risposta_moves.set_result(None)
+                elif messaggio.startswith("GAMEOVER|"):
+                    self.fine(messaggio.split("|")[1])
+                    break
+                elif messaggio.startswith("ERROR|"):
+                    self.risultati.errori[messaggio[6:]] += 1
+                elif messaggio.startswith(("TIME|", "PROTO|", "OPPONENT|", "TIMEOUT|")):
+                    continue
+                elif "|" not in messaggio:
+                    self.ricevi_mossa(chess.Move.from_uci(messaggio))
+            else:
+                # Dopo RESIGN| il server chiude la connessione senza GAMEOVER
+                if self.abbandono:
+                    self.fine("RESIGN")
+                else:
+                    self.risultati.errori["connessione chiusa dal server"] += 1
+        finally:
+            if self.turno is not None:
+                self.turno.cancel()
+                self.turno = None
+            self.writer.close()
+
+    def fine(self, esito):
+        self.risultati.esiti[esito] += 1
+        self.risultati.fini += 1
+
+    def invia(self, testo):
+        self.writer.write(protocollo.codifica(testo))
+
+    def ricevi_mossa(self, mossa):
+        semimossa = len(self.scacchiera.move_stack)
+        inviata = self.risultati.invii.pop((self.avversario, semimossa), None)
+        if inviata is not None:
+            self.risultati.inoltro.append(time.perf_counter() - inviata)
+        self.risultati.mosse += 1
+        self.scacchiera.push(mossa)
+        if not self.scacchiera.is_game_over():
+            self.avvia_turno()
+
+    def avvia_turno(self):
+        self.turno = asyncio.ensure_future(self.muovi())
+
+    def scegli_mossa(self):
+        giocate = [mossa.uci() for mossa in self.scacchiera.move_stack]
+        n = len(giocate)
+        for partita in self.partite:
+            if len(partita) > n and partita[:n] == giocate:
+                mossa = chess.Move.from_uci(partita[n])
+                if self.scacchiera.is_legal(mossa):
+                    return mossa
+        return random.choice(list(self.scacchiera.legal_moves))
+
+    async def muovi(self):
+        opzioni = self.opzioni
+        await asyncio.sleep(random.uniform(0.5, 1.5) * opzioni.ritmo)
+        scacchiera = self.scacchiera
+        semimossa = len(scacchiera.move_stack)
+        if semimossa >= opzioni.mosse_max:
+            self.abbandono = True
+            self.invia("RESIGN|")
+            return
+        mossa = self.scegli_mossa()
+        if opzioni.chat and random.random() < opzioni.chat:
+            self.invia(f"CHAT|mossa {semimossa + 1}")
+        # Come il client: prima la selezione del pezzo, poi la mossa
+        self.risposta_moves = asyncio.get_running_loop().create_future()
+        richiesta = time.perf_counter()
+        self.invia(f"MOVES|{chess.square_name(mossa.from_square)}")
+        try:
+            await asyncio.wait_for(self.risposta_moves, ATTESA_MOVES)
+            self.risultati.moves.append(time.perf_counter() - richiesta)
+        except asyncio.TimeoutError:
+            self.risultati.errori["MOVES| senza risposta"] += 1
+        self.risultati.invii[(self.nickname, semimossa)] = time.perf_counter()
+        if opzioni.binario:
+            self.writer.write(protocollo.codifica_mossa(mossa))
+        else:
+            self.invia(mossa.uci())
+        scacchiera.push(mossa)
+
+
+def leggi_processo(pid):
+    """(RSS in kB, thread) del processo da /proc, o (None, None) se non disponibile."""
+    rss = thread = None
+    try:
+        with open(f"/proc/{pid}/status", encoding="ascii") as f:
+            for riga in f:
+                if riga.startswith("VmRSS:"):
+                    rss = int(riga.split()[1])
+                elif riga.startswith("Threads:"):
+                    thread = int(riga.split()[1])
+    except (OSError, ValueError):
+        pass
+    return rss, thread
+
+
+async def campiona_server(pid, risultati):
+    while True:
+        rss, thread = leggi_processo(pid)
+        if rss is not None:
+            risultati.rss_massimo = max(rss, risultati.rss_massimo or 0)
+        if thread is not None:
+            risultati.thread_massimi = max(thread, risultati.thread_massimi or 0)
+        await asyncio.sleep(0.5)
+
+
+async def esegui_carico(opzioni, risultati, partite):
+    modalita = [int(m) for m in opzioni.modalita.split(",")]
+    inizio = time.monotonic()
+    scadenza = inizio + opzioni.durata
+    campionatore = None
+    if opzioni.pid:
+        campionatore = asyncio.ensure_future(campiona_server(opzioni.pid, risultati))
+    bot = []
+    for i in range(opzioni.bot):
+        # Bot consecutivi nella stessa modalità, così si accoppiano tra loro
+        durata = modalita[(i // 2) % len(modalita)]
+        bot.append(Bot(f"bot{i}", durata, opzioni, risultati, partite))
+    compiti = []
+    for i, b in enumerate(bot):
+        compiti.append(asyncio.ensure_future(b.esegui(scadenza)))
+        if opzioni.rampa:
+            await asyncio.sleep(opzioni.rampa / opzioni.bot)
+    # Margine per chiudere le partite in corso alla scadenza
+    _, pendenti = await asyncio.wait(compiti, timeout=opzioni.durata + opzioni.attesa_finale)
+    for compito in pendenti:
+        compito.cancel()
+    if pendenti:
+        risultati.errori["partite non concluse"] += len(pendenti)
+    if campionatore is not None:
+        campionatore.cancel()
+    return time.monotonic() - inizio
+
+
+def stampa(riepilogo):
+    print(f"Durata: {riepilogo['durata_s']} s")
+    for chiave, titolo in (("inoltro_mosse", "Inoltro mosse"), ("matchmaking", "Matchmaking"),
+                           ("risposte_moves", "Risposte MOVES|")):
+        s = riepilogo[chiave]
+        print(f"{titolo:<16} n={s['n']:<7} p50={s['p50_ms']} ms  p95={s['p95_ms']} ms  "
+              f"p99={s['p99_ms']} ms  max={s['max_ms']} ms")
+    print(f"Throughput: {riepilogo['mosse_al_secondo']} mosse/s, "
+          f"{riepilogo['partite_al_secondo']} partite/s ({riepilogo['partite_finite']} finite)")
+    print(f"Esiti: {riepilogo['esiti']}")
+    if riepilogo["errori"]:
+        print(f"Errori: {riepilogo['errori']}")
+    rss = riepilogo["rss_server_kb"]
+    print(f"Server: RSS massimo {'n/d' if rss is None else f'{rss / 1024:.1f} MB'}, "
+          f"thread massimi {riepilogo['thread_server'] or 'n/d'}")
+
+
+def avvia_server(host, porta, modalita, *altri_argomenti):
+    """Server headless in un sottoprocesso, senza archivio né giornale (usato anche da riproduci.py)."""
+    comando = [
+        sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "server.py"),
+        "--headless", "--host", host, "--port", str(porta),
+        "--modalita", modalita, "--senza-archivio", "--senza-giornale", *altri_argomenti,
+    ]
+    processo = subprocess.Popen(comando, stdout=subprocess.DEVNULL)
+    time.sleep(1.0)  # tempo per l'import di chess e il bind
+    return processo
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Generatore di carico Thread-Chess")
+    parser.add_argument("--host", default=INDIRIZZO)
+    parser.add_argument("--port", type=int, default=PORTA)
+    parser.add_argument("--bot", type=int, default=100, help="bot connessi insieme (pari)")
+    parser.add_argument("--modalita", default=",".join(str(m) for m in MODALITA),
+                        help="durate in secondi, separate da virgola, assegnate a coppie di bot")
+    parser.add_argument("--ritmo", type=float, default=0.5, help="secondi medi di riflessione per mossa")
+    parser.add_argument("--durata", type=float, default=60, help="secondi di test (0 = una partita per bot)")
+    parser.add_argument("--rampa", type=float, default=0, help="secondi in cui distribuire le connessioni")
+    parser.add_argument("--mosse-max", type=int, default=80, help="semimosse prima dell'abbandono")
+    parser.add_argument("--chat", type=float, default=0.1, help="probabilità di un messaggio di chat per mossa")
+    parser.add_argument("--binario", action="store_true", help="negozia il protocollo binario (BIN1)")
+    parser.add_argument("--partite", help="file di partite scriptate (UCI, una per riga)")
+    parser.add_argument("--seme", type=int, help="seme per le mosse casuali")
+    parser.add_argument("--pid", type=int, help="pid del server di cui misurare RSS e thread")
+    parser.add_argument("--avvia-server", action="store_true", help="avvia un server headless da misurare")
+    parser.add_argument("--modalita-server", choices=("thread", "asyncio"), default="thread")
+    parser.add_argument("--attesa-finale", type=float, default=120,
+                        help="secondi concessi alle partite in corso dopo la durata")
+    parser.add_argument("--json", help="salva il riepilogo in questo file")
+    opzioni = parser.parse_args()
+
+    if opzioni.seme is not None:
+        random.seed(opzioni.seme)
+    partite = carica_partite(opzioni.partite) if opzioni.partite else []
+
+    processo = None
+    if opzioni.avvia_server:
+        processo = avvia_server(opzioni.host, opzioni.port, opzioni.modalita_server)
+        opzioni.pid = processo.pid
+    risultati = Risultati()
+    try:
+        durata = asyncio.run(esegui_carico(opzioni, risultati, partite))
+    finally:
+        if processo is not None:
+            processo.terminate()
+            processo.wait()
+
+    riepilogo = risultati.riepilogo(durata)
+    stampa(riepilogo)
+    if opzioni.json:
+        with open(opzioni.json, "w", encoding="utf-8") as f:
+            json.dump(riepilogo, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
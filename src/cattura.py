@@ -0,0 +1,164 @@
+"""
+Cattura del traffico dei giocatori, da riprodurre con riproduci.py.
+
+Con --cattura PERCORSO (o CATTURA_TRAFFICO=PERCORSO) il server registra per ogni
+connessione l'apertura, i messaggi ricevuti e inviati e la chiusura, ciascuno con
+l'istante in microsecondi dall'avvio della cattura. Come nel giornale, i thread di
+gioco fanno solo una put() su una coda: formattazione e scrittura avvengono in un
+thread dedicato, a blocchi.
+
+Formato (una riga per evento, campi separati da tab, i dati sono l'ultimo campo):
+  microsecondi  connessione  tipo  dati
+tipi: A apertura (dati: indirizzo del client), < messaggio ricevuto,
+      > messaggio inviato, F fine della lettura (il client ha chiuso o la
+      connessione è caduta), C chiusura da parte del server,
+      S accoppiamento del matchmaking (sulla connessione del Bianco,
+      dati: id_sessione|connessione del Nero).
+I record binari (protocollo BIN1) sono scritti come "~" seguito dai byte in
+esadecimale. Un PERCORSO che termina in .gz viene compresso con gzip.
+Gli spettatori scrivono direttamente sul socket: di loro resta solo il WATCH|.
+"""
+
+import gzip
+import itertools
+import queue
+import threading
+import time
+
+import chess
+
+import protocollo
+
+INTERVALLO_SCRITTURA = 0.1  # secondi di eventi raccolti in una sola scrittura
+INTESTAZIONE = "# cattura Thread-Chess v1"
+
+APERTURA = "A"
+RICEVUTO = "<"
+INVIATO = ">"
+FINE_CLIENT = "F"
+CHIUSURA = "C"
+ACCOPPIAMENTO = "S"
+
+
+def testo_evento(dati) -> str:
+    """Forma testuale di un messaggio ricevuto (str o chess.Move) o inviato (bytes)."""
+    if isinstance(dati, str):
+        return dati
+    if isinstance(dati, chess.Move):
+        return "~" + protocollo.codifica_mossa(dati).hex()
+    dati = bytes(dati)
+    if dati and dati[0] >= 0x80:
+        return "~" + dati.hex()
+    return dati.decode("utf-8", "replace").rstrip("\n")
+
+
+def apri_file(percorso, modo):
+    percorso = str(percorso)
+    if percorso.endswith(".gz"):
+        return gzip.open(percorso, modo + "t", encoding="utf-8")
+    return open(percorso, modo, encoding="utf-8")
+
+
+class Canale:
+    """Registrazione degli eventi di una singola connessione."""
+
+    __slots__ = ("cattura", "id")
+
+    def __init__(self, cattura, id_connessione):
+        self.cattura = cattura
+        self.id = id_connessione
+
+    def ricevuto(self, messaggio):
+        self.cattura.registra(self.id, RICEVUTO, messaggio)
+
+    def inviato(self, dati):
+        self.cattura.registra(self.id, INVIATO, dati)
+
+    def chiuso(self):
+        self.cattura.registra(self.id, CHIUSURA, "")
+
+    def ingresso(self, messaggi):
+        """Avvolge il generatore dei messaggi ricevuti registrandoli, fino alla fine della lettura."""
+        try:
+            for messaggio in messaggi:
+                self.ricevuto(messaggio)
+                yield messaggio
+        except OSError:
+            self.cattura.registra(self.id, FINE_CLIENT, "")
+            raise
+        self.cattura.registra(self.id, FINE_CLIENT, "")
+
+    async def ingresso_async(self, messaggi):
+        try:
+            async for messaggio in messaggi:
+                self.ricevuto(messaggio)
+                yield messaggio
+        except OSError:
+            self.cattura.registra(self.id, FINE_CLIENT, "")
+            raise
+        self.cattura.registra(self.id, FINE_CLIENT, "")
+
+
+class Cattura:
+    def __init__(self, percorso, intervallo=INTERVALLO_SCRITTURA):
+        self.percorso = percorso
+        self.intervallo = intervallo
+        self._file = apri_file(percorso, "w")
+        self._file.write(f"{INTESTAZIONE} {time.strftime('%Y-%m-%dT%H:%M:%S')}\n")
+        self._coda = queue.SimpleQueue()
+        self._id = itertools.count(1)
+        self._inizio = time.perf_counter_ns()
+        self.eventi = 0
+        threading.Thread(target=self._ciclo, name="cattura", daemon=True).start()
+
+    def canale(self, indirizzo) -> Canale:
+        canale = Canale(self, next(self._id))
+        self.registra(canale.id, APERTURA, str(indirizzo[0]) if isinstance(indirizzo, tuple) else str(indirizzo))
+        return canale
+
+    def accoppiamento(self, sessione, connessione_bianco, connessione_nero):
+        """Chi ha giocato con chi: la riproduzione rifà gli stessi accoppiamenti."""
+        canale_bianco = getattr(connessione_bianco, "cattura", None)
+        canale_nero = getattr(connessione_nero, "cattura", None)
+        if canale_bianco is not None and canale_nero is not None:
+            self.registra(canale_bianco.id, ACCOPPIAMENTO, f"{sessione.id}|{canale_nero.id}")
+
+    def registra(self, id_connessione, tipo, dati):
+        self._coda.put((time.perf_counter_ns(), id_connessione, tipo, dati))
+
+    def _ciclo(self):
+        while True:
+            blocco = [self._coda.get()]
+            time.sleep(self.intervallo)
+            try:
+                while True:
+                    blocco.append(self._coda.get_nowait())
+            except queue.Empty:
+                pass
+            righe = []
+            for istante, id_connessione, tipo, dati in blocco:
+                microsecondi = (istante - self._inizio) // 1000
+                righe.append(f"{microsecondi}\t{id_connessione}\t{tipo}\t{testo_evento(dati)}\n")
+            try:
+                self._file.write("".join(righe))
+                self._file.flush()
+                self.eventi += len(righe)
+            except (OSError, ValueError) as errore:
+                print(f"Errore cattura traffico: {errore}")
+
+
+def leggi(percorso) -> list:
+    """Eventi di una cattura: tuple (microsecondi, connessione, tipo, dati), in ordine."""
+    eventi = []
+    with apri_file(percorso, "r") as f:
+        try:
+            for riga in f:
+                if riga.startswith("#"):
+                    continue
+                campi = riga.rstrip("\n").split("\t", 3)
+                if len(campi) != 4:
+                    continue  # riga troncata (es. server terminato durante la scrittura)
+                eventi.append((int(campi[0]), int(campi[1]), campi[2], campi[3]))
+        except EOFError:
+            pass  # file gzip non chiuso: si tengono gli eventi già letti
+    return eventi
@@ -0,0 +1,90 @@
+"""
+Bus degli eventi del server, fuori dal percorso caldo delle partite.
+
+Il thread che inoltra una mossa si limita a pubblicare l'evento su una coda
+limitata; un unico thread consumatore lo consegna agli iscritti (pannello admin,
+log...), che possono quindi essere lenti senza ritardare i giocatori.
+Se la coda è piena l'evento viene scartato e contato: la partita non aspetta mai
+gli iscritti.
+L'archivio PGN, che non può perdere partite, non passa dal bus: il server lo
+chiama direttamente (vedi archivio.py).
+
+Eventi pubblicati dal server (nome -> argomenti):
+  sessione_iniziata  (sessione)
+  mossa              (sessione, nickname, mossa_uci)
+  chat               (sessione, mittente, messaggio)
+  partita_finita     (sessione, risultato, terminazione)
+  sessione_chiusa    (sessione, testo)
+  ban                (sessione, nickname_bannato)
+  limite             (sessione, nickname, tipo_messaggio, disconnesso)
+  avviso             (testo)
+"""
+
+import queue
+import threading
+
+CAPACITA_CODA = 10_000  # eventi in attesa prima di iniziare a scartare
+
+
+class BusEventi:
+    def __init__(self, capacita=CAPACITA_CODA):
+        self._coda = queue.Queue(capacita)
+        self._iscritti = []
+        self._lock = threading.Lock()
+        self._thread = None
+        self.scartati = 0
+
+    def iscrivi(self, iscritto):
+        """
+        Aggiunge un iscritto: per ogni evento viene chiamato, se esiste, il suo
+        metodo con lo stesso nome. Il consumatore parte al primo iscritto.
+        """
+        with self._lock:
+            self._iscritti = self._iscritti + [iscritto]
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._ciclo, name="bus-eventi", daemon=True)
+                self._thread.start()
+
+    def pubblica(self, evento, *argomenti):
+        """Accoda un evento senza mai bloccare; senza iscritti non costa nulla."""
+        if not self._iscritti:
+            return
+        try:
+            self._coda.put_nowait((evento, argomenti))
+        except queue.Full:
+            self.scartati += 1
+
+    def in_coda(self) -> int:
+        return self._coda.qsize()
+
+    def _ciclo(self):
+        while True:
+            evento, argomenti = self._coda.get()
+            for iscritto in self._iscritti:
+                gestore = getattr(iscritto, evento, None)
+                if gestore is None:
+                    continue
+                try:
+                    gestore(*argomenti)
+                except Exception as errore:
+                    print(f"Errore iscritto ({evento}): {errore}")
+
+
+class LogConsole:
+    """Iscritto che scrive su console gli eventi di gioco."""
+
+    def mossa(self, sessione, nickname, mossa):
+        print(f"Mossa valida {mossa} da {nickname} (sessione #{sessione.id})")
+
+    def partita_finita(self, sessione, risultato, terminazione):
+        print(f"Partita finita (sessione #{sessione.id}): {risultato} ({terminazione})")
+
+    def ban(self, sessione, nickname):
+        print(f"BAN: {nickname} (sessione #{sessione.id})")
+
+    def limite(self, sessione, nickname, tipo, disconnesso):
+        if disconnesso:
+            print(f"FLOOD: {nickname} disconnesso per troppi messaggi {tipo} (sessione #{sessione.id})")
+
+    def avviso(self, testo):
+        print(testo)
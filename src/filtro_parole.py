@@ -0,0 +1,155 @@
+"""
+Filtro delle parole vietate condiviso da client (main.py) e server (server.py).
+
+Le parole di bad_words.txt vengono compilate in un automa di Aho-Corasick, che
+trova tutte le occorrenze in una sola passata sul testo: il costo per nickname o
+messaggio di chat dipende dalla lunghezza del testo e non dal numero di parole,
+quindi l'elenco può crescere fino a migliaia di voci.
+
+Il FiltroParole controlla (al massimo una volta ogni INTERVALLO_CONTROLLO) la data
+di modifica del file e, se è cambiata, compila un nuovo automa e lo sostituisce
+con un solo assegnamento: chi sta filtrando usa fino in fondo quello vecchio.
+"""
+
+import os
+import threading
+import time
+
+INTERVALLO_CONTROLLO = 1.0  # secondi tra due controlli della data di modifica del file
+
+# Usate se il file manca, non è leggibile o è vuoto
+PAROLE_PREDEFINITE = (
+    "cazzo",
+    "merda",
+    "stronzo",
+    "vaffanculo",
+)
+
+
+def leggi_parole(percorso) -> list:
+    """Una parola per riga, senza righe vuote e commenti (#); [] se il file non è leggibile."""
+    parole = []
+    try:
+        with open(percorso, "r", encoding="utf-8") as f:
+            for riga in f:
+                riga = riga.strip().lower()
+                if riga and not riga.startswith("#"):
+                    parole.append(riga)
+    except OSError:
+        return []
+    return parole
+
+
+def _minuscolo(testo: str) -> str:
+    """Minuscolo carattere per carattere, così le posizioni restano quelle di testo."""
+    minuscolo = testo.lower()
+    if len(minuscolo) != len(testo):
+        # Alcuni caratteri (es. "İ") diventano due in minuscolo
+        minuscolo = "".join(c.lower()[:1] for c in testo)
+    return minuscolo
+
+
+class Automa:
+    """Automa di Aho-Corasick (minuscolo) su un insieme di parole."""
+
+    __slots__ = ("_figli", "_fallimento", "_uscita")
+
+    def __init__(self, parole):
+        self._figli = [{}]  # stato -> {carattere: stato}
+        self._uscita = [0]  # stato -> lunghezza della parola più lunga che termina qui (0 = nessuna)
+        for parola in parole:
+            stato = 0
+            for carattere in parola.lower():
+                prossimo = self._figli[stato].get(carattere)
+                if prossimo is None:
+                    prossimo = len(self._figli)
+                    self._figli[stato][carattere] = prossimo
+                    self._figli.append({})
+                    self._uscita.append(0)
+                stato = prossimo
+            if parola:
+                self._uscita[stato] = max(self._uscita[stato], len(parola))
+
+        # Collegamenti di fallimento in ampiezza: ogni stato eredita l'uscita del suo suffisso
+        self._fallimento = [0] * len(self._figli)
+        coda = list(self._figli[0].values())
+        for stato in coda:
+            for carattere, figlio in self._figli[stato].items():
+                ripiego = self._fallimento[stato]
+                while ripiego and carattere not in self._figli[ripiego]:
+                    ripiego = self._fallimento[ripiego]
+                self._fallimento[figlio] = self._figli[ripiego].get(carattere, 0)
+                self._uscita[figlio] = max(self._uscita[figlio], self._uscita[self._fallimento[figlio]])
+                coda.append(figlio)
+
+    def _scorri(self, testo):
+        """Per ogni posizione di fine di una parola vietata: (fine, lunghezza)."""
+        figli, fallimento, uscita = self._figli, self._fallimento, self._uscita
+        stato = 0
+        for indice, carattere in enumerate(_minuscolo(testo)):
+            while stato and carattere not in figli[stato]:
+                stato = fallimento[stato]
+            stato = figli[stato].get(carattere, 0)
+            if uscita[stato]:
+                yield indice + 1, uscita[stato]
+
+    def contiene(self, testo: str) -> bool:
+        for _ in self._scorri(testo):
+            return True
+        return False
+
+    def censura(self, testo: str, simbolo="*") -> str:
+        """Testo con le parole vietate sostituite da simboli della stessa lunghezza."""
+        caratteri = None
+        for fine, lunghezza in self._scorri(testo):
+            if caratteri is None:
+                caratteri = list(testo)
+            caratteri[fine - lunghezza:fine] = simbolo * lunghezza
+        return testo if caratteri is None else "".join(caratteri)
+
+
+class FiltroParole:
+    """Automa sulle parole di un file, ricompilato quando il file cambia."""
+
+    def __init__(self, percorso, intervallo=INTERVALLO_CONTROLLO):
+        self.percorso = percorso
+        self.intervallo = intervallo
+        self._lock = threading.Lock()
+        self._data_modifica = None
+        self._ultimo_controllo = 0.0
+        self._automa = None
+        self.ricarica()
+
+    def ricarica(self):
+        """Compila l'automa dal file (o dalle parole predefinite) e lo rende attivo."""
+        try:
+            data_modifica = os.stat(self.percorso).st_mtime_ns
+        except OSError:
+            data_modifica = None
+        parole = leggi_parole(self.percorso) if data_modifica is not None else []
+        automa = Automa(parole or PAROLE_PREDEFINITE)
+        # Un solo assegnamento: i thread che filtrano vedono il vecchio o il nuovo automa
+        self._automa = automa
+        self._data_modifica = data_modifica
+
+    def automa(self) -> Automa:
+        adesso = time.monotonic()
+        if adesso - self._ultimo_controllo >= self.intervallo and self._lock.acquire(blocking=False):
+            # Un solo thread controlla il file, gli altri continuano con l'automa attuale
+            try:
+                self._ultimo_controllo = adesso
+                try:
+                    data_modifica = os.stat(self.percorso).st_mtime_ns
+                except OSError:
+                    data_modifica = None
+                if data_modifica != self._data_modifica:
+                    self.ricarica()
+            finally:
+                self._lock.release()
+        return self._automa
+
+    def contiene(self, testo: str) -> bool:
+        return self.automa().contiene(testo)
+
+    def censura(self, testo: str) -> str:
+        return self.automa().censura(testo)
@@ -0,0 +1,169 @@
+"""
+Giornale delle partite in corso (write-ahead log) per il ripristino dopo un crash.
+
+Ogni inizio partita, mossa (con gli orologi) e fine partita viene accodato come
+riga di testo prima di inoltrare la mossa all'avversario; un thread di scrittura
+raccoglie le righe arrivate nell'ultimo INTERVALLO_COMMIT e le rende persistenti
+con un solo fsync (group commit), così il costo per mossa resta quello di una
+put() su una coda.
+
+La mossa viene inoltrata senza aspettare il suo fsync: è persistente entro un
+INTERVALLO_COMMIT. Se il server cade in quella finestra l'ultima mossa può andare
+persa anche se l'avversario l'ha già vista; alla ripresa il server invia le mosse
+dall'ultima salvata (RESUME|da|...) e i client tornano indietro fino a lì.
+
+Formato delle righe (campi separati da "|", i nickname non contengono "|"):
+  S|id|durata|nick_bianco|nick_nero|token_bianco|token_nero
+  M|id|semimossa|uci|ms_bianco|ms_nero
+  F|id
+
+Le righe sono idempotenti (una M già applicata o di una sessione sconosciuta viene
+ignorata), quindi la compattazione può riscrivere il file con le sole partite
+ancora aperte senza coordinarsi con le righe ancora in coda.
+"""
+
+import os
+import pathlib
+import queue
+import threading
+import time
+
+INTERVALLO_COMMIT = 0.05  # secondi di righe raccolte in un solo fsync
+SOGLIA_COMPATTAZIONE = 500  # partite finite dopo cui il file viene compattato
+
+
+class PartitaSalvata:
+    """Stato di una partita non conclusa ricostruito dal giornale."""
+
+    __slots__ = ("id", "durata", "nickname", "token", "mosse", "ms_bianco", "ms_nero")
+
+    def __init__(self, id_sessione, durata, nickname, token):
+        self.id = id_sessione
+        self.durata = durata
+        self.nickname = nickname
+        self.token = token
+        self.mosse = []
+        self.ms_bianco = durata * 1000
+        self.ms_nero = durata * 1000
+
+
+def righe_sessione(sessione) -> list:
+    """Righe che descrivono per intero una sessione iniziata (usate nella compattazione)."""
+    ms_bianco = int(sessione.tempo_bianco * 1000)
+    ms_nero = int(sessione.tempo_nero * 1000)
+    righe = [
+        f"S|{sessione.id}|{sessione.durata}|{sessione.giocatori[0][1]}|{sessione.giocatori[1][1]}"
+        f"|{sessione.token[0]}|{sessione.token[1]}\n"
+    ]
+    for ply, mossa in enumerate(sessione.scacchiera.move_stack, 1):
+        righe.append(f"M|{sessione.id}|{ply}|{mossa.uci()}|{ms_bianco}|{ms_nero}\n")
+    return righe
+
+
+class GiornaleMosse:
+    def __init__(self, percorso, intervallo=INTERVALLO_COMMIT, soglia_compattazione=SOGLIA_COMPATTAZIONE):
+        self.percorso = pathlib.Path(percorso)
+        self.percorso.parent.mkdir(parents=True, exist_ok=True)
+        self.intervallo = intervallo
+        self.soglia_compattazione = soglia_compattazione
+        self._coda = queue.Queue()
+        self._file = None
+        self._sessioni_attive = None
+        self._finite = 0  # partite finite dall'ultima compattazione
+        self.commit = 0
+
+    # --- Ripristino ---
+
+    def leggi(self) -> list:
+        """Partite non concluse presenti nel giornale, in ordine di inizio."""
+        partite = {}
+        try:
+            righe = self.percorso.read_text(encoding="utf-8").splitlines()
+        except FileNotFoundError:
+            return []
+        for riga in righe:
+            campi = riga.split("|")
+            try:
+                tipo, id_sessione = campi[0], int(campi[1])
+                if tipo == "S" and id_sessione not in partite and len(campi) == 7:
+                    partite[id_sessione] = PartitaSalvata(
+                        id_sessione, int(campi[2]), (campi[3], campi[4]), (campi[5], campi[6])
+                    )
+                elif tipo == "M" and id_sessione in partite:
+                    partita = partite[id_sessione]
+                    ply, uci, ms_bianco, ms_nero = int(campi[2]), campi[3], int(campi[4]), int(campi[5])
+                    # Solo la semimossa successiva: duplicati e righe fuori ordine vengono ignorati
+                    if ply == len(partita.mosse) + 1:
+                        partita.mosse.append(uci)
+                        partita.ms_bianco = ms_bianco
+                        partita.ms_nero = ms_nero
+                elif tipo == "F":
+                    partite.pop(id_sessione, None)
+            except (IndexError, ValueError):
+                # Riga incompleta (es. crash durante la scrittura): si salta
+                continue
+        return list(partite.values())
+
+    def avvia(self, sessioni_attive):
+        """
+        Compatta il giornale sulle sessioni attive (es. quelle appena ripristinate)
+        e avvia il thread di scrittura. sessioni_attive() ritorna la lista delle sessioni.
+        """
+        self._sessioni_attive = sessioni_attive
+        self._compatta()
+        threading.Thread(target=self._ciclo, name="giornale", daemon=True).start()
+
+    # --- Registrazione (thread di gioco, con il lock della sessione preso) ---
+
+    def inizio(self, sessione):
+        self._coda.put(righe_sessione(sessione)[0])
+
+    def mossa(self, sessione):
+        scacchiera = sessione.scacchiera
+        self._coda.put(
+            f"M|{sessione.id}|{len(scacchiera.move_stack)}|{scacchiera.peek().uci()}"
+            f"|{int(sessione.tempo_bianco * 1000)}|{int(sessione.tempo_nero * 1000)}\n"
+        )
+
+    def fine(self, sessione):
+        self._coda.put(f"F|{sessione.id}\n")
+
+    # --- Thread di scrittura ---
+
+    def _ciclo(self):
+        while True:
+            blocco = [self._coda.get()]
+            scadenza = time.monotonic() + self.intervallo
+            try:
+                while True:
+                    blocco.append(self._coda.get(timeout=max(0.0, scadenza - time.monotonic())))
+            except queue.Empty:
+                pass
+            try:
+                self._file.write("".join(blocco).encode("utf-8"))
+                self._file.flush()
+                os.fsync(self._file.fileno())
+                self.commit += 1
+                self._finite += sum(1 for riga in blocco if riga.startswith("F|"))
+                if self._finite >= self.soglia_compattazione:
+                    self._compatta()
+            except OSError as errore:
+                print(f"Errore giornale partite: {errore}")
+
+    def _compatta(self):
+        """Riscrive il giornale con le sole partite ancora aperte, poi riprende in append."""
+        righe = []
+        for sessione in self._sessioni_attive():
+            with sessione.lock:
+                if sessione.iniziata:
+                    righe.extend(righe_sessione(sessione))
+        temporaneo = self.percorso.with_suffix(".tmp")
+        with open(temporaneo, "wb") as f:
+            f.write("".join(righe).encode("utf-8"))
+            f.flush()
+            os.fsync(f.fileno())
+        if self._file is not None:
+            self._file.close()
+        os.replace(temporaneo, self.percorso)
+        self._file = open(self.percorso, "ab")
+        self._finite = 0
@@ -0,0 +1,86 @@
+"""
+Limiti di frequenza per connessione sui messaggi più costosi per il server.
+
+Ogni CHAT| viene inoltrata, filtrata e pubblicata sul bus; ogni MOVES| genera le
+mosse legali. Ogni giocatore ha un secchio di gettoni per tipo di messaggio
+(raffica massima + ricarica al secondo, diversi per modalità di gioco): un
+messaggio senza gettoni viene rifiutato. Anche i rifiuti hanno un loro secchio,
+così chi insiste oltre la tolleranza viene disconnesso. I secchi appartengono al
+posto nella partita, non alla connessione: una ripresa (RESUME|) li ritrova come
+erano, quindi riconnettersi non azzera il limite.
+"""
+
+import time
+
+# Per tipo di messaggio: (gettoni massimi = raffica, gettoni ricaricati al secondo)
+LIMITI_PREDEFINITI = {
+    "CHAT": (5, 1.0),
+    "MOVES": (20, 10.0),
+}
+# Per modalità (secondi di gioco), sostituiscono i predefiniti: nel bullet e nel blitz
+# si selezionano i pezzi molto più in fretta
+LIMITI_PER_MODALITA = {
+    60: {"MOVES": (40, 20.0)},
+    180: {"MOVES": (30, 15.0)},
+}
+
+# Rifiuti tollerati: una raffica di MAX_VIOLAZIONI, poi RICARICA_VIOLAZIONI al secondo
+MAX_VIOLAZIONI = 10
+RICARICA_VIOLAZIONI = 0.2
+
+# Esiti di LimitiConnessione.controlla
+CONSENTITO = "ok"
+LIMITATO = "limitato"
+DISCONNETTI = "disconnetti"
+
+
+def tipo_messaggio(messaggio):
+    """Tipo limitato del messaggio ("CHAT", "MOVES") o None."""
+    if isinstance(messaggio, str):
+        if messaggio.startswith("CHAT|"):
+            return "CHAT"
+        if messaggio.startswith("MOVES|"):
+            return "MOVES"
+    return None
+
+
+class SecchioGettoni:
+    __slots__ = ("capacita", "ricarica", "gettoni", "ultimo")
+
+    def __init__(self, capacita, ricarica):
+        self.capacita = capacita
+        self.ricarica = ricarica
+        self.gettoni = float(capacita)
+        self.ultimo = time.monotonic()
+
+    def consuma(self, adesso) -> bool:
+        """Toglie un gettone se disponibile, dopo la ricarica maturata dall'ultima chiamata."""
+        self.gettoni = min(self.capacita, self.gettoni + (adesso - self.ultimo) * self.ricarica)
+        self.ultimo = adesso
+        if self.gettoni >= 1.0:
+            self.gettoni -= 1.0
+            return True
+        return False
+
+
+class LimitiConnessione:
+    """Secchi di un giocatore, usati dalla connessione che occupa il suo posto."""
+
+    __slots__ = ("secchi", "violazioni", "rifiutati")
+
+    def __init__(self, durata):
+        limiti = dict(LIMITI_PREDEFINITI)
+        limiti.update(LIMITI_PER_MODALITA.get(durata, {}))
+        self.secchi = {tipo: SecchioGettoni(*valori) for tipo, valori in limiti.items()}
+        self.violazioni = SecchioGettoni(MAX_VIOLAZIONI, RICARICA_VIOLAZIONI)
+        self.rifiutati = 0
+
+    def controlla(self, tipo) -> str:
+        secchio = self.secchi.get(tipo)
+        if secchio is None:
+            return CONSENTITO
+        adesso = time.monotonic()
+        if secchio.consuma(adesso):
+            return CONSENTITO
+        self.rifiutati += 1
+        return LIMITATO if self.violazioni.consuma(adesso) else DISCONNETTI
@@ -4,11 +4,18 @@ import threading
 import chess
 import re
 import time
+import pathlib
+import protocollo
+import filtro_parole
 
 # Costanti di connessione (valori di default)
 INDIRIZZO_SERVER = "localhost"
 PORTA_SERVER = 5000
 
+# Ripresa della partita se la connessione cade (es. riavvio del server)
+TENTATIVI_RICONNESSIONE = 30
+ATTESA_RICONNESSIONE = 2.0  # secondi tra un tentativo e l'altro
+
 class ClientScacchi:
     def __init__(self, pagina: ft.Page):
         self.pagina = pagina
@@ -31,16 +38,19 @@ class ClientScacchi:
         self.testoTempoBianco = None
         self.testoTempoNero = None
         self.partitaTerminata = False
+        # True se il server ha confermato il protocollo binario compatto (PROTO|BIN1)
+        self.protocolloBinario = False
+        # Mossa eseguita localmente e inviata al server, da annullare se il server la rifiuta
+        self.mossaInAttesa = None
+        # Token ricevuto con START| per riprendere la partita dopo una disconnessione
+        self.tokenRipresa = None
+        self.indirizzoServer = None
+        self.tentativiRipresa = TENTATIVI_RICONNESSIONE
         self.listaMessaggiChat = ft.ListView(expand=True, spacing=5, auto_scroll=True)
         self.campoInputChat = ft.TextField(hint_text="Scrivi un messaggio...", expand=True, on_submit=self.invia_messaggio_chat)
 
-        # Lista semplice di parole vietate lato client
-        self.parole_vietate = [
-            "cazzo",
-            "merda",
-            "stronzo",
-            "vaffanculo",
-        ]
+        # Stesso file e stesso filtro del server (parole predefinite se il file manca)
+        self.filtro_parole = filtro_parole.FiltroParole(pathlib.Path(__file__).with_name("bad_words.txt"))
 
         # Mappatura modalità -> durata in secondi (0 = nessun timer)
         self.mappa_modalita_timer = {
@@ -113,6 +123,9 @@ class ClientScacchi:
             ],
             on_change=self.on_cambio_modalita,
         )
+        # Se attivo, le mosse valide vengono calcolate sulla scacchiera locale senza
+        # chiedere MOVES| al server (che resta comunque l'autorità sulle mosse).
+        self.checkEvidenziazioneLocale = ft.Checkbox(label="Evidenzia le mosse senza attendere il server", value=True)
         self.etichettaStatoAttuale = ft.Text("", size=16, weight="bold", color="red")
         self.schermataLogin()
 
@@ -127,6 +140,7 @@ class ClientScacchi:
                 self.dropdownTemaScacchiera,
                 self.campoServer,
                 self.dropdownModalita,
+                self.checkEvidenziazioneLocale,
                 self.etichettaStatoAttuale,
                 ft.ElevatedButton("Entra in Coda", on_click=self.connetti_al_server),
             ], alignment=ft.MainAxisAlignment.CENTER, horizontal_alignment=ft.CrossAxisAlignment.CENTER)
@@ -145,7 +159,7 @@ class ClientScacchi:
             
             # Invia al server
             msg = f"CHAT|{testo}"
-            self.socket_client.send(msg.encode())
+            self.socket_client.send(protocollo.codifica(msg))
         except Exception as ex:
             print(f"Errore invio chat: {ex}")
             self.gestisci_disconnessione()
@@ -172,12 +186,10 @@ class ClientScacchi:
             return False
 
         # Controllo parolacce (match parziale, case-insensitive)
-        nick_lower = nickname.lower()
-        for parola in self.parole_vietate:
-            if parola in nick_lower:
-                self.etichettaStatoAttuale.value = "Nickname non consentito."
-                self.pagina.update()
-                return False
+        if self.filtro_parole.contiene(nickname):
+            self.etichettaStatoAttuale.value = "Nickname non consentito."
+            self.pagina.update()
+            return False
 
         # Se tutto ok, pulisco eventuali messaggi di errore
         self.etichettaStatoAttuale.value = ""
@@ -251,9 +263,16 @@ class ClientScacchi:
         try:
             self.socket_client = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
             self.socket_client.connect((host, porta))
+            self.indirizzoServer = (host, porta)
+            self.tokenRipresa = None
             # Invia al server nickname e durata timer (in secondi). 0 = nessun timer.
-            messaggio_iniziale = f"{self.campoNickname.value}|{durata_selezionata}"
-            self.socket_client.send(messaggio_iniziale.encode())
+            # Il terzo campo chiede il protocollo binario compatto: un server che non lo
+            # supporta lo ignora e si resta sul protocollo testuale.
+            self.protocolloBinario = False
+            self.mioColore = None
+            self.mossaInAttesa = None
+            messaggio_iniziale = f"{self.campoNickname.value}|{durata_selezionata}|{protocollo.CAPACITA_BINARIA}"
+            self.socket_client.send(protocollo.codifica(messaggio_iniziale))
             
             self.mostra_schermata_attesa()
             # Avvia il thread per ascoltare il server
@@ -341,26 +360,61 @@ class ClientScacchi:
             self.socket_client = None
 
     def cicloRicezione(self):
-        while True:
-            try:
-                if not self.socket_client:
-                    break
-                datoRicevuto = self.socket_client.recv(1024).decode()
-                if not datoRicevuto: 
+        if not self.socket_client:
+            return
+        socket_corrente = self.socket_client
+        disconnesso = False
+        try:
+            # Il codec separa i messaggi anche quando TCP ne unisce più di uno in una recv
+            for datoRicevuto in protocollo.leggi_messaggi(socket_corrente):
+                if self.socket_client is not socket_corrente:
                     break
 
-                if datoRicevuto.startswith("START|"):
-                    coloreAssegnato = datoRicevuto.split("|")[1]
+                # Record binari (solo se negoziati): mossa avversaria e orologio in millisecondi
+                if isinstance(datoRicevuto, chess.Move):
+                    self.mossaAvversario(datoRicevuto)
+                elif isinstance(datoRicevuto, protocollo.TempoBinario):
+                    self.aggiorna_timer_ui(datoRicevuto.ms_bianco // 1000, datoRicevuto.ms_nero // 1000)
+                elif datoRicevuto.startswith("PROTO|"):
+                    self.protocolloBinario = datoRicevuto.split("|", 1)[1] == protocollo.CAPACITA_BINARIA
+                elif datoRicevuto.startswith("START|"):
+                    parti = datoRicevuto.split("|")
+                    coloreAssegnato = parti[1]
+                    self.tokenRipresa = parti[2] if len(parti) > 2 else None
+                    self.tentativiRipresa = TENTATIVI_RICONNESSIONE
                     self.mioColore = chess.WHITE if coloreAssegnato == "WHITE" else chess.BLACK
                     self.mioTurno = (self.mioColore == chess.WHITE)
                     self.schermataScacchiera()
+                elif datoRicevuto.startswith("RESUME|"):
+                    self.sincronizzaPartita(datoRicevuto)
+                elif datoRicevuto.startswith("OPPONENT|"):
+                    # L'avversario ha perso la connessione (ha qualche secondo per tornare) o è tornato
+                    parti = datoRicevuto.split("|")
+                    if parti[1] == "DISCONNECTED":
+                        attesa = f" (max {parti[2]}s)" if len(parti) > 2 else ""
+                        self.etichettaStatoAttuale.value = f"Avversario disconnesso, in attesa{attesa}..."
+                    else:
+                        self.etichettaStatoAttuale.value = "TOCCA A TE!" if self.mioTurno else "Turno avversario..."
+                    self.pagina.update()
                 elif datoRicevuto.startswith("ERROR|"):
                     messaggioErrore = datoRicevuto.split("|", 1)[1] if "|" in datoRicevuto else "Errore dal server"
                     print(f"ERRORE DAL SERVER: {messaggioErrore}")
-                    # Torno alla schermata di login mostrando l'errore
-                    self.schermataLogin()
-                    self.etichettaStatoAttuale.value = messaggioErrore
-                    self.pagina.update()
+                    if messaggioErrore.startswith("Troppi messaggi"):
+                        # Limite di frequenza su chat o richieste di mosse: non riguarda la mossa in attesa
+                        self.etichettaStatoAttuale.value = messaggioErrore
+                        self.pagina.update()
+                    elif self.mossaInAttesa is not None:
+                        # Il server ha rifiutato la mossa eseguita in modo ottimistico
+                        self.annullaMossaRifiutata(messaggioErrore)
+                    elif self.mioColore is not None:
+                        # Errore durante la partita: lo mostriamo senza uscire
+                        self.etichettaStatoAttuale.value = messaggioErrore
+                        self.pagina.update()
+                    else:
+                        # Torno alla schermata di login mostrando l'errore
+                        self.schermataLogin()
+                        self.etichettaStatoAttuale.value = messaggioErrore
+                        self.pagina.update()
                 elif datoRicevuto.startswith("MOVES|"):
                     # Formato: MOVES|e4,e5,e6 (lista di caselle separate da virgola)
                     caselle_valide = datoRicevuto.split("|")[1].split(",") if len(datoRicevuto.split("|")) > 1 and datoRicevuto.split("|")[1] else []
@@ -386,6 +440,8 @@ class ClientScacchi:
                         messaggio = "Patta!"
                     elif esito == "OPPONENT_LEFT":
                         messaggio = "Il tuo avversario ha abbandonato!"
+                    elif esito == "EXPIRED":
+                        messaggio = "La partita non è più disponibile."
                     else:
                         messaggio = "Partita terminata."
                     self.mostra_schermata_fine_partita(messaggio)
@@ -429,33 +485,101 @@ class ClientScacchi:
                         self.pagina.update()
                 else:
                     self.mossaAvversario(datoRicevuto)
-                    
-            except (ConnectionResetError, OSError, BrokenPipeError) as errore:
-                print(f"Disconnesso: {errore}")
-                # Se non siamo già arrivati a una schermata di fine partita,
-                # gestiamo la disconnessione in modo generico.
-                if self.socket_client is not None and not self.partitaTerminata:
-                    self.gestisci_disconnessione()
-                break
-            except Exception as errore:
-                print(f"Errore nella ricezione: {errore}")
-                break
+
+        except (ConnectionResetError, OSError, BrokenPipeError) as errore:
+            print(f"Disconnesso: {errore}")
+            disconnesso = True
+        except Exception as errore:
+            print(f"Errore nella ricezione: {errore}")
+
+        # Connessione persa a partita in corso: proviamo a riprenderla con il token
+        if self.socket_client is socket_corrente and not self.partitaTerminata and self.tokenRipresa:
+            if self.riconnetti():
+                return
+            disconnesso = True
+        # Se non siamo già arrivati a una schermata di fine partita,
+        # gestiamo la disconnessione in modo generico.
+        if disconnesso and self.socket_client is socket_corrente and not self.partitaTerminata:
+            self.gestisci_disconnessione()
         # Alla fine chiudiamo il socket se è ancora aperto
-        if self.socket_client:
+        if self.socket_client is socket_corrente:
             try:
                 self.socket_client.close()
             except:
                 pass
             self.socket_client = None
 
+    def riconnetti(self):
+        """
+        Riapre la connessione e chiede al server di riprendere la partita
+        (RESUME|token|semimosse): il server risponde con le sole mosse mancanti.
+        Ritorna True se la nuova connessione è partita (o se la partita non è più in corso).
+        """
+        socket_perso = self.socket_client
+        try:
+            socket_perso.close()
+        except:
+            pass
+        self.etichettaStatoAttuale.value = "Connessione persa, riconnessione in corso..."
+        self.pagina.update()
+
+        # Tentativi condivisi tra riconnessioni successive, ricaricati a ogni ripresa riuscita
+        while self.tentativiRipresa > 0:
+            self.tentativiRipresa -= 1
+            # Nel frattempo l'utente può aver abbandonato la partita
+            if self.socket_client is not socket_perso or self.partitaTerminata:
+                return True
+            # Semimosse confermate dal server: una mossa ottimistica in attesa non conta
+            semimosse = len(self.scacchiera.move_stack) - (1 if self.mossaInAttesa is not None else 0)
+            try:
+                nuovo_socket = socket.create_connection(self.indirizzoServer, timeout=5)
+                nuovo_socket.settimeout(None)
+                nuovo_socket.send(protocollo.codifica(
+                    f"RESUME|{self.tokenRipresa}|{semimosse}|{protocollo.CAPACITA_BINARIA}"
+                ))
+            except OSError:
+                time.sleep(ATTESA_RICONNESSIONE)
+                continue
+            self.socket_client = nuovo_socket
+            self.protocolloBinario = False
+            threading.Thread(target=self.cicloRicezione, daemon=True).start()
+            return True
+        return False
+
+    def sincronizzaPartita(self, messaggio):
+        """
+        Risposta del server alla ripresa: "RESUME|da_semimossa|uci,uci,..." con le mosse
+        giocate a partire da da_semimossa. La scacchiera locale viene riallineata.
+        """
+        parti = messaggio.split("|")
+        try:
+            da_semimossa = int(parti[1])
+            mosse = [chess.Move.from_uci(uci) for uci in parti[2].split(",") if uci]
+        except (IndexError, ValueError):
+            return
+        # Annulla anche un'eventuale mossa ottimistica che il server non ha ricevuto
+        while len(self.scacchiera.move_stack) > da_semimossa:
+            self.scacchiera.pop()
+        for mossa in mosse:
+            self.scacchiera.push(mossa)
+        self.mossaInAttesa = None
+        self.tentativiRipresa = TENTATIVI_RICONNESSIONE
+        self.casellaSelezionata = None
+        self.mosseValideEvidenziate = []
+        self.mioTurno = (self.scacchiera.turn == self.mioColore)
+        self.etichettaStatoAttuale.value = "TOCCA A TE!" if self.mioTurno else "Turno avversario..."
+        self.aggiornaPezzi()
+
     def mostra_schermata_fine_partita(self, messaggio):
         """Pulisce la pagina e mostra il risultato della partita con possibilità di nuova partita."""
         # Segna che la partita è conclusa per evitare messaggi di disconnessione sovrascrittivi
         self.partitaTerminata = True
+        self.tokenRipresa = None
         # Reset stato interno
         self.mioTurno = False
         self.casellaSelezionata = None
         self.mosseValideEvidenziate = []
+        self.mossaInAttesa = None
         self.scacchiera = chess.Board()
         self.caselleGrafica = {}
 
@@ -515,8 +639,14 @@ class ClientScacchi:
 
         # 4. Logica di gioco (disconnessione, reset variabili)
         self.partitaTerminata = True
+        self.tokenRipresa = None
         
         if self.socket_client:
+            try:
+                # Abbandono esplicito: senza, il server aspetterebbe la finestra di ripresa
+                self.socket_client.send(protocollo.codifica("RESIGN|"))
+            except:
+                pass
             try:
                 self.socket_client.close()
             except:
@@ -528,6 +658,7 @@ class ClientScacchi:
         self.mioTurno = False
         self.casellaSelezionata = None
         self.mosseValideEvidenziate = []
+        self.mossaInAttesa = None
         self.partitaTerminata = False 
 
         # 5. Adesso che la grafica è pulita, carichiamo la Login
@@ -752,11 +883,31 @@ class ClientScacchi:
         if self.testoTempoBianco or self.testoTempoNero:
             self.pagina.update()
 
+    def calcolaMosseValide(self, casella):
+        """Mosse valide per una casella calcolate sulla scacchiera locale (nessun round trip)."""
+        casella_partenza = chess.parse_square(casella)
+        return [
+            chess.square_name(m.to_square)
+            for m in self.scacchiera.legal_moves
+            if m.from_square == casella_partenza
+        ]
+
+    def annullaMossaRifiutata(self, messaggioErrore):
+        """Annulla la mossa ottimistica rifiutata dal server e restituisce il turno."""
+        if self.scacchiera.move_stack and self.scacchiera.peek() == self.mossaInAttesa:
+            self.scacchiera.pop()
+        self.mossaInAttesa = None
+        self.casellaSelezionata = None
+        self.mosseValideEvidenziate = []
+        self.mioTurno = True
+        self.etichettaStatoAttuale.value = f"Mossa rifiutata: {messaggioErrore}"
+        self.aggiornaPezzi()
+
     def richiediMosseValide(self, casella):
         """Richiede al server le mosse valide per una casella"""
         if self.socket_client and self.mioTurno and not self.partitaTerminata:
             try:
-                self.socket_client.send(f"MOVES|{casella}".encode())
+                self.socket_client.send(protocollo.codifica(f"MOVES|{casella}"))
             except (ConnectionResetError, OSError, BrokenPipeError, AttributeError) as e:
                 print(f"Errore invio richiesta mosse: {e}")
                 self.gestisci_disconnessione()
@@ -777,7 +928,11 @@ class ClientScacchi:
         pezzo = self.scacchiera.piece_at(chess.parse_square(nomeCasella))
         if pezzo and pezzo.color == self.mioColore:
             self.casellaSelezionata = nomeCasella
-            self.richiediMosseValide(nomeCasella)
+            if self.checkEvidenziazioneLocale.value:
+                self.mosseValideEvidenziate = self.calcolaMosseValide(nomeCasella)
+                self.aggiornaPezzi()
+            else:
+                self.richiediMosseValide(nomeCasella)
     
     def clickSuCasella(self, evento, nomeCasella):
         """Gestisce il click su una casella per muovere il pezzo selezionato"""
@@ -800,6 +955,7 @@ class ClientScacchi:
             
             if mossa and mossa in self.scacchiera.legal_moves:
                 self.scacchiera.push(mossa)
+                self.mossaInAttesa = mossa
                 self.casellaSelezionata = None
                 self.mosseValideEvidenziate = []
                 self.aggiornaPezzi()
@@ -811,7 +967,7 @@ class ClientScacchi:
                     # Può capitare che il socket sia stato chiuso tra la mossa locale
                     # e l'invio, quindi verifichiamo prima che esista ancora.
                     if self.socket_client and not self.partitaTerminata:
-                        self.socket_client.send(mossa.uci().encode())
+                        self.socket_client.send(self.codificaMossa(mossa))
                 except (ConnectionResetError, OSError, BrokenPipeError, AttributeError) as e:
                     print(f"Errore invio mossa: {e}")
                     self.gestisci_disconnessione()
@@ -843,6 +999,7 @@ class ClientScacchi:
         if mossa and mossa in self.scacchiera.legal_moves:
             # Eseguiamo localmente "con fiducia" (Optimistic UI update)
             self.scacchiera.push(mossa)
+            self.mossaInAttesa = mossa
             self.casellaSelezionata = None
             self.mosseValideEvidenziate = []
             self.aggiornaPezzi()
@@ -853,16 +1010,25 @@ class ClientScacchi:
             # INVIO AL SERVER
             try:
                 if self.socket_client and not self.partitaTerminata:
-                    self.socket_client.send(mossa.uci().encode())
+                    self.socket_client.send(self.codificaMossa(mossa))
             except (ConnectionResetError, OSError, BrokenPipeError, AttributeError) as e:
                 print(f"Errore invio mossa: {e}")
                 self.gestisci_disconnessione()
         else:
             self.aggiornaPezzi() # Reset visuale in caso di mossa invalida (il pezzo torna indietro)
 
+    def codificaMossa(self, mossa):
+        """Codifica la mossa nel formato negoziato con il server (binario o UCI testuale)."""
+        if self.protocolloBinario:
+            return protocollo.codifica_mossa(mossa)
+        return protocollo.codifica(mossa.uci())
+
     def mossaAvversario(self, mossa_uci):
         try:
-            mossa = chess.Move.from_uci(mossa_uci)
+            # La mossa può arrivare come testo UCI o già decodificata dal protocollo binario
+            mossa = mossa_uci if isinstance(mossa_uci, chess.Move) else chess.Move.from_uci(mossa_uci)
+            # L'avversario ha risposto: la nostra ultima mossa è stata accettata
+            self.mossaInAttesa = None
             # Qui ci fidiamo del server (che ha già validato la mossa)
             self.scacchiera.push(mossa)
             self.casellaSelezionata = None
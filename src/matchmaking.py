@@ -0,0 +1,44 @@
+"""
+Matchmaking: una coda FIFO di giocatori in attesa per ogni modalità (durata del timer).
+
+Accoppiare un nuovo giocatore costa O(1) indipendentemente dal numero di partite
+in corso, e l'operazione è atomica: due giocatori che arrivano insieme non possono
+prendere lo stesso posto. Un giocatore in attesa che si disconnette viene tolto
+dalla coda, sempre in O(1).
+"""
+
+import collections
+import threading
+
+
+class Matchmaking:
+    def __init__(self, modalita):
+        self._lock = threading.Lock()
+        # Per ogni modalità: id(voce) -> voce, in ordine di arrivo
+        self._code = {durata: collections.OrderedDict() for durata in sorted(modalita)}
+
+    def accoppia(self, durata, voce):
+        """
+        Se nella coda della modalità c'è qualcuno in attesa lo rimuove e lo ritorna
+        (il chiamante completa la partita); altrimenti mette in coda `voce` e ritorna None.
+        """
+        with self._lock:
+            coda = self._code[durata]
+            if coda:
+                _, in_attesa = coda.popitem(last=False)
+                return in_attesa
+            coda[id(voce)] = voce
+            return None
+
+    def annulla(self, durata, voce) -> bool:
+        """Toglie `voce` dalla coda. Ritorna False se era già stata accoppiata (o mai accodata)."""
+        with self._lock:
+            coda = self._code.get(durata)
+            if coda is None:
+                return False
+            return coda.pop(id(voce), None) is not None
+
+    def in_attesa(self) -> dict:
+        """Numero di giocatori in attesa per ogni modalità."""
+        with self._lock:
+            return {durata: len(coda) for durata, coda in self._code.items()}
@@ -0,0 +1,155 @@
+"""
+Metriche del server nel formato testuale di Prometheus, senza dipendenze esterne.
+
+Contatori e istogrammi vengono aggiornati dai thread di gioco con semplici
+incrementi di attributi, senza lock: sotto carico qualche incremento concorrente
+può andare perso, un errore trascurabile per una metrica e meglio di un lock
+conteso sul percorso delle mosse. I valori istantanei (client, code, sessioni,
+thread) sono letti solo quando Prometheus interroga l'endpoint.
+
+L'endpoint HTTP (GET /metrics) gira su una porta separata da quella di gioco, in
+un thread a parte: una lettura lenta non tocca mai le partite.
+"""
+
+import bisect
+import http.server
+import threading
+
+# Limiti dei bucket degli istogrammi di latenza, in secondi
+BUCKET_LATENZA = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 1.0)
+
+
+def _etichette(etichette) -> str:
+    if not etichette:
+        return ""
+    return "{" + ",".join(f'{nome}="{valore}"' for nome, valore in etichette.items()) + "}"
+
+
+class Contatore:
+    __slots__ = ("nome", "aiuto", "valore")
+
+    def __init__(self, nome, aiuto):
+        self.nome = nome
+        self.aiuto = aiuto
+        self.valore = 0
+
+    def incrementa(self, quanto=1):
+        self.valore += quanto
+
+    def righe(self):
+        yield f"# HELP {self.nome} {self.aiuto}"
+        yield f"# TYPE {self.nome} counter"
+        yield f"{self.nome} {self.valore}"
+
+
+class Misura:
+    """
+    Valore letto a ogni interrogazione: funzione() ritorna un numero o {etichetta: numero}.
+    Con tipo="counter" espone un contatore tenuto altrove (es. uscita.disconnessi_lenti).
+    """
+
+    __slots__ = ("nome", "aiuto", "funzione", "etichetta", "tipo")
+
+    def __init__(self, nome, aiuto, funzione, etichetta=None, tipo="gauge"):
+        self.nome = nome
+        self.aiuto = aiuto
+        self.funzione = funzione
+        self.etichetta = etichetta
+        self.tipo = tipo
+
+    def righe(self):
+        yield f"# HELP {self.nome} {self.aiuto}"
+        yield f"# TYPE {self.nome} {self.tipo}"
+        valore = self.funzione()
+        if self.etichetta is None:
+            yield f"{self.nome} {valore}"
+        else:
+            for chiave, numero in valore.items():
+                yield f"{self.nome}{_etichette({self.etichetta: chiave})} {numero}"
+
+
+class Istogramma:
+    __slots__ = ("nome", "aiuto", "limiti", "conteggi", "somma", "totale")
+
+    def __init__(self, nome, aiuto, limiti=BUCKET_LATENZA):
+        self.nome = nome
+        self.aiuto = aiuto
+        self.limiti = tuple(limiti)
+        self.conteggi = [0] * (len(self.limiti) + 1)  # l'ultimo è +Inf
+        self.somma = 0.0
+        self.totale = 0
+
+    def osserva(self, valore):
+        self.conteggi[bisect.bisect_left(self.limiti, valore)] += 1
+        self.somma += valore
+        self.totale += 1
+
+    def righe(self):
+        yield f"# HELP {self.nome} {self.aiuto}"
+        yield f"# TYPE {self.nome} histogram"
+        cumulato = 0
+        for limite, conteggio in zip(self.limiti, self.conteggi):
+            cumulato += conteggio
+            yield f'{self.nome}_bucket{{le="{limite}"}} {cumulato}'
+        yield f'{self.nome}_bucket{{le="+Inf"}} {cumulato + self.conteggi[-1]}'
+        yield f"{self.nome}_sum {self.somma}"
+        yield f"{self.nome}_count {self.totale}"
+
+
+class RegistroMetriche:
+    def __init__(self, prefisso):
+        self.prefisso = prefisso
+        self._metriche = []
+
+    def contatore(self, nome, aiuto) -> Contatore:
+        return self._aggiungi(Contatore(f"{self.prefisso}_{nome}", aiuto))
+
+    def misura(self, nome, aiuto, funzione, etichetta=None, tipo="gauge") -> Misura:
+        return self._aggiungi(Misura(f"{self.prefisso}_{nome}", aiuto, funzione, etichetta, tipo))
+
+    def istogramma(self, nome, aiuto, limiti=BUCKET_LATENZA) -> Istogramma:
+        return self._aggiungi(Istogramma(f"{self.prefisso}_{nome}", aiuto, limiti))
+
+    def _aggiungi(self, metrica):
+        self._metriche.append(metrica)
+        return metrica
+
+    def esponi(self) -> str:
+        righe = []
+        for metrica in self._metriche:
+            try:
+                righe.extend(metrica.righe())
+            except Exception as errore:
+                righe.append(f"# errore in {metrica.nome}: {errore}")
+        return "\n".join(righe) + "\n"
+
+    def avvia_http(self, indirizzo, porta, percorsi=None):
+        """
+        Avvia l'endpoint GET /metrics in un thread dedicato.
+        percorsi aggiunge altri endpoint: {percorso: (content_type, funzione che ritorna il testo)}.
+        """
+        risposte = {"/metrics": ("text/plain; version=0.0.4; charset=utf-8", self.esponi)}
+        risposte.update(percorsi or {})
+
+        class Gestore(http.server.BaseHTTPRequestHandler):
+            def do_GET(self):
+                risposta = risposte.get(self.path.split("?", 1)[0])
+                if risposta is None:
+                    self.send_error(404)
+                    return
+                tipo, funzione = risposta
+                corpo = funzione().encode("utf-8")
+                self.send_response(200)
+                self.send_header("Content-Type", tipo)
+                self.send_header("Content-Length", str(len(corpo)))
+                self.end_headers()
+                self.wfile.write(corpo)
+
+            def log_message(self, formato, *argomenti):
+                pass  # niente log a ogni lettura di Prometheus
+
+        server_http = http.server.ThreadingHTTPServer((indirizzo, porta), Gestore)
+        server_http.daemon_threads = True
+        threading.Thread(target=server_http.serve_forever, name="metriche", daemon=True).start()
+        print(f"METRICHE SU http://{indirizzo}:{porta}/metrics")
+        return server_http
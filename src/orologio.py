@@ -0,0 +1,94 @@
+"""
+Scheduler centrale degli orologi di gioco.
+
+Un unico thread gestisce un heap di eventi ordinati per scadenza (time.monotonic):
+la caduta della bandierina di ogni lato e l'invio periodico del TIME ai giocatori.
+Il thread dorme fino al prossimo evento, quindi il costo dipende dagli eventi che
+scattano e non dal numero di partite aperte, e un tempo scade esattamente quando
+deve invece che fino a un secondo dopo.
+"""
+
+import heapq
+import itertools
+import threading
+import time
+
+
+class Evento:
+    """Handle di un evento pianificato, usato per annullarlo."""
+
+    __slots__ = ("scadenza", "funzione", "argomenti", "annullato")
+
+    def __init__(self, scadenza, funzione, argomenti):
+        self.scadenza = scadenza
+        self.funzione = funzione
+        self.argomenti = argomenti
+        self.annullato = False
+
+
+class Orologio:
+    def __init__(self):
+        self._heap = []
+        self._condizione = threading.Condition()
+        self._sequenza = itertools.count()  # spareggio per eventi con la stessa scadenza
+        self._annullati = 0
+        self._thread = None
+
+    def avvia(self):
+        """Avvia il thread dello scheduler (una sola volta)."""
+        with self._condizione:
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._ciclo, name="orologio", daemon=True)
+                self._thread.start()
+
+    def pianifica(self, ritardo, funzione, *argomenti) -> Evento:
+        """Esegue funzione(*argomenti) tra `ritardo` secondi sul thread dello scheduler."""
+        evento = Evento(time.monotonic() + max(0.0, ritardo), funzione, argomenti)
+        with self._condizione:
+            heapq.heappush(self._heap, (evento.scadenza, next(self._sequenza), evento))
+            # Sveglia il thread solo se il nuovo evento è il più vicino
+            if self._heap[0][2] is evento:
+                self._condizione.notify()
+        return evento
+
+    def annulla(self, evento):
+        """Annulla un evento (rimozione pigra: viene scartato quando arriva in cima all'heap)."""
+        if evento is None or evento.annullato:
+            return
+        with self._condizione:
+            evento.annullato = True
+            self._annullati += 1
+            # Se gli annullati dominano l'heap lo ricostruiamo, così la memoria resta limitata
+            if self._annullati > 64 and self._annullati * 2 > len(self._heap):
+                self._heap = [voce for voce in self._heap if not voce[2].annullato]
+                heapq.heapify(self._heap)
+                self._annullati = 0
+
+    def eventi_pianificati(self) -> int:
+        with self._condizione:
+            return len(self._heap) - self._annullati
+
+    def _ciclo(self):
+        while True:
+            with self._condizione:
+                while True:
+                    if not self._heap:
+                        self._condizione.wait()
+                        continue
+                    scadenza, _, evento = self._heap[0]
+                    if evento.annullato:
+                        heapq.heappop(self._heap)
+                        self._annullati -= 1
+                        continue
+                    attesa = scadenza - time.monotonic()
+                    if attesa <= 0:
+                        heapq.heappop(self._heap)
+                        # Marcato come consumato: un annulla() successivo non lo conta
+                        evento.annullato = True
+                        break
+                    self._condizione.wait(attesa)
+            # La callback gira fuori dal lock, così può pianificare nuovi eventi
+            try:
+                evento.funzione(*evento.argomenti)
+            except Exception as errore:
+                print(f"Errore evento orologio: {errore}")
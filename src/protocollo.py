@@ -0,0 +1,168 @@
+"""
+Codec del protocollo di rete condiviso da client (main.py) e server (server.py).
+
+Ogni messaggio è testo UTF-8 terminato da "\\n". TCP non conserva i confini dei
+messaggi: una singola recv può contenere più messaggi uniti (es. "TIME|..." e una
+mossa) oppure solo una parte di un messaggio, anche a metà di un carattere
+multibyte. Il Decodificatore accumula i byte in un bytearray riutilizzato e
+restituisce solo i messaggi completi.
+
+Se negoziato nell'handshake ("nickname|secondi|BIN1"), mosse e aggiornamenti
+dell'orologio viaggiano come record binari a lunghezza fissa. Il primo byte di
+un record binario è un tag >= 0x80, che non può mai aprire un messaggio
+testuale (sempre ASCII), quindi i due formati convivono sullo stesso stream.
+"""
+
+import struct
+import time
+from typing import NamedTuple
+
+import chess
+
+SEPARATORE = b"\n"
+DIMENSIONE_RICEZIONE = 4096  # byte letti per ogni syscall
+LUNGHEZZA_MASSIMA = 64 * 1024  # oltre questa soglia senza separatore il peer è considerato malevolo
+
+# Capacità annunciata dal client nell'handshake e confermata dal server con "PROTO|BIN1"
+CAPACITA_BINARIA = "BIN1"
+
+# Record binari: tag (1 byte) + payload big-endian a lunghezza fissa
+TAG_MOSSA = 0x80  # uint16: da (6 bit) | a (6 bit) << 6 | promozione (3 bit) << 12
+TAG_TEMPO = 0x81  # 2 x uint32: millisecondi residui di Bianco e Nero
+_FORMATO_MOSSA = struct.Struct(">BH")
+_FORMATO_TEMPO = struct.Struct(">BII")
+LUNGHEZZA_RECORD = {
+    TAG_MOSSA: _FORMATO_MOSSA.size,
+    TAG_TEMPO: _FORMATO_TEMPO.size,
+}
+
+
+class TempoBinario(NamedTuple):
+    """Aggiornamento dell'orologio ricevuto in formato binario."""
+    ms_bianco: int
+    ms_nero: int
+
+
+class MessaggioTroppoLungo(ValueError):
+    """Il buffer ha superato LUNGHEZZA_MASSIMA senza incontrare un separatore."""
+
+
+def codifica(testo: str) -> bytes:
+    """
+    Codifica un messaggio per l'invio. Eventuali "\\n" nel contenuto (es. nella chat)
+    vengono sostituiti da spazi per non rompere il framing.
+    """
+    return testo.replace("\n", " ").encode("utf-8") + SEPARATORE
+
+
+def codifica_mossa(mossa: chess.Move) -> bytes:
+    """Codifica una mossa in 3 byte (equivalente binario di "e2e4")."""
+    codice = mossa.from_square | (mossa.to_square << 6) | ((mossa.promotion or 0) << 12)
+    return _FORMATO_MOSSA.pack(TAG_MOSSA, codice)
+
+
+def codifica_tempo(ms_bianco: int, ms_nero: int) -> bytes:
+    """Codifica un aggiornamento dell'orologio in 9 byte (equivalente binario di "TIME|w|b")."""
+    return _FORMATO_TEMPO.pack(TAG_TEMPO, max(0, int(ms_bianco)), max(0, int(ms_nero)))
+
+
+def _decodifica_record(tag, vista):
+    if tag == TAG_MOSSA:
+        _, codice = _FORMATO_MOSSA.unpack(vista)
+        promozione = (codice >> 12) & 0x7
+        return chess.Move(codice & 0x3F, (codice >> 6) & 0x3F, promozione or None)
+    _, ms_bianco, ms_nero = _FORMATO_TEMPO.unpack(vista)
+    return TempoBinario(ms_bianco, ms_nero)
+
+
+class Decodificatore:
+    """
+    Decodificatore incrementale: alimentato con blocchi di byte arbitrari,
+    restituisce la lista dei messaggi completi trovati (anche più di uno per blocco).
+    I messaggi testuali sono str, i record binari chess.Move o TempoBinario.
+    """
+
+    __slots__ = ("_buffer", "_dimensione_ricezione", "_ricezione", "_vista_ricezione", "istante")
+
+    def __init__(self, dimensione_ricezione=DIMENSIONE_RICEZIONE, misura_istante=False):
+        self._buffer = bytearray()
+        # Con misura_istante: perf_counter_ns() dell'ultimo blocco ricevuto (per il tracciamento)
+        self.istante = 0 if misura_istante else None
+        # Buffer fisso per recv_into, creato alla prima ricevi(): evita di allocare un nuovo
+        # oggetto bytes a ogni recv, senza pesare sui decodificatori alimentati da asyncio
+        self._dimensione_ricezione = dimensione_ricezione
+        self._ricezione = None
+        self._vista_ricezione = None
+
+    def alimenta(self, dati) -> list:
+        """Aggiunge dati ricevuti e ritorna i messaggi completi (senza separatore)."""
+        if self.istante is not None:
+            self.istante = time.perf_counter_ns()
+        self._buffer += dati
+        return self._estrai()
+
+    def ricevi(self, sock):
+        """
+        Esegue una recv sul socket e ritorna i messaggi completi ricevuti.
+        Ritorna None se il peer ha chiuso la connessione.
+        """
+        if self._ricezione is None:
+            self._ricezione = bytearray(self._dimensione_ricezione)
+            self._vista_ricezione = memoryview(self._ricezione)
+        letti = sock.recv_into(self._ricezione)
+        if not letti:
+            return None
+        if self.istante is not None:
+            self.istante = time.perf_counter_ns()
+        self._buffer += self._vista_ricezione[:letti]
+        return self._estrai()
+
+    def _estrai(self) -> list:
+        buffer = self._buffer
+        messaggi = []
+        inizio = 0
+        with memoryview(buffer) as vista:
+            while inizio < len(buffer):
+                lunghezza_record = LUNGHEZZA_RECORD.get(buffer[inizio])
+                if lunghezza_record:
+                    # Record binario a lunghezza fissa (può contenere anche il byte "\n")
+                    if len(buffer) - inizio < lunghezza_record:
+                        break
+                    messaggi.append(_decodifica_record(buffer[inizio], vista[inizio:inizio + lunghezza_record]))
+                    inizio += lunghezza_record
+                    continue
+                fine = buffer.find(SEPARATORE, inizio)
+                if fine < 0:
+                    break
+                if fine > inizio:
+                    # Decodifica direttamente dalla vista, senza copie intermedie
+                    messaggi.append(str(vista[inizio:fine], "utf-8", "replace").rstrip("\r"))
+                inizio = fine + 1
+        # Un'unica compattazione per blocco ricevuto, non per messaggio
+        if inizio:
+            del buffer[:inizio]
+        if len(buffer) > LUNGHEZZA_MASSIMA:
+            buffer.clear()
+            raise MessaggioTroppoLungo("Messaggio oltre la lunghezza massima consentita")
+        return messaggi
+
+
+def leggi_messaggi(sock, decodificatore=None):
+    """Generatore dei messaggi ricevuti da un socket bloccante, fino alla chiusura."""
+    decodificatore = decodificatore or Decodificatore()
+    while True:
+        messaggi = decodificatore.ricevi(sock)
+        if messaggi is None:
+            return
+        yield from messaggi
+
+
+async def leggi_messaggi_async(reader, decodificatore=None):
+    """Come leggi_messaggi, ma per uno StreamReader asyncio."""
+    decodificatore = decodificatore or Decodificatore()
+    while True:
+        dati = await reader.read(DIMENSIONE_RICEZIONE)
+        if not dati:
+            return
+        for messaggio in decodificatore.alimenta(dati):
+            yield messaggio
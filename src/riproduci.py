@@ -0,0 +1,281 @@
+"""
+Riproduzione deterministica di una cattura del traffico (vedi cattura.py).
+
+Ogni connessione catturata viene riaperta verso un server nuovo, che riceve gli
+stessi messaggi nello stesso ordine: alla velocità originale (--velocita 1, o un
+multiplo) oppure il più in fretta possibile (--velocita 0). Prima di ogni
+messaggio di una connessione la riproduzione aspetta che quella connessione abbia
+ricevuto tutte le risposte che il server le aveva inviato fino a quel punto:
+così, anche a velocità massima, una mossa parte solo dopo la mossa
+dell'avversario e l'intreccio dei messaggi resta quello catturato.
+
+Alla fine confronta, connessione per connessione, i messaggi ricevuti con quelli
+catturati. I messaggi che dipendono dal tempo (TIME|) sono esclusi e i token di
+ripresa vengono tradotti. Riporta le differenze, la durata della riproduzione e i
+tempi di risposta del server. Il codice di uscita è 1 se una connessione diverge.
+
+Gli accoppiamenti del matchmaking registrati nella cattura vengono rifatti
+identici: l'handshake del Bianco parte per primo, seguito da una breve pausa,
+poi quello del Nero, che aspetta il suo START| prima di proseguire.
+
+Limiti: a velocità massima le partite con orologio non consumano il tempo
+originale, quindi una vittoria al tempo si riproduce solo a velocità 1. Con
+--avvia-server a velocità massima il server parte senza limiti di frequenza, che
+il traffico originale non aveva raggiunto.
+
+Uso:
+    python server.py --headless --cattura traffico.log.gz      # in produzione
+    python riproduci.py traffico.log.gz --avvia-server --velocita 0
+"""
+
+import argparse
+import asyncio
+import collections
+import sys
+import time
+
+import carico
+import cattura
+import protocollo
+
+PAUSA_HANDSHAKE = 0.02  # secondi dopo un handshake, a velocità massima
+ATTESA_RISPOSTE = 5.0  # secondi massimi di attesa delle risposte catturate
+
+
+def normalizza(testo):
+    """Forma confrontabile di un messaggio inviato dal server, o None se dipende dal tempo."""
+    if testo.startswith("TIME|") or testo.startswith(f"~{protocollo.TAG_TEMPO:02x}"):
+        return None
+    if testo.startswith("START|"):
+        return "|".join(testo.split("|")[:2])  # senza il token di ripresa
+    return testo
+
+
+class Piano:
+    """
+    Eventi da riprodurre e risposte attese, ricavati dalla cattura.
+
+    L'ordine in cui gli handshake sono stati registrati non è per forza quello in
+    cui il matchmaking li ha serviti (modalità thread): l'handshake di un nuovo
+    giocatore viene quindi spostato al suo accoppiamento (evento S), prima il
+    Bianco e poi il Nero, così la riproduzione forma le stesse coppie.
+    """
+
+    def __init__(self, eventi):
+        # (microsecondi, connessione, tipo, dati, risposte attese prima, risposte attese dopo)
+        self.passi = []
+        self.attese = collections.defaultdict(list)  # connessione -> messaggi normalizzati
+        self.token = {}  # connessione -> token di ripresa catturato
+        self.spettatori = set()
+        self.durata = eventi[-1][0] / 1e6 if eventi else 0.0
+        handshake = {}  # connessione -> passo dell'handshake in attesa dell'accoppiamento
+        iniziate = set()
+        for microsecondi, connessione, tipo, dati in eventi:
+            if tipo == cattura.INVIATO:
+                if dati.startswith("START|") and dati.count("|") >= 2:
+                    self.token[connessione] = dati.split("|")[2]
+                messaggio = normalizza(dati)
+                if messaggio is not None:
+                    self.attese[connessione].append(messaggio)
+            elif tipo == cattura.ACCOPPIAMENTO:
+                nero = int(dati.split("|")[1])
+                for giocatore in (connessione, nero):
+                    passo = handshake.pop(giocatore, None)
+                    if passo is not None:
+                        # Il Nero aspetta il suo START| prima di lasciar passare altri handshake
+                        dopo = len(self.attese[giocatore]) + 1 if giocatore == nero else None
+                        self.passi.append(passo[:5] + (dopo,))
+            elif tipo in (cattura.APERTURA, cattura.RICEVUTO, cattura.FINE_CLIENT):
+                if connessione in handshake:
+                    # Handshake senza accoppiamento (es. nickname rifiutato): resta al suo posto
+                    self.passi.append(handshake.pop(connessione))
+                passo = (microsecondi, connessione, tipo, dati, len(self.attese[connessione]), None)
+                if tipo == cattura.RICEVUTO and connessione not in iniziate:
+                    iniziate.add(connessione)
+                    if dati.startswith("WATCH|"):
+                        self.spettatori.add(connessione)
+                    elif not dati.startswith("RESUME|"):
+                        handshake[connessione] = passo
+                        continue
+                self.passi.append(passo)
+        self.passi.extend(handshake.values())
+
+
+class ConnessioneRiprodotta:
+    def __init__(self, id_connessione, piano, token_nuovi):
+        self.id = id_connessione
+        self.piano = piano
+        self.token_nuovi = token_nuovi
+        self.ricevuti = []
+        self.nuovo_messaggio = asyncio.Event()
+        self.writer = None
+        self.lettura = None
+        self.inviati = 0
+
+    async def apri(self, host, porta):
+        reader, self.writer = await asyncio.open_connection(host, porta)
+        self.lettura = asyncio.ensure_future(self._leggi(reader))
+
+    async def _leggi(self, reader):
+        try:
+            async for messaggio in protocollo.leggi_messaggi_async(reader):
+                if isinstance(messaggio, protocollo.TempoBinario):
+                    continue
+                testo = cattura.testo_evento(messaggio)
+                if testo.startswith("START|") and testo.count("|") >= 2 and self.id in self.piano.token:
+                    self.token_nuovi[self.piano.token[self.id]] = testo.split("|")[2]
+                testo = normalizza(testo)
+                if testo is not None:
+                    self.ricevuti.append(testo)
+                    self.nuovo_messaggio.set()
+        except OSError:
+            pass
+        finally:
+            self.nuovo_messaggio.set()
+
+    async def attendi(self, quante, attesa):
+        """Aspetta che la connessione abbia ricevuto `quante` risposte; False allo scadere."""
+        scadenza = time.monotonic() + attesa
+        while len(self.ricevuti) < quante:
+            if self.lettura.done():
+                return False
+            residuo = scadenza - time.monotonic()
+            if residuo <= 0:
+                return False
+            self.nuovo_messaggio.clear()
+            try:
+                await asyncio.wait_for(self.nuovo_messaggio.wait(), residuo)
+            except asyncio.TimeoutError:
+                return False
+        return True
+
+    def invia(self, testo):
+        if self.writer.is_closing():
+            return
+        if testo.startswith("~"):
+            self.writer.write(bytes.fromhex(testo[1:]))
+        else:
+            if testo.startswith("RESUME|"):
+                parti = testo.split("|")
+                if len(parti) > 1:
+                    parti[1] = self.token_nuovi.get(parti[1], parti[1])
+                    testo = "|".join(parti)
+            self.writer.write(protocollo.codifica(testo))
+        self.inviati += 1
+
+    def chiudi(self):
+        if self.writer is not None:
+            self.writer.close()
+
+
+async def riproduci(piano, opzioni):
+    connessioni = {}
+    token_nuovi = {}
+    risposte = []  # secondi di attesa delle risposte del server prima di un invio
+    scadute = 0
+    inizio = time.monotonic()
+    for microsecondi, id_connessione, tipo, dati, attese, attese_dopo in piano.passi:
+        if opzioni.velocita:
+            ritardo = inizio + microsecondi / 1e6 / opzioni.velocita - time.monotonic()
+            if ritardo > 0:
+                await asyncio.sleep(ritardo)
+        if tipo == cattura.APERTURA:
+            connessione = ConnessioneRiprodotta(id_connessione, piano, token_nuovi)
+            try:
+                await connessione.apri(opzioni.host, opzioni.port)
+            except OSError as errore:
+                print(f"Connessione {id_connessione}: {errore}")
+                continue
+            connessioni[id_connessione] = connessione
+            continue
+        connessione = connessioni.get(id_connessione)
+        if connessione is None:
+            continue
+        attesa = time.monotonic()
+        if not await connessione.attendi(attese, opzioni.attesa):
+            scadute += 1
+        risposte.append(time.monotonic() - attesa)
+        if tipo == cattura.RICEVUTO:
+            connessione.invia(dati)
+            if attese_dopo is not None:
+                if not await connessione.attendi(attese_dopo, opzioni.attesa):
+                    scadute += 1
+            elif connessione.inviati == 1:
+                # Il Bianco deve essere in coda prima che arrivi il Nero
+                await asyncio.sleep(PAUSA_HANDSHAKE)
+        else:
+            connessione.chiudi()
+    # Le ultime risposte (es. GAMEOVER) prima del confronto
+    for id_connessione, connessione in connessioni.items():
+        await connessione.attendi(len(piano.attese[id_connessione]), opzioni.attesa)
+        connessione.chiudi()
+    return connessioni, risposte, scadute, time.monotonic() - inizio
+
+
+def confronta(piano, connessioni, dettagli):
+    """Connessioni i cui messaggi differiscono dalla cattura: (id, indice, atteso, ricevuto)."""
+    differenze = []
+    for id_connessione, connessione in sorted(connessioni.items()):
+        if id_connessione in piano.spettatori:
+            continue
+        attesi = piano.attese[id_connessione]
+        ricevuti = connessione.ricevuti
+        if attesi == ricevuti:
+            continue
+        indice = next(
+            (i for i, (a, r) in enumerate(zip(attesi, ricevuti)) if a != r), min(len(attesi), len(ricevuti))
+        )
+        differenze.append((
+            id_connessione, indice,
+            attesi[indice] if indice < len(attesi) else "<fine>",
+            ricevuti[indice] if indice < len(ricevuti) else "<fine>",
+        ))
+    for id_connessione, indice, atteso, ricevuto in differenze[:dettagli]:
+        print(f"  connessione {id_connessione}, messaggio {indice}: atteso {atteso!r}, ricevuto {ricevuto!r}")
+    return differenze
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Riproduzione di una cattura del traffico Thread-Chess")
+    parser.add_argument("cattura", help="file scritto dal server con --cattura")
+    parser.add_argument("--host", default=carico.INDIRIZZO)
+    parser.add_argument("--port", type=int, default=carico.PORTA)
+    parser.add_argument("--velocita", type=float, default=1.0,
+                        help="multiplo della velocità originale (0 = il più in fretta possibile)")
+    parser.add_argument("--attesa", type=float, default=ATTESA_RISPOSTE,
+                        help="secondi massimi di attesa delle risposte catturate")
+    parser.add_argument("--avvia-server", action="store_true", help="avvia un server headless nuovo")
+    parser.add_argument("--modalita-server", choices=("thread", "asyncio"), default="thread")
+    parser.add_argument("--dettagli", type=int, default=10, help="differenze mostrate")
+    opzioni = parser.parse_args()
+
+    piano = Piano(cattura.leggi(opzioni.cattura))
+    connessioni_catturate = sum(1 for passo in piano.passi if passo[2] == cattura.APERTURA)
+    print(f"Cattura: {connessioni_catturate} connessioni, {len(piano.passi)} eventi, {piano.durata:.1f} s")
+
+    processo = None
+    if opzioni.avvia_server:
+        argomenti = () if opzioni.velocita else ("--senza-limiti",)
+        processo = carico.avvia_server(opzioni.host, opzioni.port, opzioni.modalita_server, *argomenti)
+    try:
+        connessioni, risposte, scadute, durata = asyncio.run(riproduci(piano, opzioni))
+    finally:
+        if processo is not None:
+            processo.terminate()
+            processo.wait()
+
+    inviati = sum(connessione.inviati for connessione in connessioni.values())
+    print(f"Riproduzione: {durata:.2f} s ({inviati / durata if durata else 0:.0f} messaggi/s), "
+          f"attese scadute {scadute}")
+    print("Attesa delle risposte: " + "  ".join(
+        f"p{p}={(carico.percentile(risposte, p) or 0) * 1000:.3f} ms" for p in (50, 95, 99)
+    ))
+    differenze = confronta(piano, connessioni, opzioni.dettagli)
+    confrontate = len([c for c in connessioni if c not in piano.spettatori])
+    print(f"Connessioni identiche: {confrontate - len(differenze)}/{confrontate}")
+    if differenze:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
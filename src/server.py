@@ -1,15 +1,37 @@
+import asyncio
+import os
+import signal
 import socket
 import threading
 import time
-import flet as ft
 import chess
 import re
 import pathlib
-import functools
-
-# Costanti di rete
-INDIRIZZO_SERVER = "localhost"
-PORTA_SERVER = 5000
+import protocollo
+import matchmaking
+import orologio
+import sessioni
+import cache_mosse
+import eventi
+import archivio
+import giornale
+import filtro_parole
+import spettatori
+import uscita
+import limiti
+import metriche
+import tracce
+import cattura
+
+# Costanti di rete (sovrascrivibili da ambiente o da riga di comando, es. nel container)
+INDIRIZZO_SERVER = os.environ.get("INDIRIZZO_SERVER", "localhost")
+PORTA_SERVER = int(os.environ.get("PORTA_SERVER", "5000"))
+BACKLOG_SERVER = 1024  # connessioni in attesa di accept()
+
+# Modalità di gestione delle connessioni:
+# - "thread": un thread bloccante per ogni client (modalità storica)
+# - "asyncio": tutti i client come coroutine su un unico event loop
+MODALITA_SERVER = os.environ.get("MODALITA_SERVER", "thread")
 
 # Valori consentiti per la durata del timer (in secondi)
 MODALITA_CONSENTITE = {0, 60, 180, 300, 600, 1200}
@@ -17,51 +39,105 @@ MODALITA_CONSENTITE = {0, 60, 180, 300, 600, 1200}
 # Liste globali per la gestione
 client_connessi = []
 
-# Struttura sessioni_gioco:
-# [
-#   (socket_g1, nick_g1, durata_timer),
-#   (socket_g2, nick_g2, durata_timer) opzionale finché non si accoppia,
-#   scacchiera_oggetto (chess.Board),
-#   timer_info (dict) - opzionale finché non parte la partita (solo se durata_timer > 0)
-# ]
-sessioni_gioco = []
-
-# Riferimenti UI per il pannello di amministrazione
-contenitore_sessioni = None  # ft.Column che contiene tutte le session card
-ui_sessioni = {}  # mappa id(sessione) -> dict con controlli UI (card, lista mosse, ecc.)
+# Connessioni che hanno negoziato il protocollo binario compatto (vedi protocollo.py)
+client_binari = set()
+
+# Sessioni attive (in attesa o in corso) indicizzate per id, vedi sessioni.py
+sessioni_gioco = sessioni.RegistroSessioni()
+
+# Code di attesa del matchmaking, una per modalità
+code_attesa = matchmaking.Matchmaking(MODALITA_CONSENTITE)
+
+# Orologio centrale: un solo thread per scadenze e invii TIME di tutte le partite
+orologio_partite = orologio.Orologio()
+INTERVALLO_INVIO_TEMPO = 1.0  # secondi tra due TIME| periodici
+
+# Mosse legali per posizione, condivise tra tutte le sessioni
+cache_mosse_legali = cache_mosse.CacheMosse()
+
+# Eventi per pannello admin e log, consegnati fuori dal percorso delle mosse
+bus_eventi = eventi.BusEventi()
+
+# Spettatori delle partite in corso, serviti da un thread diffusore
+tribuna = spettatori.Tribuna()
+
+# Giornale delle partite in corso per il ripristino dopo un crash (None = disattivato)
+giornale_partite = None
+# Archivio PGN delle partite concluse (None = disattivato), chiamato senza passare dal bus
+archivio_partite = None
+ATTESA_RIPRESA = 120.0  # secondi concessi ai giocatori per tornare in una partita ripristinata
+# Secondi concessi a un giocatore disconnesso per riprendere la partita (0 = abbandono immediato)
+FINESTRA_RIPRESA = float(os.environ.get("FINESTRA_RIPRESA", "60"))
+
+# Cattura del traffico dei giocatori (cattura.Cattura, --cattura), None se disattivata
+cattura_traffico = None
+# Limiti di frequenza per connessione (vedi limiti.py); --senza-limiti per i replay veloci
+LIMITI_ATTIVI = True
+
+# Metriche Prometheus, esposte via HTTP solo se è impostata una porta (0 = disattivate)
+INDIRIZZO_METRICHE = os.environ.get("INDIRIZZO_METRICHE", "127.0.0.1")
+PORTA_METRICHE = int(os.environ.get("PORTA_METRICHE", "0"))
+metriche_server = metriche.RegistroMetriche("threadchess")
+mosse_giocate = metriche_server.contatore("mosse_total", "Mosse valide giocate")
+messaggi_chat = metriche_server.contatore("chat_total", "Messaggi di chat inoltrati")
+partite_avviate = metriche_server.contatore("partite_avviate_total", "Partite avviate dal matchmaking")
+tempi_scaduti = metriche_server.contatore("timeout_total", "Partite finite per tempo scaduto")
+ban_eseguiti = metriche_server.contatore("ban_total", "Giocatori bannati dall'admin")
+latenza_mosse = metriche_server.istogramma(
+    "latenza_mossa_secondi", "Gestione di una mossa: attesa del lock, validazione, inoltro"
+)
+latenza_richieste_mosse = metriche_server.istogramma(
+    "latenza_moves_secondi", "Risposta a una richiesta MOVES| (mosse legali di una casella)"
+)
+
+
+def profondita_code_uscita():
+    """Messaggi in coda di uscita (modalità thread) o byte nel buffer del trasporto (asyncio)."""
+    totale = 0
+    for connessione, _, _ in list(client_connessi):
+        try:
+            totale += connessione.in_coda()
+        except:
+            pass
+    return totale
+
+
+metriche_server.misura("client_connessi", "Client connessi (giocatori)", lambda: len(client_connessi))
+metriche_server.misura(
+    "giocatori_in_attesa", "Giocatori in coda di matchmaking per modalità",
+    lambda: code_attesa.in_attesa(), etichetta="modalita",
+)
+metriche_server.misura(
+    "partite_in_corso", "Sessioni con entrambi i giocatori",
+    lambda: sum(1 for sessione in sessioni_gioco.attive() if sessione.iniziata),
+)
+metriche_server.misura("coda_uscita", profondita_code_uscita.__doc__, profondita_code_uscita)
+metriche_server.misura("thread", "Thread del processo", threading.active_count)
+metriche_server.misura(
+    "disconnessi_lenti_total", "Client disconnessi perché non leggevano",
+    lambda: uscita.disconnessi_lenti, tipo="counter",
+)
+metriche_server.misura(
+    "cache_mosse_hit_total", "Richieste di mosse legali servite dalla cache",
+    lambda: cache_mosse_legali.hit, tipo="counter",
+)
+metriche_server.misura(
+    "cache_mosse_miss_total", "Richieste di mosse legali calcolate (posizione non in cache)",
+    lambda: cache_mosse_legali.miss, tipo="counter",
+)
+metriche_server.misura(
+    "cache_mosse_posizioni", "Posizioni nella cache delle mosse legali",
+    lambda: cache_mosse_legali.statistiche()["posizioni"],
+)
+metriche_server.misura(
+    "eventi_scartati_total", "Eventi del bus scartati a coda piena",
+    lambda: bus_eventi.scartati, tipo="counter",
+)
 
 # Percorso del file con le parole vietate (stessa cartella di questo file)
 BAD_WORDS_FILE = pathlib.Path(__file__).with_name("bad_words.txt")
-
-
-@functools.lru_cache(maxsize=1)
-def carica_parole_vietate():
-    """
-    Legge il file bad_words.txt (una parola per riga, minuscolo).
-    Se il file non esiste o non è leggibile, ritorna una piccola lista di default.
-    """
-    try:
-        if BAD_WORDS_FILE.exists():
-            parole = []
-            with BAD_WORDS_FILE.open("r", encoding="utf-8") as f:
-                for riga in f:
-                    riga = riga.strip().lower()
-                    # Salta righe vuote o commenti
-                    if not riga or riga.startswith("#"):
-                        continue
-                    parole.append(riga)
-            if parole:
-                return parole
-    except Exception:
-        pass
-
-    # Fallback minimale se il file manca o è vuoto
-    return [
-        "cazzo",
-        "merda",
-        "stronzo",
-        "vaffanculo",
-    ]
+# Ricaricato da solo quando il file cambia, senza riavviare il server
+filtro_parole_vietate = filtro_parole.FiltroParole(BAD_WORDS_FILE)
 
 
 def nickname_valido(nickname: str) -> bool:
@@ -82,27 +158,24 @@ def nickname_valido(nickname: str) -> bool:
     if not re.fullmatch(r"[A-Za-z0-9_]+", nickname):
         return False
 
-    # Lista di parole vietate caricata dal file (o fallback)
-    parole_vietate = carica_parole_vietate()
-
-    nick_lower = nickname.lower()
-    for parola in parole_vietate:
-        if parola in nick_lower:
-            return False
+    # Parole vietate (dal file o predefinite), in una sola passata
+    if filtro_parole_vietate.contiene(nickname):
+        return False
 
     return True
 
-def notifica_fine_partita(sessione, risultato, pagina):
+def notifica_fine_partita(sessione, risultato, terminazione="normal"):
     """
     Invia ai giocatori un messaggio di fine partita in base al risultato.
     risultato: stringa restituita da chess.Board().result() -> "1-0", "0-1", "1/2-1/2"
+    terminazione: motivo in forma PGN ("normal", "time forfeit", ...), per archivio e log
     """
-    if len(sessione) < 2:
+    if len(sessione.giocatori) < 2:
         return
 
     # Gli elementi dei giocatori sono tuple (socket, nickname, durata_timer)
-    socket_g1, nick_g1, _ = sessione[0]
-    socket_g2, nick_g2, _ = sessione[1]
+    socket_g1, nick_g1, _ = sessione.giocatori[0]
+    socket_g2, nick_g2, _ = sessione.giocatori[1]
 
     if risultato == "1-0":
         # Bianco vince
@@ -118,16 +191,38 @@ def notifica_fine_partita(sessione, risultato, pagina):
         messaggio_nero = "GAMEOVER|DRAW"
 
     try:
-        socket_g1.send(messaggio_bianco.encode())
+        socket_g1.send(protocollo.codifica(messaggio_bianco))
     except:
         pass
     try:
-        socket_g2.send(messaggio_nero.encode())
+        socket_g2.send(protocollo.codifica(messaggio_nero))
     except:
         pass
 
-    pagina.add(ft.Text(f"Partita finita: {risultato}"))
-    pagina.update()
+    pubblica_fine_partita(sessione, risultato, terminazione)
+
+
+def pubblica_fine_partita(sessione, risultato, terminazione):
+    """Esito della partita agli spettatori (che vengono poi chiusi), all'archivio e agli iscritti del bus."""
+    tribuna.fine(sessione, risultato, terminazione)
+    if archivio_partite is not None:
+        archivio_partite.partita_finita(sessione, risultato, terminazione)
+    bus_eventi.pubblica("partita_finita", sessione, risultato, terminazione)
+
+
+def rimuovi_sessione(sessione):
+    """
+    Toglie la sessione da quelle attive e annulla i suoi eventi sull'orologio centrale.
+    Ritorna False se era già stata rimossa (es. da un altro thread).
+    """
+    orologio_partite.annulla(sessione.evento_scadenza)
+    orologio_partite.annulla(sessione.evento_tempo)
+    for evento in sessione.scadenze_ripresa:
+        orologio_partite.annulla(evento)
+    rimossa = sessioni_gioco.rimuovi(sessione)
+    if rimossa and sessione.iniziata and giornale_partite is not None:
+        giornale_partite.fine(sessione)
+    return rimossa
 
 
 def avvisa_avversario_abbandono(sessione, indice_giocatore_che_abbandona):
@@ -136,10 +231,10 @@ def avvisa_avversario_abbandono(sessione, indice_giocatore_che_abbandona):
     """
     try:
         indice_avversario = 1 if indice_giocatore_che_abbandona == 0 else 0
-        if len(sessione) > indice_avversario:
-            socket_avversario = sessione[indice_avversario][0]
+        if len(sessione.giocatori) > indice_avversario:
+            socket_avversario = sessione.giocatori[indice_avversario][0]
             try:
-                socket_avversario.send("GAMEOVER|OPPONENT_LEFT".encode())
+                socket_avversario.send(protocollo.codifica("GAMEOVER|OPPONENT_LEFT"))
             except:
                 pass
             try:
@@ -150,487 +245,956 @@ def avvisa_avversario_abbandono(sessione, indice_giocatore_che_abbandona):
         pass
 
 
-def crea_ui_sessione(sessione, durata_sessione, pagina):
+def chiudi_sessione_da_admin(sessione, motivo, esito_forzato):
     """
-    Crea una scheda grafica per una nuova sessione.
+    Chiusura anticipata della sessione da parte dell'admin.
+    esito_forzato: "DRAW" per patta amministrativa.
     """
-    global contenitore_sessioni, ui_sessioni
-    if contenitore_sessioni is None:
-        return
+    with sessione.lock:
+        if len(sessione.giocatori) < 2 or sessione not in sessioni_gioco:
+            return
 
-    sid = id(sessione)
-    socket_g1, nick_g1, _ = sessione[0]
-    socket_g2, nick_g2, _ = sessione[1]
+        try:
+            socket_g1, nick_g1, _ = sessione.giocatori[0]
+            socket_g2, nick_g2, _ = sessione.giocatori[1]
 
-    descr_timer = "No time" if durata_sessione == 0 else f"{int(durata_sessione // 60)}' per lato"
+            if esito_forzato == "DRAW":
+                mess1 = "GAMEOVER|DRAW"
+                mess2 = "GAMEOVER|DRAW"
+            else:
+                mess1 = "GAMEOVER|DRAW"
+                mess2 = "GAMEOVER|DRAW"
 
-    titolo = ft.Text(
-        f"Sessione #{sid} - {nick_g1} (Bianco) vs {nick_g2} (Nero) - {descr_timer}",
-        weight="bold",
-    )
+            try:
+                socket_g1.send(protocollo.codifica(mess1))
+            except:
+                pass
+            try:
+                socket_g2.send(protocollo.codifica(mess2))
+            except:
+                pass
 
-    # UI Mosse
-    lista_mosse = ft.ListView(expand=1, spacing=2, padding=5, auto_scroll=True, height=100)
-    # UI Chat (NUOVO)
-    lista_chat = ft.ListView(expand=1, spacing=2, padding=5, auto_scroll=True, height=100)
-    
-    testo_stato = ft.Text("In corso", color="green")
-
-    def chiudi_sessione_admin(e):
-        chiudi_sessione_da_admin(sessione, motivo="Chiusura manuale (patta)", esito_forzato="DRAW", pagina=pagina)
-
-    def banna_bianco(e):
-        banna_giocatore(sessione, indice_bannato=0, pagina=pagina)
-
-    def banna_nero(e):
-        banna_giocatore(sessione, indice_bannato=1, pagina=pagina)
-
-    pulsanti = ft.Row(
-        [
-            ft.ElevatedButton("Chiudi sessione", on_click=chiudi_sessione_admin),
-            ft.TextButton("Banna Bianco", on_click=banna_bianco),
-            ft.TextButton("Banna Nero", on_click=banna_nero),
-        ],
-        spacing=10,
-    )
+            try:
+                socket_g1.close()
+            except:
+                pass
+            try:
+                socket_g2.close()
+            except:
+                pass
+        finally:
+            rimuovi_sessione(sessione)
+            bus_eventi.pubblica("sessione_chiusa", sessione, f"Chiusa: {motivo}")
+            pubblica_fine_partita(sessione, "1/2-1/2", "adjudication")
 
-    card = ft.Card(
-        content=ft.Container(
-            content=ft.Column(
-                [
-                    titolo,
-                    pulsanti,
-                    ft.Text("Mosse:", weight="bold"),
-                    ft.Container(content=lista_mosse, border=ft.border.all(1, "grey"), border_radius=5, height=100),
-                    ft.Text("Chat:", weight="bold"),
-                    ft.Container(content=lista_chat, border=ft.border.all(1, "grey"), border_radius=5, height=100),
-                    testo_stato,
-                ],
-                spacing=5,
-            ),
-            padding=10,
-        )
-    )
 
-    ui_sessioni[sid] = {
-        "card": card,
-        "lista_mosse": lista_mosse,
-        "lista_chat": lista_chat, # Salviamo il riferimento
-        "testo_stato": testo_stato,
-    }
+def banna_giocatore(sessione, indice_bannato):
+    """
+    Banna un giocatore:
+    - il bannato perde
+    - l'altro vince
+    - la sessione viene chiusa
+    """
+    with sessione.lock:
+        if len(sessione.giocatori) < 2 or sessione not in sessioni_gioco:
+            return
 
-    contenitore_sessioni.controls.append(card)
-    pagina.update()
+        vincitore = 1 - indice_bannato
+        try:
+            socket_bannato, nick_bannato, _ = sessione.giocatori[indice_bannato]
+            socket_vincitore, nick_vincitore, _ = sessione.giocatori[vincitore]
 
+            try:
+                socket_bannato.send(protocollo.codifica("GAMEOVER|LOSE"))
+            except:
+                pass
+            try:
+                socket_vincitore.send(protocollo.codifica("GAMEOVER|WIN"))
+            except:
+                pass
 
-def log_mossa_sessione(sessione, nickname, mossa, pagina):
-    """Aggiunge una mossa alla lista delle mosse della UI admin"""
-    global ui_sessioni
-    sid = id(sessione)
-    ui = ui_sessioni.get(sid)
-    if not ui:
-        return
-    testo = ft.Text(f"{nickname}: {mossa}", size=12)
-    ui["lista_mosse"].controls.append(testo)
-    pagina.update()
+            try:
+                socket_bannato.close()
+            except:
+                pass
+            try:
+                socket_vincitore.close()
+            except:
+                pass
+        finally:
+            rimuovi_sessione(sessione)
+            ban_eseguiti.incrementa()
+            bus_eventi.pubblica("ban", sessione, nick_bannato)
+            bus_eventi.pubblica(
+                "sessione_chiusa",
+                sessione,
+                f"Chiusura: {nick_bannato} bannato, vittoria a {nick_vincitore}",
+            )
+            risultato = "0-1" if indice_bannato == 0 else "1-0"
+            pubblica_fine_partita(sessione, risultato, "rules infraction")
+
+
+def interpreta_handshake(prima_risposta):
+    """
+    Interpreta il primo messaggio del client (formato: "nickname|secondi[|BIN1]").
+    Ritorna (nickname, durata_timer, binario); la durata ricade sul default
+    se manca o non è tra le MODALITA_CONSENTITE, binario indica se il client
+    ha chiesto il protocollo binario compatto.
+    """
+    parti = prima_risposta.split("|")
+    nickname = (parti[0] if parti else "").strip()
+
+    durata_timer_richiesta = 600  # default di sicurezza
+    if len(parti) >= 2:
+        try:
+            durata_parsata = int(float(parti[1]))
+            if durata_parsata in MODALITA_CONSENTITE:
+                durata_timer_richiesta = durata_parsata
+        except ValueError:
+            pass
+    binario = protocollo.CAPACITA_BINARIA in parti[2:]
+    return nickname, durata_timer_richiesta, binario
 
 
-def log_chat_sessione(sessione, mittente, messaggio, pagina):
-    """Aggiunge un messaggio alla chat della UI admin"""
-    global ui_sessioni
-    sid = id(sessione)
-    ui = ui_sessioni.get(sid)
-    if not ui:
-        return
-    testo = ft.Text(f"[{mittente}]: {messaggio}", size=12)
-    ui["lista_chat"].controls.append(testo)
-    pagina.update()
+def negozia_protocollo(socket_client, binario):
+    """Conferma al client il protocollo binario, se richiesto, prima di ogni altro messaggio."""
+    if binario:
+        client_binari.add(socket_client)
+        socket_client.send(protocollo.codifica(f"PROTO|{protocollo.CAPACITA_BINARIA}"))
 
 
-def marca_sessione_chiusa(sessione, testo, colore="red", pagina=None):
-    """Aggiorna lo stato visivo di una sessione quando viene chiusa."""
-    global ui_sessioni, contenitore_sessioni
-    sid = id(sessione)
-    ui = ui_sessioni.get(sid)
-    if not ui:
-        return
-    ui["testo_stato"].value = testo
-    ui["testo_stato"].color = colore
-    if pagina:
-        pagina.update()
+def invia_mossa(socket_destinatario, mossa):
+    """Invia una mossa nel formato negoziato dal destinatario (UCI testuale o binario)."""
+    if socket_destinatario in client_binari:
+        socket_destinatario.send(protocollo.codifica_mossa(mossa))
+    else:
+        socket_destinatario.send(protocollo.codifica(mossa.uci()))
 
 
-def chiudi_sessione_da_admin(sessione, motivo, esito_forzato, pagina):
+def rifiuta_connessione(socket_client, indirizzo_ip, nickname):
+    """Rifiuta un client con nickname non valido e chiude la connessione."""
+    try:
+        socket_client.send(protocollo.codifica("ERROR|Nickname non valido"))
+    except:
+        pass
+    try:
+        socket_client.close()
+    except:
+        pass
+    bus_eventi.pubblica("avviso", f"Connessione rifiutata da {indirizzo_ip}: nickname non valido ({nickname!r})")
+
+
+def accoppia_giocatore(socket_client, nickname, durata_timer_richiesta):
     """
-    Chiusura anticipata della sessione da parte dell'admin.
-    esito_forzato: "DRAW" per patta amministrativa.
+    Matchmaking: prende il primo giocatore in coda con la stessa durata,
+    altrimenti crea una nuova sessione con il client come Bianco e lo mette in coda.
+    Ritorna la coppia (sessione, indice_giocatore) con 0 = Bianco, 1 = Nero.
     """
-    if len(sessione) < 2:
-        return
+    giocatore = (socket_client, nickname, durata_timer_richiesta)
 
-    try:
-        socket_g1, nick_g1, _ = sessione[0]
-        socket_g2, nick_g2, _ = sessione[1]
+    while True:
+        nuova_sessione = sessioni.Sessione(giocatore)
+
+        # Accoppiamento atomico in O(1): nessuna scansione delle sessioni.
+        # Il lock della nuova sessione è tenuto finché non è registrata, così chi la
+        # preleva dalla coda aspetta che sia visibile nel registro.
+        with nuova_sessione.lock:
+            sessione = code_attesa.accoppia(durata_timer_richiesta, nuova_sessione)
+            if sessione is None:
+                # Nessuno in attesa con la stessa durata: resto in coda come primo giocatore
+                sessioni_gioco.aggiungi(nuova_sessione)
+                return nuova_sessione, 0 # Sono il Bianco
+
+        with sessione.lock:
+            # Il giocatore in attesa si è disconnesso mentre lo prelevavamo: riprova
+            if sessione not in sessioni_gioco:
+                continue
 
-        if esito_forzato == "DRAW":
-            mess1 = "GAMEOVER|DRAW"
-            mess2 = "GAMEOVER|DRAW"
-        else:
-            mess1 = "GAMEOVER|DRAW"
-            mess2 = "GAMEOVER|DRAW"
+            durata_sessione = sessione.durata
+            # Mi aggiungo come secondo giocatore: ora siamo in 2, creiamo la Scacchiera e iniziamo!
+            sessione.avvia(giocatore)
+            sessioni_gioco.indicizza_token(sessione)
+            if giornale_partite is not None:
+                giornale_partite.inizio(sessione)
+
+            socket_g1, nick_g1, _ = sessione.giocatori[0]
+            socket_g2, nick_g2, _ = sessione.giocatori[1]
+
+            print(f"START: {nick_g1} vs {nick_g2} (timer: {durata_sessione}s)")
+
+            # Avvisa gli iscritti al bus (es. scheda grafica nel pannello admin)
+            partite_avviate.incrementa()
+            bus_eventi.pubblica("sessione_iniziata", sessione)
+
+            if cattura_traffico is not None:
+                cattura_traffico.accoppiamento(sessione, socket_g1, socket_g2)
+            # Invio segnale di start, assegnazione colori e token di ripresa
+            socket_g1.send(protocollo.codifica(f"START|WHITE|{sessione.token[0]}"))
+            socket_g2.send(protocollo.codifica(f"START|BLACK|{sessione.token[1]}"))
 
+            if sessione.con_timer:
+                invia_tempo_ai_giocatori(sessione)
+                avvia_timer_sessione(sessione)
+            return sessione, 1 # Sono il Nero
+
+
+def riprendi_sessione(connessione, richiesta):
+    """
+    Handshake di ripresa ("RESUME|token[|semimosse][|BIN1]"): riaggancia il client al
+    suo posto nella partita e gli invia solo le mosse che non ha ("RESUME|da|uci,uci,...",
+    a partire dalla semimossa "da") e gli orologi. Se il posto risulta ancora occupato
+    (connessione morta non ancora rilevata) la vecchia connessione viene sostituita.
+    Ritorna (sessione, indice_giocatore, nickname), o None se la partita non esiste più.
+    """
+    parti = richiesta.split("|")
+    semimosse_client = int(parti[2]) if len(parti) > 2 and parti[2].isdigit() else 0
+    trovata = sessioni_gioco.per_token(parti[1] if len(parti) > 1 else "")
+    if trovata is None:
+        connessione.send(protocollo.codifica("GAMEOVER|EXPIRED"))
+        connessione.close()
+        return None
+
+    sessione, indice_giocatore = trovata
+    with sessione.lock:
+        if sessione not in sessioni_gioco:
+            connessione.send(protocollo.codifica("GAMEOVER|EXPIRED"))
+            connessione.close()
+            return None
+
+        negozia_protocollo(connessione, protocollo.CAPACITA_BINARIA in parti[2:])
+        vecchia_connessione, nickname, durata = sessione.giocatori[indice_giocatore]
+        sessione.giocatori[indice_giocatore] = (connessione, nickname, durata)
+        client_connessi.append((connessione, nickname, durata))
+        # Il thread della vecchia connessione, chiudendosi, non tocca più la sessione
         try:
-            socket_g1.send(mess1.encode())
+            vecchia_connessione.shutdown(socket.SHUT_RDWR)  # sblocca la recv() in modalità thread
         except:
             pass
         try:
-            socket_g2.send(mess2.encode())
+            vecchia_connessione.close()
         except:
             pass
-
+        orologio_partite.annulla(sessione.scadenze_ripresa[indice_giocatore])
+        sessione.scadenze_ripresa[indice_giocatore] = None
+        print(f"[RIPRESA] {nickname} nella sessione #{sessione.id}")
+
+        # Solo le semimosse mancanti al client (delta dalla sua ultima semimossa)
+        move_stack = sessione.scacchiera.move_stack
+        da_semimossa = min(semimosse_client, len(move_stack))
+        mosse = ",".join(mossa.uci() for mossa in move_stack[da_semimossa:])
+        connessione.send(protocollo.codifica(f"RESUME|{da_semimossa}|{mosse}"))
         try:
-            socket_g1.close()
+            sessione.giocatori[1 - indice_giocatore][0].send(protocollo.codifica("OPPONENT|RECONNECTED"))
         except:
             pass
+
+        # Tornati entrambi: la partita riparte da dove si era fermata
+        if sessione.sospesa and not sessione.assenti():
+            sessione.sospesa = False
+            orologio_partite.annulla(sessione.evento_scadenza)
+            sessione.ultimo_tick = time.monotonic()
+            if sessione.con_timer:
+                avvia_timer_sessione(sessione)
+            bus_eventi.pubblica("avviso", f"Sessione #{sessione.id} ripresa")
+        if sessione.con_timer:
+            invia_tempo_ai_giocatori(sessione)
+    return sessione, indice_giocatore, nickname
+
+
+def aggancia_spettatore(connessione, richiesta, crea_spettatore):
+    """
+    Handshake spettatore ("WATCH|id_sessione[|BIN1]"): crea con crea_spettatore(binario)
+    lo spettatore adatto alla modalità del server, gli accoda la fotografia della partita
+    e lo aggiunge alla tribuna. Ritorna (sessione, spettatore), o None se la partita
+    non esiste o non è ancora iniziata.
+    """
+    parti = richiesta.split("|")
+    id_sessione = int(parti[1]) if len(parti) > 1 and parti[1].isdigit() else -1
+    sessione = sessioni_gioco.get(id_sessione)
+    if sessione is None or not sessione.iniziata:
         try:
-            socket_g2.close()
+            connessione.send(protocollo.codifica("ERROR|Partita inesistente"))
         except:
             pass
-    finally:
-        if sessione in sessioni_gioco:
-            sessioni_gioco.remove(sessione)
-        marca_sessione_chiusa(sessione, f"Chiusa: {motivo}", pagina=pagina)
+        return None
 
+    binario = protocollo.CAPACITA_BINARIA in parti[2:]
+    with sessione.lock:
+        if sessione not in sessioni_gioco:
+            connessione.send(protocollo.codifica("GAMEOVER|EXPIRED"))
+            return None
+        spettatore = crea_spettatore(binario)
+        # Fotografia e iscrizione sotto il lock: nessuna mossa può finire tra le due
+        if binario:
+            spettatore.accoda(protocollo.codifica(f"PROTO|{protocollo.CAPACITA_BINARIA}"))
+        mosse = ",".join(mossa.uci() for mossa in sessione.scacchiera.move_stack)
+        spettatore.accoda(protocollo.codifica(
+            f"WATCH|{sessione.id}|{sessione.giocatori[0][1]}|{sessione.giocatori[1][1]}"
+            f"|{sessione.durata}|{mosse}"
+        ))
+        if sessione.con_timer:
+            if binario:
+                spettatore.accoda(protocollo.codifica_tempo(
+                    sessione.tempo_bianco * 1000, sessione.tempo_nero * 1000
+                ))
+            else:
+                spettatore.accoda(protocollo.codifica(
+                    f"TIME|{max(0, int(sessione.tempo_bianco))}|{max(0, int(sessione.tempo_nero))}"
+                ))
+        tribuna.aggiungi(sessione.id, spettatore)
+    bus_eventi.pubblica(
+        "avviso", f"Spettatore sulla sessione #{sessione.id} ({tribuna.quanti(sessione.id)} in tutto)"
+    )
+    return sessione, spettatore
+
+
+def ripristina_sessioni():
+    """Ricostruisce dal giornale le partite interrotte e compatta il giornale."""
+    for partita in giornale_partite.leggi():
+        bianco, nero = partita.nickname
+        sessione = sessioni.Sessione((sessioni.ConnessioneAssente(), bianco, partita.durata))
+        sessione.avvia((sessioni.ConnessioneAssente(), nero, partita.durata))
+        sessione.id = partita.id
+        sessione.token = list(partita.token)
+        sessioni.riserva_id(partita.id)
+        for uci in partita.mosse:
+            try:
+                mossa = chess.Move.from_uci(uci)
+            except ValueError:
+                break
+            if not sessione.scacchiera.is_legal(mossa):
+                break
+            sessione.gioca(mossa)
+        sessione.tempo_bianco = partita.ms_bianco / 1000
+        sessione.tempo_nero = partita.ms_nero / 1000
+        # Orologi fermi finché non sono tornati entrambi i giocatori
+        sessione.sospesa = True
+        sessioni_gioco.aggiungi(sessione)
+        orologio_partite.avvia()
+        sessione.evento_scadenza = orologio_partite.pianifica(ATTESA_RIPRESA, scadenza_ripresa, sessione)
+        bus_eventi.pubblica("sessione_iniziata", sessione)
+        print(f"RIPRISTINATA: sessione #{sessione.id} {bianco} vs {nero} ({len(partita.mosse)} semimosse)")
+    giornale_partite.avvia(sessioni_gioco.attive)
+
+
+def scadenza_ripresa(sessione):
+    """Evento dell'orologio: chi non è tornato in una partita ripristinata la perde per abbandono."""
+    with sessione.lock:
+        if sessione not in sessioni_gioco or not sessione.sospesa:
+            return
+        assenti = sessione.assenti()
+        rimuovi_sessione(sessione)
+        if len(assenti) == 1:
+            avvisa_avversario_abbandono(sessione, assenti[0])
+            risultato = "0-1" if assenti[0] == 0 else "1-0"
+        else:
+            risultato = "*"
+        bus_eventi.pubblica("sessione_chiusa", sessione, "Non ripresa dopo il riavvio")
+        pubblica_fine_partita(sessione, risultato, "abandoned")
 
-def banna_giocatore(sessione, indice_bannato, pagina):
+
+def sospendi_giocatore(sessione, indice_giocatore):
     """
-    Banna un giocatore:
-    - il bannato perde
-    - l'altro vince
-    - la sessione viene chiusa
+    Il giocatore si è disconnesso a partita in corso: il suo posto resta libero per
+    FINESTRA_RIPRESA secondi (l'orologio continua a correre), poi perde per abbandono.
+    Da chiamare con il lock della sessione preso.
     """
-    if len(sessione) < 2:
-        return
-
-    vincitore = 1 - indice_bannato
+    _, nickname, durata = sessione.giocatori[indice_giocatore]
+    sessione.giocatori[indice_giocatore] = (sessioni.ConnessioneAssente(), nickname, durata)
+    # Le partite ripristinate e ancora sospese hanno già la loro scadenza (ATTESA_RIPRESA)
+    if not sessione.sospesa:
+        orologio_partite.avvia()
+        orologio_partite.annulla(sessione.scadenze_ripresa[indice_giocatore])
+        sessione.scadenze_ripresa[indice_giocatore] = orologio_partite.pianifica(
+            FINESTRA_RIPRESA, fine_finestra_ripresa, sessione, indice_giocatore
+        )
     try:
-        socket_bannato, nick_bannato, _ = sessione[indice_bannato]
-        socket_vincitore, nick_vincitore, _ = sessione[vincitore]
+        sessione.giocatori[1 - indice_giocatore][0].send(
+            protocollo.codifica(f"OPPONENT|DISCONNECTED|{FINESTRA_RIPRESA:g}")
+        )
+    except:
+        pass
+    bus_eventi.pubblica("avviso", f"Sessione #{sessione.id}: {nickname} disconnesso, in attesa di ripresa")
 
+
+def fine_finestra_ripresa(sessione, indice_giocatore):
+    """Evento dell'orologio: il giocatore non è tornato in tempo e perde per abbandono."""
+    with sessione.lock:
+        sessione.scadenze_ripresa[indice_giocatore] = None
+        if sessione not in sessioni_gioco or indice_giocatore not in sessione.assenti():
+            return
+        rimuovi_sessione(sessione)
+        avvisa_avversario_abbandono(sessione, indice_giocatore)
+        nickname = sessione.giocatori[indice_giocatore][1]
+        bus_eventi.pubblica("sessione_chiusa", sessione, f"Abbandono: {nickname}")
+        risultato = "0-1" if indice_giocatore == 0 else "1-0"
+        pubblica_fine_partita(sessione, risultato, "abandoned")
+
+
+def mosse_legali_sessione(sessione):
+    """Tabella delle mosse legali della posizione corrente, calcolata al più una volta per mossa."""
+    if sessione.mosse_legali is None:
+        sessione.mosse_legali = cache_mosse_legali.tabella(sessione.scacchiera, sessione.chiave)
+    return sessione.mosse_legali
+
+
+def esito_partita(sessione):
+    """
+    Fine partita dopo l'ultima mossa (chess.Outcome o None), a costo costante per mossa.
+    La tabella delle mosse legali calcolata qui serve poi all'avversario (MOVES| e validazione).
+    """
+    return sessione.esito(bool(mosse_legali_sessione(sessione).mosse))
+
+
+def elabora_messaggio(socket_client, nickname, indice_giocatore, sessione_corrente, messaggio,
+                      limiti_client=None, istante_ricezione=None):
+    """
+    Logica autorevole del server per un singolo messaggio ricevuto durante la partita.
+    Ritorna False quando la connessione va chiusa (fine partita o flood), True altrimenti.
+    istante_ricezione (perf_counter_ns del blocco ricevuto) serve solo al tracciamento.
+    """
+    if not isinstance(messaggio, (str, chess.Move)):
+        # Record binario che solo il server invia (es. TempoBinario): rifiutato, la connessione resta
         try:
-            socket_bannato.send("GAMEOVER|LOSE".encode())
-        except:
-            pass
-        try:
-            socket_vincitore.send("GAMEOVER|WIN".encode())
+            socket_client.send(protocollo.codifica("ERROR|Record binario non valido"))
         except:
             pass
+        return True
+    inizio = time.perf_counter()
+    tipo = limiti.tipo_messaggio(messaggio)
+    traccia = None
+    if tracce.ATTIVO and tipo is None:
+        traccia = tracce.Traccia(sessione_corrente.id, nickname, istante_ricezione)
+        traccia.tappa("ricezione")
+    # Limiti di frequenza prima di qualunque lavoro (e senza prendere il lock)
+    if limiti_client is not None and tipo is not None:
+        esito = limiti_client.controlla(tipo)
+        if esito != limiti.CONSENTITO:
+            return rifiuta_per_limite(socket_client, nickname, sessione_corrente, tipo, esito)
+
+    # Il lock della sessione serializza i due giocatori, l'orologio centrale e l'admin
+    with sessione_corrente.lock:
+        # Controllo se la partita è effettivamente iniziata (ci sono 2 player e la scacchiera)
+        if not sessione_corrente.iniziata:
+            return True
+        # Partita già chiusa da un altro thread (timeout, admin, avversario uscito)
+        if sessione_corrente not in sessioni_gioco:
+            return False
+        if traccia is not None:
+            traccia.tappa("lock")
+        continua = elabora_messaggio_partita(
+            socket_client, nickname, indice_giocatore, sessione_corrente, messaggio, traccia
+        )
+    if traccia is not None and traccia.mossa is not None:
+        tracce.registra(traccia)
+
+    if tipo == "MOVES":
+        latenza_richieste_mosse.osserva(time.perf_counter() - inizio)
+    elif tipo is None and (isinstance(messaggio, chess.Move) or "|" not in messaggio):
+        latenza_mosse.osserva(time.perf_counter() - inizio)
+    return continua
+
+
+def limiti_posto(sessione, indice_giocatore):
+    """
+    Limiti di frequenza del posto in partita (None se disattivati). Restano sulla
+    sessione e non sulla connessione: chi viene disconnesso per flood e torna con
+    RESUME| ritrova i secchi vuoti invece che pieni.
+    """
+    if not LIMITI_ATTIVI or indice_giocatore not in (0, 1):
+        return None
+    with sessione.lock:
+        if sessione.limiti[indice_giocatore] is None:
+            sessione.limiti[indice_giocatore] = limiti.LimitiConnessione(sessione.durata)
+        return sessione.limiti[indice_giocatore]
+
 
+def rifiuta_per_limite(socket_client, nickname, sessione, tipo, esito):
+    """Risponde a un messaggio oltre il limite; ritorna False se il client va disconnesso."""
+    disconnetti = esito == limiti.DISCONNETTI
+    try:
+        if disconnetti:
+            socket_client.send(protocollo.codifica("ERROR|Troppi messaggi, disconnesso"))
+        else:
+            socket_client.send(protocollo.codifica(f"ERROR|Troppi messaggi {tipo}, rallenta"))
+    except:
+        pass
+    bus_eventi.pubblica("limite", sessione, nickname, tipo, disconnetti)
+    return not disconnetti
+
+
+def elabora_messaggio_partita(socket_client, nickname, indice_giocatore, sessione_corrente, messaggio,
+                              traccia=None):
+    """
+    Come elabora_messaggio, per una partita iniziata e con il lock della sessione già preso.
+    traccia (tracce.Traccia o None) raccoglie le tappe del percorso di una mossa.
+    """
+    scacchiera = sessione_corrente.scacchiera # Recupero l'oggetto chess.Board
+    timer_info_presente = sessione_corrente.con_timer
+
+    if timer_info_presente:
+        colore_scaduto = aggiorna_timer(sessione_corrente)
+        if colore_scaduto:
+            gestisci_timeout(sessione_corrente, colore_scaduto)
+            return False
+    if traccia is not None:
+        traccia.tappa("orologio")
+
+    # CONTROLLO 1: È il turno di questo socket?
+    # scacchiera.turn è True per il Bianco, False per il Nero
+    # indice_giocatore è 0 per il Bianco, 1 per il Nero
+    e_turno_bianco = scacchiera.turn
+    sono_il_bianco = (indice_giocatore == 0)
+    # Le mosse in formato binario arrivano già decodificate come chess.Move
+    mossa_binaria = isinstance(messaggio, chess.Move)
+    # Gestione CHAT
+    if not mossa_binaria and messaggio.startswith("CHAT|"):
         try:
-            socket_bannato.close()
-        except:
-            pass
+            # Dividiamo solo alla prima pipe, così il messaggio può contenere pipe
+            _, contenuto_chat = messaggio.split("|", 1)
+            contenuto_chat = filtro_parole_vietate.censura(contenuto_chat.strip())
+
+            if contenuto_chat:
+                # Costruiamo il pacchetto da inviare ai client
+                msg_out = f"CHAT|{nickname}|{contenuto_chat}"
+
+                # Invio a entrambi i giocatori
+                for g in sessione_corrente.giocatori: # g è (socket, nick, timer)
+                    try:
+                        g[0].send(protocollo.codifica(msg_out))
+                    except:
+                        pass
+
+                messaggi_chat.incrementa()
+                tribuna.chat(sessione_corrente, nickname, contenuto_chat)
+                # Log lato admin
+                bus_eventi.pubblica("chat", sessione_corrente, nickname, contenuto_chat)
+        except Exception as e:
+            print(f"Errore chat: {e}")
+        return True # Passa al prossimo messaggio
+    # Gestione richiesta mosse valide
+    if not mossa_binaria and messaggio.startswith("MOVES|"):
+        if e_turno_bianco != sono_il_bianco:
+            socket_client.send(protocollo.codifica("MOVES|"))  # Nessuna mossa valida se non è il tuo turno
+            return True
+
         try:
-            socket_vincitore.close()
+            casella_richiesta = messaggio.split("|")[1]
+            square = chess.parse_square(casella_richiesta)
+            pezzo = scacchiera.piece_at(square)
+
+            # Verifica che ci sia un pezzo e che sia del colore del giocatore
+            if pezzo and pezzo.color == (chess.WHITE if sono_il_bianco else chess.BLACK):
+                # Mosse legali da questa casella, dalla tabella della posizione corrente
+                mosse_valide = mosse_legali_sessione(sessione_corrente).da_casella(square)
+                caselle_valide = [chess.square_name(m.to_square) for m in mosse_valide]
+                risposta = f"MOVES|{','.join(caselle_valide)}"
+                socket_client.send(protocollo.codifica(risposta))
+            else:
+                socket_client.send(protocollo.codifica("MOVES|"))  # Nessuna mossa valida
         except:
-            pass
-    finally:
-        if sessione in sessioni_gioco:
-            sessioni_gioco.remove(sessione)
-        marca_sessione_chiusa(
-            sessione,
-            f"Chiusura: {nick_bannato} bannato, vittoria a {nick_vincitore}",
-            pagina=pagina,
-        )
+            socket_client.send(protocollo.codifica("MOVES|"))  # Errore nel parsing
+        return True
+
+    # Abbandono esplicito: a differenza di una disconnessione non lascia finestra di ripresa
+    if not mossa_binaria and messaggio.startswith("RESIGN|"):
+        rimuovi_sessione(sessione_corrente)
+        avvisa_avversario_abbandono(sessione_corrente, indice_giocatore)
+        bus_eventi.pubblica("sessione_chiusa", sessione_corrente, f"Abbandono: {nickname}")
+        risultato = "0-1" if indice_giocatore == 0 else "1-0"
+        pubblica_fine_partita(sessione_corrente, risultato, "abandoned")
+        return False
+
+    if sessione_corrente.sospesa:
+        socket_client.send(protocollo.codifica("ERROR|In attesa che l'avversario si riconnetta"))
+        return True
 
+    if e_turno_bianco != sono_il_bianco:
+        print(f"Mossa rifiutata: non è il turno di {nickname}")
+        socket_client.send(protocollo.codifica("ERROR|Non è il tuo turno"))
+        return True
+    if traccia is not None:
+        traccia.tappa("turno")
 
-def gestisci_client(socket_client, indirizzo_ip, pagina):
+    # CONTROLLO 2: La mossa è valida secondo le regole degli scacchi?
+    try:
+        mossa = messaggio if mossa_binaria else chess.Move.from_uci(messaggio)
+        if mossa_binaria:
+            messaggio = mossa.uci()  # forma testuale per log e admin
+        legale = mossa in mosse_legali_sessione(sessione_corrente).mosse
+        if traccia is not None:
+            traccia.mossa = messaggio
+            traccia.tappa("legalita")
+        if legale:
+            # VALIDAZIONE OK: Eseguiamo la mossa sulla scacchiera del Server
+            sessione_corrente.gioca(mossa)
+            mosse_giocate.incrementa()
+            if traccia is not None:
+                traccia.tappa("push")
+            # Giornale (solo accodato: fsync a gruppi entro giornale.INTERVALLO_COMMIT). Un crash
+            # dentro quell'intervallo perde la mossa anche se l'avversario l'ha già ricevuta:
+            # alla ripresa RESUME| riporta entrambi i client all'ultima mossa salvata
+            if giornale_partite is not None:
+                giornale_partite.mossa(sessione_corrente)
+            if traccia is not None:
+                traccia.tappa("giornale")
+
+            # Inoltra la mossa all'AVVERSARIO
+            indice_avversario = 1 if indice_giocatore == 0 else 0
+            socket_avversario = sessione_corrente.giocatori[indice_avversario][0]
+            invia_mossa(socket_avversario, mossa)
+            if traccia is not None:
+                traccia.tappa("inoltro")
+            tribuna.mossa(sessione_corrente, mossa)
+            # Log (console, admin) dopo l'inoltro: qui si accoda soltanto
+            bus_eventi.pubblica("mossa", sessione_corrente, nickname, messaggio)
+            if traccia is not None:
+                traccia.tappa("eventi")
+
+            # Controlla fine partita (Scacco matto, stallo, ecc.)
+            esito = esito_partita(sessione_corrente)
+            if traccia is not None:
+                traccia.tappa("fine_partita")
+            if esito is not None:
+                risultato = esito.result()
+                notifica_fine_partita(sessione_corrente, risultato)
+                # Chiudo la sessione e le connessioni
+                rimuovi_sessione(sessione_corrente)
+                for giocatore in sessione_corrente.giocatori:
+                    try:
+                        giocatore[0].close()
+                    except:
+                        pass
+                return False
+            if timer_info_presente:
+                pianifica_scadenza(sessione_corrente)
+                invia_tempo_ai_giocatori(sessione_corrente)
+                if traccia is not None:
+                    traccia.tappa("tempo")
+        else:
+            print(f"Mossa illegale tentata da {nickname}: {messaggio}")
+            socket_client.send(protocollo.codifica("ERROR|Mossa illegale"))
+    except ValueError:
+        pass # Formato mossa non valido
+    return True
+
+
+def chiudi_client(socket_client, sessione_corrente, indice_giocatore):
+    """Pulizia della sessione in caso di disconnessione del client."""
+    # Rimuovi qualunque entry con questo socket, ignorando la durata
+    for entry in list(client_connessi):
+        if entry[0] is socket_client:
+            client_connessi.remove(entry)
+    client_binari.discard(socket_client)
+
+    if sessione_corrente is not None:
+        with sessione_corrente.lock:
+            # Se era ancora in attesa di un avversario esce dalla coda del matchmaking
+            if not sessione_corrente.iniziata:
+                code_attesa.annulla(sessione_corrente.durata, sessione_corrente)
+
+            # Posto già ripreso da una nuova connessione (RESUME): la sessione non va toccata
+            if (
+                indice_giocatore in (0, 1)
+                and sessione_corrente.iniziata
+                and sessione_corrente.giocatori[indice_giocatore][0] is not socket_client
+            ):
+                pass
+            # Partita in corso: il giocatore ha FINESTRA_RIPRESA secondi per tornare
+            elif (
+                sessione_corrente in sessioni_gioco
+                and sessione_corrente.iniziata
+                and indice_giocatore in (0, 1)
+                and FINESTRA_RIPRESA > 0
+            ):
+                sospendi_giocatore(sessione_corrente, indice_giocatore)
+            # Se la sessione è ancora attiva, avvisa l'avversario che questo giocatore ha abbandonato
+            elif sessione_corrente in sessioni_gioco:
+                # Calcola l'indice locale del giocatore che sta abbandonando, se non noto lo deduciamo
+                if indice_giocatore not in (0, 1):
+                    try:
+                        if sessione_corrente.giocatori[0][0] is socket_client:
+                            indice_giocatore = 0
+                        elif len(sessione_corrente.giocatori) > 1 and sessione_corrente.giocatori[1][0] is socket_client:
+                            indice_giocatore = 1
+                    except:
+                        indice_giocatore = -1
+
+                if indice_giocatore in (0, 1):
+                    avvisa_avversario_abbandono(sessione_corrente, indice_giocatore)
+
+                rimuovi_sessione(sessione_corrente)
+
+                if sessione_corrente.iniziata and indice_giocatore in (0, 1):
+                    nick_uscito = sessione_corrente.giocatori[indice_giocatore][1]
+                    bus_eventi.pubblica("sessione_chiusa", sessione_corrente, f"Abbandono: {nick_uscito}")
+                    risultato = "0-1" if indice_giocatore == 0 else "1-0"
+                    pubblica_fine_partita(sessione_corrente, risultato, "abandoned")
+
+    socket_client.close()
+
+
+def gestisci_client(socket_client, indirizzo_ip):
+    """Gestione di un client nella modalità "thread" (un thread bloccante per socket)."""
     nickname = "Sconosciuto"
     indice_giocatore = -1  # 0 = Bianco, 1 = Nero
     sessione_corrente = None
-    durata_timer_richiesta = 600  # default di sicurezza
 
     try:
-        # 1. Ricezione Nickname + durata timer (formato: "nickname|secondi")
-        prima_risposta = socket_client.recv(1024).decode('utf-8').strip()
-        parti = prima_risposta.split("|")
-        nickname = (parti[0] if parti else "").strip()
-
-        durata_timer_richiesta = 600
-        if len(parti) >= 2:
-            try:
-                durata_parsata = int(float(parti[1]))
-                if durata_parsata in MODALITA_CONSENTITE:
-                    durata_timer_richiesta = durata_parsata
-            except ValueError:
-                pass
+        # Messaggi già separati dal codec (più messaggi per recv o messaggi spezzati)
+        decodificatore = protocollo.Decodificatore(misura_istante=tracce.ATTIVO)
+        messaggi = protocollo.leggi_messaggi(socket_client, decodificatore)
+        if socket_client.cattura is not None:
+            messaggi = socket_client.cattura.ingresso(messaggi)
 
-        # Validazione nickname lato server (sicurezza)
-        if not nickname_valido(nickname):
-            try:
-                socket_client.send("ERROR|Nickname non valido".encode())
-            except:
-                pass
-            try:
-                socket_client.close()
-            except:
-                pass
-            pagina.add(ft.Text(f"Connessione rifiutata da {indirizzo_ip}: nickname non valido ({nickname!r})"))
-            pagina.update()
+        # 1. Ricezione Nickname + durata timer (formato: "nickname|secondi")
+        prima_risposta = next(messaggi, "").strip()
+        if prima_risposta.startswith("WATCH|"):
+            # Spettatore: questo thread invia soltanto, fino alla fine della partita
+            agganciato = aggancia_spettatore(
+                socket_client, prima_risposta,
+                # Lo spettatore ha già la sua coda: scrive direttamente sul socket
+                lambda binario: spettatori.Spettatore(socket_client.socket, binario),
+            )
+            if agganciato is not None:
+                sessione_guardata, spettatore = agganciato
+                spettatore.invia_in_coda()
+                tribuna.rimuovi(sessione_guardata.id, spettatore)
             return
+        if prima_risposta.startswith("RESUME|"):
+            # Ritorno in una partita già iniziata (token ricevuto con START|)
+            ripresa = riprendi_sessione(socket_client, prima_risposta)
+            if ripresa is None:
+                return
+            sessione_corrente, indice_giocatore, nickname = ripresa
+        else:
+            nickname, durata_timer_richiesta, binario = interpreta_handshake(prima_risposta)
 
-        print(f"[CONNESSO] {nickname} da {indirizzo_ip} (timer: {durata_timer_richiesta}s)")
-        
-        client_connessi.append((socket_client, nickname, durata_timer_richiesta))
-        pagina.update()
-
-        # 2. Matchmaking (Creazione della partita)
-        for sessione in sessioni_gioco:
-            # Se la sessione ha meno di 2 elementi, significa che c'è un solo giocatore e manca la scacchiera
-            # e la durata del timer deve coincidere
-            if len(sessione) < 2:
-                durata_sessione = sessione[0][2]
-                if durata_sessione != durata_timer_richiesta:
-                    continue
-
-                sessione.insert(1, (socket_client, nickname, durata_timer_richiesta)) # Mi aggiungo come secondo giocatore
-                sessione_corrente = sessione
-                indice_giocatore = 1 # Sono il Nero
-                
-                # Ora siamo in 2: Creiamo la Scacchiera e Iniziamo!
-                scacchiera = chess.Board()
-                sessione.append(scacchiera) # La scacchiera diventa l'elemento indice 2
-
-                if durata_sessione > 0:
-                    timer_info = {
-                        "white_time": durata_sessione,
-                        "black_time": durata_sessione,
-                        "ultimo_tick": time.time()
-                    }
-                    sessione.append(timer_info)  # Timer info diventa elemento indice 3
-                
-                socket_g1 = sessione[0][0]
-                socket_g2 = sessione[1][0]
-                nick_g1 = sessione[0][1]
-                nick_g2 = sessione[1][1]
-                
-                print(f"START: {nick_g1} vs {nick_g2} (timer: {durata_sessione}s)")
-                pagina.update()
-
-                # Crea la scheda grafica per questa nuova sessione
-                crea_ui_sessione(sessione, durata_sessione, pagina)
-
-                # Invio segnale di start e assegnazione colori
-                socket_g1.send("START|WHITE".encode())
-                socket_g2.send("START|BLACK".encode())
-
-                if durata_sessione > 0:
-                    invia_tempo_ai_giocatori(sessione)
-                    threading.Thread(
-                        target=loop_timer_sessione, args=(sessione, pagina), daemon=True
-                    ).start()
-                break
-        
-        if not sessione_corrente:
-            # Se non ho trovato partite aperte con la stessa durata, creo una nuova sessione con me come primo giocatore
-            nuova_sessione = [(socket_client, nickname, durata_timer_richiesta)] 
-            sessioni_gioco.append(nuova_sessione)
-            sessione_corrente = nuova_sessione
-            indice_giocatore = 0 # Sono il Bianco
+            # Validazione nickname lato server (sicurezza)
+            if not nickname_valido(nickname):
+                rifiuta_connessione(socket_client, indirizzo_ip, nickname)
+                return
 
-        # 3. Ciclo di Gioco (Logica Autorevole del Server)
-        while True:
-            messaggio = socket_client.recv(1024).decode()
-            if not messaggio: break
-            
-            # Controllo se la partita è effettivamente iniziata (ci sono 2 player e la scacchiera)
-            if len(sessione_corrente) < 3:
-                continue
+            print(f"[CONNESSO] {nickname} da {indirizzo_ip} (timer: {durata_timer_richiesta}s)")
+            negozia_protocollo(socket_client, binario)
 
-            scacchiera = sessione_corrente[2] # Recupero l'oggetto chess.Board
-            timer_info_presente = len(sessione_corrente) >= 4
-            
-            if timer_info_presente:
-                colore_scaduto = aggiorna_timer(sessione_corrente)
-                if colore_scaduto:
-                    gestisci_timeout(sessione_corrente, colore_scaduto, pagina)
-                    break
-            
-            # CONTROLLO 1: È il turno di questo socket?
-            # scacchiera.turn è True per il Bianco, False per il Nero
-            # indice_giocatore è 0 per il Bianco, 1 per il Nero
-            e_turno_bianco = scacchiera.turn
-            sono_il_bianco = (indice_giocatore == 0)
-            # Gestione CHAT
-            if messaggio.startswith("CHAT|"):
-                try:
-                    # Dividiamo solo alla prima pipe, così il messaggio può contenere pipe
-                    _, contenuto_chat = messaggio.split("|", 1)
-                    contenuto_chat = contenuto_chat.strip()
-                    
-                    if contenuto_chat:
-                        # Costruiamo il pacchetto da inviare ai client
-                        msg_out = f"CHAT|{nickname}|{contenuto_chat}"
-                        
-                        # Invio a entrambi i giocatori
-                        for g in sessione_corrente[:2]: # g è (socket, nick, timer)
-                            try:
-                                g[0].send(msg_out.encode())
-                            except:
-                                pass
-                        
-                        # Log lato admin
-                        log_chat_sessione(sessione_corrente, nickname, contenuto_chat, pagina)
-                except Exception as e:
-                    print(f"Errore chat: {e}")
-                continue # Passa al prossimo ciclo
-            # Gestione richiesta mosse valide
-            if messaggio.startswith("MOVES|"):
-                if e_turno_bianco != sono_il_bianco:
-                    socket_client.send("MOVES|".encode())  # Nessuna mossa valida se non è il tuo turno
-                    continue
-                
-                try:
-                    casella_richiesta = messaggio.split("|")[1]
-                    square = chess.parse_square(casella_richiesta)
-                    pezzo = scacchiera.piece_at(square)
-                    
-                    # Verifica che ci sia un pezzo e che sia del colore del giocatore
-                    if pezzo and pezzo.color == (chess.WHITE if sono_il_bianco else chess.BLACK):
-                        # Trova tutte le mosse legali da questa casella
-                        mosse_valide = [m for m in scacchiera.legal_moves if m.from_square == square]
-                        caselle_valide = [chess.square_name(m.to_square) for m in mosse_valide]
-                        risposta = f"MOVES|{','.join(caselle_valide)}"
-                        socket_client.send(risposta.encode())
-                    else:
-                        socket_client.send("MOVES|".encode())  # Nessuna mossa valida
-                except:
-                    socket_client.send("MOVES|".encode())  # Errore nel parsing
-                continue
-            
-            if e_turno_bianco != sono_il_bianco:
-                print(f"Mossa rifiutata: non è il turno di {nickname}")
-                socket_client.send("ERROR|Non è il tuo turno".encode())
-                continue
+            client_connessi.append((socket_client, nickname, durata_timer_richiesta))
 
-            # CONTROLLO 2: La mossa è valida secondo le regole degli scacchi?
-            try:
-                mossa = chess.Move.from_uci(messaggio)
-                if mossa in scacchiera.legal_moves:
-                    # VALIDAZIONE OK: Eseguiamo la mossa sulla scacchiera del Server
-                    scacchiera.push(mossa)
-                    print(f"Mossa valida {messaggio} da {nickname}. Inoltro...")
-                    # Log grafico della mossa
-                    log_mossa_sessione(sessione_corrente, nickname, messaggio, pagina)
-                    
-                    # Inoltra la mossa all'AVVERSARIO
-                    indice_avversario = 1 if indice_giocatore == 0 else 0
-                    socket_avversario = sessione_corrente[indice_avversario][0]
-                    socket_avversario.send(messaggio.encode())
-                    
-                    # Controlla fine partita (Scacco matto, stallo, ecc.)
-                    if scacchiera.is_game_over():
-                        risultato = scacchiera.result()
-                        notifica_fine_partita(sessione_corrente, risultato, pagina)
-                        # Chiudo la sessione e le connessioni
-                        if sessione_corrente in sessioni_gioco:
-                            sessioni_gioco.remove(sessione_corrente)
-                        for giocatore in sessione_corrente[:2]:
-                            try:
-                                giocatore[0].close()
-                            except:
-                                pass
-                        break
-                    if timer_info_presente:
-                        invia_tempo_ai_giocatori(sessione_corrente)
-                else:
-                    print(f"Mossa illegale tentata da {nickname}: {messaggio}")
-                    socket_client.send("ERROR|Mossa illegale".encode())
-            except ValueError:
-                pass # Formato mossa non valido
+            # 2. Matchmaking (Creazione della partita)
+            sessione_corrente, indice_giocatore = accoppia_giocatore(
+                socket_client, nickname, durata_timer_richiesta
+            )
+
+        # 3. Ciclo di Gioco (Logica Autorevole del Server)
+        limiti_client = limiti_posto(sessione_corrente, indice_giocatore)
+        for messaggio in messaggi:
+            if not elabora_messaggio(
+                socket_client, nickname, indice_giocatore, sessione_corrente, messaggio, limiti_client,
+                decodificatore.istante,
+            ):
+                break
 
     except Exception as errore:
         print(f"Errore {nickname}: {errore}")
     finally:
-        # Pulizia sessione in caso di disconnessione
-        # Rimuovi qualunque entry con questo socket, ignorando la durata
-        for entry in list(client_connessi):
-            if entry[0] is socket_client:
-                client_connessi.remove(entry)
-        
-        # Se esiste una sessione associata, avvisa l'avversario che questo giocatore ha abbandonato
-        if sessione_corrente and sessione_corrente in sessioni_gioco:
-            # Calcola l'indice locale del giocatore che sta abbandonando, se non noto lo deduciamo
-            if indice_giocatore not in (0, 1):
+        chiudi_client(socket_client, sessione_corrente, indice_giocatore)
+
+
+class ConnessioneAsync:
+    """
+    Adattatore che espone su uno StreamWriter asyncio la stessa interfaccia
+    dei socket usata dal resto del server (send/close), così le funzioni di gioco
+    restano identiche nelle due modalità. Le chiamate da altri thread (es. i
+    pulsanti dell'admin Flet) vengono rimandate all'event loop.
+    I messaggi inviati nello stesso giro dell'event loop (es. mossa + TIME) vengono
+    uniti in una sola scrittura; un client che lascia nel buffer del trasporto più
+    di uscita.LIMITE_BUFFER_ASYNC byte viene disconnesso.
+    """
+
+    __slots__ = ("writer", "loop", "thread_loop", "_in_attesa", "cattura")
+
+    def __init__(self, writer, loop):
+        self.writer = writer
+        self.loop = loop
+        self.thread_loop = threading.get_ident()
+        self._in_attesa = []
+        self.cattura = None  # cattura.Canale se il server registra il traffico
+
+    def _esegui(self, funzione, *argomenti):
+        if threading.get_ident() == self.thread_loop:
+            funzione(*argomenti)
+        else:
+            self.loop.call_soon_threadsafe(funzione, *argomenti)
+
+    def _scrivi(self, dati):
+        if self.writer.is_closing():
+            return
+        if not self._in_attesa:
+            self.loop.call_soon(self._svuota)
+        self._in_attesa.append(dati)
+
+    def _svuota(self):
+        blocco, self._in_attesa = self._in_attesa, []
+        if not blocco or self.writer.is_closing():
+            return
+        self.writer.write(b"".join(blocco))
+        if self.writer.transport.get_write_buffer_size() > uscita.LIMITE_BUFFER_ASYNC:
+            # Client che non legge: si chiude subito invece di accumulare memoria
+            uscita.disconnessi_lenti += 1
+            self.writer.transport.abort()
+
+    def _chiudi(self):
+        self._svuota()  # prima i messaggi già accodati (es. GAMEOVER)
+        self.writer.close()
+
+    def send(self, dati):
+        if self.cattura is not None:
+            self.cattura.inviato(dati)
+        self._esegui(self._scrivi, dati)
+        return len(dati)
+
+    def in_coda(self) -> int:
+        return self.writer.transport.get_write_buffer_size()
+
+    def close(self):
+        if self.cattura is not None:
+            self.cattura.chiuso()
+        self._esegui(self._chiudi)
+
+
+async def gestisci_client_async(reader, writer):
+    """
+    Gestione di un client nella modalità "asyncio": stesso handshake, matchmaking
+    e logica di gioco di gestisci_client, ma come coroutine sull'unico event loop.
+    """
+    connessione = ConnessioneAsync(writer, asyncio.get_running_loop())
+    indirizzo_ip = writer.get_extra_info("peername")
+    if cattura_traffico is not None:
+        connessione.cattura = cattura_traffico.canale(indirizzo_ip)
+    nickname = "Sconosciuto"
+    indice_giocatore = -1  # 0 = Bianco, 1 = Nero
+    sessione_corrente = None
+
+    try:
+        decodificatore = protocollo.Decodificatore(misura_istante=tracce.ATTIVO)
+        messaggi = protocollo.leggi_messaggi_async(reader, decodificatore)
+        if connessione.cattura is not None:
+            messaggi = connessione.cattura.ingresso_async(messaggi)
+
+        # 1. Ricezione Nickname + durata timer (formato: "nickname|secondi")
+        try:
+            prima_risposta = (await messaggi.__anext__()).strip()
+        except StopAsyncIteration:
+            prima_risposta = ""
+        if prima_risposta.startswith("WATCH|"):
+            agganciato = aggancia_spettatore(
+                connessione, prima_risposta,
+                lambda binario: spettatori.SpettatoreAsync(writer, connessione.loop, binario),
+            )
+            if agganciato is not None:
+                sessione_guardata, spettatore = agganciato
                 try:
-                    if sessione_corrente[0][0] is socket_client:
-                        indice_giocatore = 0
-                    elif len(sessione_corrente) > 1 and sessione_corrente[1][0] is socket_client:
-                        indice_giocatore = 1
-                except:
-                    indice_giocatore = -1
+                    # Gli spettatori non inviano nulla: si aspetta solo la chiusura
+                    async for _ in messaggi:
+                        pass
+                finally:
+                    tribuna.rimuovi(sessione_guardata.id, spettatore)
+            return
+        if prima_risposta.startswith("RESUME|"):
+            ripresa = riprendi_sessione(connessione, prima_risposta)
+            if ripresa is None:
+                return
+            sessione_corrente, indice_giocatore, nickname = ripresa
+        else:
+            nickname, durata_timer_richiesta, binario = interpreta_handshake(prima_risposta)
 
-            if indice_giocatore in (0, 1):
-                avvisa_avversario_abbandono(sessione_corrente, indice_giocatore)
+            if not nickname_valido(nickname):
+                rifiuta_connessione(connessione, indirizzo_ip, nickname)
+                return
 
-            if sessione_corrente in sessioni_gioco:
-                sessioni_gioco.remove(sessione_corrente)
+            print(f"[CONNESSO] {nickname} da {indirizzo_ip} (timer: {durata_timer_richiesta}s)")
+            negozia_protocollo(connessione, binario)
 
-            pagina.update()
-        
-        socket_client.close()
+            client_connessi.append((connessione, nickname, durata_timer_richiesta))
+
+            # 2. Matchmaking (Creazione della partita)
+            sessione_corrente, indice_giocatore = accoppia_giocatore(
+                connessione, nickname, durata_timer_richiesta
+            )
+
+        # 3. Ciclo di Gioco (Logica Autorevole del Server)
+        limiti_client = limiti_posto(sessione_corrente, indice_giocatore)
+        async for messaggio in messaggi:
+            if not elabora_messaggio(
+                connessione, nickname, indice_giocatore, sessione_corrente, messaggio, limiti_client,
+                decodificatore.istante,
+            ):
+                break
+
+    except Exception as errore:
+        print(f"Errore {nickname}: {errore}")
+    finally:
+        chiudi_client(connessione, sessione_corrente, indice_giocatore)
 
 def invia_tempo_ai_giocatori(sessione):
-    if len(sessione) < 4:
+    if not sessione.con_timer or not sessione.iniziata:
         return
-    timer_info = sessione[3]
-    tempo_bianco = max(0, int(timer_info["white_time"]))
-    tempo_nero = max(0, int(timer_info["black_time"]))
-    messaggio = f"TIME|{tempo_bianco}|{tempo_nero}"
-    for giocatore in sessione[:2]:
+    tempo_bianco = max(0, int(sessione.tempo_bianco))
+    tempo_nero = max(0, int(sessione.tempo_nero))
+    messaggio = protocollo.codifica(f"TIME|{tempo_bianco}|{tempo_nero}")
+    # Per i client binari il tempo viaggia in millisecondi
+    messaggio_binario = protocollo.codifica_tempo(
+        sessione.tempo_bianco * 1000, sessione.tempo_nero * 1000
+    )
+    for giocatore in sessione.giocatori:
         try:
-            giocatore[0].send(messaggio.encode())
+            if giocatore[0] in client_binari:
+                giocatore[0].send(messaggio_binario)
+            else:
+                giocatore[0].send(messaggio)
         except:
             pass
+    tribuna.tempo(sessione)
 
 def aggiorna_timer(sessione):
-    if len(sessione) < 4:
+    # Partita ripristinata in attesa dei giocatori: l'orologio è fermo
+    if not sessione.con_timer or not sessione.iniziata or sessione.sospesa:
         return None
-    timer_info = sessione[3]
-    scacchiera = sessione[2]
-    ora_attuale = time.time()
-    trascorso = ora_attuale - timer_info["ultimo_tick"]
+    ora_attuale = time.monotonic()
+    trascorso = ora_attuale - sessione.ultimo_tick
     if trascorso <= 0:
         return None
-    timer_info["ultimo_tick"] = ora_attuale
-    chiave_colore = "white_time" if scacchiera.turn else "black_time"
-    timer_info[chiave_colore] -= trascorso
-    if timer_info[chiave_colore] <= 0:
-        timer_info[chiave_colore] = 0
-        return "WHITE" if chiave_colore == "white_time" else "BLACK"
+    sessione.ultimo_tick = ora_attuale
+    if sessione.scacchiera.turn:
+        sessione.tempo_bianco -= trascorso
+        if sessione.tempo_bianco <= 0:
+            sessione.tempo_bianco = 0
+            return "WHITE"
+    else:
+        sessione.tempo_nero -= trascorso
+        if sessione.tempo_nero <= 0:
+            sessione.tempo_nero = 0
+            return "BLACK"
     return None
 
-def gestisci_timeout(sessione, colore_scaduto, pagina):
+def gestisci_timeout(sessione, colore_scaduto):
     """
     Gestisce la fine della partita per tempo, applicando le regole:
     - Chi va a zero perde, SE l'avversario ha materiale sufficiente per dare matto in teoria.
     - Se entrambi i tempi sono a zero -> patta.
     - Se il giocatore che ha ancora tempo NON ha materiale sufficiente per dare matto -> patta.
     """
-    if len(sessione) < 4:
+    if not sessione.con_timer or sessione not in sessioni_gioco:
         return
-
-    scacchiera = sessione[2]
-    timer_info = sessione[3]
+    tempi_scaduti.incrementa()
 
     # Valori di tempo normalizzati (non negativi)
-    white_time = max(0, float(timer_info.get("white_time", 0)))
-    black_time = max(0, float(timer_info.get("black_time", 0)))
+    white_time = max(0, float(sessione.tempo_bianco))
+    black_time = max(0, float(sessione.tempo_nero))
 
     # Caso: entrambi i tempi a zero → patta
     if white_time <= 0 and black_time <= 0:
-        pagina.update()
-        notifica_fine_partita(sessione, "1/2-1/2", pagina)
+        notifica_fine_partita(sessione, "1/2-1/2", "time forfeit")
     else:
         # Determina chi ha finito il tempo e chi è l'avversario
         if colore_scaduto == "WHITE":
@@ -642,86 +1206,201 @@ def gestisci_timeout(sessione, colore_scaduto, pagina):
             winning_color = chess.WHITE
             descrizione = "Nero"
 
-        pagina.add(ft.Text(f"Tempo scaduto per {descrizione}"))
-        pagina.update()
+        bus_eventi.pubblica("avviso", f"Tempo scaduto per {descrizione}")
 
-        # Controllo materiale sufficiente: usiamo la logica di python-chess.
-        # Se la funzione dice che la posizione è a "materiale insufficiente" complessivo
+        # Controllo materiale sufficiente: la logica di python-chess, tenuta aggiornata
+        # dalla sessione (vedi Sessione.gioca).
+        # Se la posizione è a "materiale insufficiente" complessivo
         # (nessuna delle due parti può dare matto in teoria), allora la partita è patta,
         # indipendentemente da chi è andato a zero.
-        if scacchiera.is_insufficient_material():
+        if sessione.materiale_insufficiente:
             risultato = "1/2-1/2"
         else:
             # Vittoria al tempo per il colore che ha ancora tempo.
             risultato = "0-1" if losing_color == chess.WHITE else "1-0"
 
-        notifica_fine_partita(sessione, risultato, pagina)
+        notifica_fine_partita(sessione, risultato, "time forfeit")
 
     # In ogni caso notifichiamo comunque il tipo di timeout esplicito (per compatibilità client)
     messaggio_timeout = f"TIMEOUT|{colore_scaduto}"
-    for giocatore in sessione[:2]:
+    for giocatore in sessione.giocatori:
         try:
-            giocatore[0].send(messaggio_timeout.encode())
+            giocatore[0].send(protocollo.codifica(messaggio_timeout))
         except:
             pass
 
     # Chiudiamo la sessione e le connessioni
-    if sessione in sessioni_gioco:
-        sessioni_gioco.remove(sessione)
-    for giocatore in sessione[:2]:
+    rimuovi_sessione(sessione)
+    for giocatore in sessione.giocatori:
         try:
             giocatore[0].close()
         except:
             pass
 
-def loop_timer_sessione(sessione, pagina):
-    while True:
+def pianifica_scadenza(sessione):
+    """(Ri)pianifica sull'orologio centrale la caduta della bandierina del lato al tratto."""
+    orologio_partite.annulla(sessione.evento_scadenza)
+    residuo = sessione.tempo_bianco if sessione.scacchiera.turn else sessione.tempo_nero
+    sessione.evento_scadenza = orologio_partite.pianifica(residuo, controlla_scadenza, sessione)
+
+def controlla_scadenza(sessione):
+    """Evento dell'orologio: il tempo del lato al tratto dovrebbe essere appena finito."""
+    with sessione.lock:
         if sessione not in sessioni_gioco:
-            break
-        if len(sessione) < 4:
-            time.sleep(0.5)
-            continue
+            return
+        colore_scaduto = aggiorna_timer(sessione)
+        if colore_scaduto:
+            gestisci_timeout(sessione, colore_scaduto)
+        else:
+            # Residuo positivo per arrotondamenti: ripianifichiamo sul tempo rimasto
+            pianifica_scadenza(sessione)
+
+def invia_tempo_periodico(sessione):
+    """Evento dell'orologio: aggiorna i client sul tempo residuo ogni INTERVALLO_INVIO_TEMPO."""
+    with sessione.lock:
+        if sessione not in sessioni_gioco:
+            return
         colore_scaduto = aggiorna_timer(sessione)
         invia_tempo_ai_giocatori(sessione)
         if colore_scaduto:
-            gestisci_timeout(sessione, colore_scaduto, pagina)
-            break
-        time.sleep(1)
+            gestisci_timeout(sessione, colore_scaduto)
+            return
+        sessione.evento_tempo = orologio_partite.pianifica(
+            INTERVALLO_INVIO_TEMPO, invia_tempo_periodico, sessione
+        )
+
+def avvia_timer_sessione(sessione):
+    """Registra la sessione sull'orologio centrale (nessun thread per partita)."""
+    orologio_partite.avvia()
+    pianifica_scadenza(sessione)
+    sessione.evento_tempo = orologio_partite.pianifica(
+        INTERVALLO_INVIO_TEMPO, invia_tempo_periodico, sessione
+    )
 
-def avvia_server(pagina):
+def avvia_server(indirizzo=INDIRIZZO_SERVER, porta=PORTA_SERVER):
     socket_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    socket_server.bind((INDIRIZZO_SERVER, PORTA_SERVER))
-    socket_server.listen()
-    
-    pagina.update()
-    
+    socket_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    socket_server.bind((indirizzo, porta))
+    socket_server.listen(BACKLOG_SERVER)
+    print(f"SERVER AVVIATO SU {indirizzo}:{porta} (modalità thread)")
+
     while True:
         client, indirizzo = socket_server.accept()
-        threading.Thread(target=gestisci_client, args=(client, indirizzo, pagina), daemon=True).start()
-
-def main(pagina: ft.Page):
-    global contenitore_sessioni
-    pagina.title = f"Server Scacchi ({INDIRIZZO_SERVER}:{PORTA_SERVER})"    
-
-    # Pannello superiore di info generali
-    intestazione = ft.Column(
-        [
-            ft.Text(f"Server Scacchi ({INDIRIZZO_SERVER}:{PORTA_SERVER})", size=24, weight="bold"),
-            ft.Text("Sessioni attive e strumenti di moderazione:", size=16),
-        ],
-        spacing=5,
+        # Come i trasporti asyncio: niente Nagle, i messaggi sono piccoli e vanno inviati subito
+        client.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        # Ogni connessione scrive tramite la propria coda di uscita (vedi uscita.py)
+        connessione = uscita.ConnessioneThread(client)
+        if cattura_traffico is not None:
+            connessione.cattura = cattura_traffico.canale(indirizzo)
+        threading.Thread(target=gestisci_client, args=(connessione, indirizzo), daemon=True).start()
+
+async def avvia_server_async(indirizzo=INDIRIZZO_SERVER, porta=PORTA_SERVER):
+    """Server a singolo event loop: ogni client è una coroutine invece di un thread."""
+    server = await asyncio.start_server(
+        gestisci_client_async,
+        indirizzo,
+        porta,
+        backlog=BACKLOG_SERVER,
     )
+    print(f"SERVER AVVIATO SU {indirizzo}:{porta} (modalità asyncio)")
 
-    contenitore_sessioni = ft.Column(spacing=10, expand=1)
+    async with server:
+        await server.serve_forever()
 
-    pagina.add(
-        intestazione,
-        ft.Divider(),
-        contenitore_sessioni,
-    )
-    pagina.update()
 
-    # Avvia il server in un thread separato per non bloccare la GUI di Flet
-    threading.Thread(target=avvia_server, args=(pagina,), daemon=True).start()
+def esegui_server(indirizzo=INDIRIZZO_SERVER, porta=PORTA_SERVER, modalita=None):
+    """Avvia il server nella modalità richiesta; blocca il thread chiamante."""
+    if giornale_partite is not None:
+        ripristina_sessioni()
+    if (modalita or MODALITA_SERVER) == "asyncio":
+        asyncio.run(avvia_server_async(indirizzo, porta))
+    else:
+        avvia_server(indirizzo, porta)
+
 
-ft.app(target=main)
\ No newline at end of file
+def avvia_con_pannello(indirizzo, porta, modalita):
+    """Avvia il server con il pannello admin Flet iscritto al bus degli eventi (import solo qui)."""
+    import flet as ft
+    import admin
+
+    titolo = f"Server Scacchi ({indirizzo}:{porta})"
+
+    def main(pagina):
+        bus_eventi.iscrivi(admin.PannelloAdmin(
+            pagina,
+            titolo,
+            modalita,
+            chiudi_sessione=lambda sessione: chiudi_sessione_da_admin(
+                sessione, motivo="Chiusura manuale (patta)", esito_forzato="DRAW"
+            ),
+            banna_giocatore=banna_giocatore,
+        ))
+
+        # Avvia il server in un thread separato per non bloccare la GUI di Flet
+        threading.Thread(
+            target=esegui_server, args=(indirizzo, porta, modalita), daemon=True
+        ).start()
+
+    ft.app(target=main)
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Server Thread-Chess")
+    parser.add_argument("--headless", action="store_true",
+                        help="solo server, senza pannello admin Flet (es. nel container)")
+    parser.add_argument("--host", default=INDIRIZZO_SERVER, help="indirizzo di ascolto")
+    parser.add_argument("--port", type=int, default=PORTA_SERVER, help="porta di ascolto")
+    parser.add_argument("--modalita", choices=("thread", "asyncio"), default=MODALITA_SERVER,
+                        help="gestione delle connessioni")
+    parser.add_argument("--dati", default=str(archivio.CARTELLA_DATI),
+                        help="cartella dei dati persistenti (archivio PGN)")
+    parser.add_argument("--senza-archivio", action="store_true",
+                        help="non salvare le partite concluse in PGN")
+    parser.add_argument("--senza-giornale", action="store_true",
+                        help="non tenere il giornale delle partite in corso (nessun ripristino)")
+    parser.add_argument("--porta-metriche", type=int, default=PORTA_METRICHE,
+                        help="porta dell'endpoint HTTP /metrics per Prometheus (0 = disattivato)")
+    parser.add_argument("--finestra-ripresa", type=float, default=FINESTRA_RIPRESA,
+                        help="secondi concessi a un giocatore disconnesso per tornare (0 = abbandono)")
+    parser.add_argument("--cattura", default=os.environ.get("CATTURA_TRAFFICO"),
+                        help="registra il traffico dei giocatori in questo file (.gz compresso)")
+    parser.add_argument("--senza-limiti", action="store_true",
+                        help="disattiva i limiti di frequenza per connessione (replay veloci)")
+    parser.add_argument("--traccia", action="store_true",
+                        help="traccia le tappe di ogni mossa (GET /tracce, SIGUSR1 salva su file)")
+    argomenti, _ = parser.parse_known_args()
+
+    FINESTRA_RIPRESA = argomenti.finestra_ripresa
+    LIMITI_ATTIVI = not argomenti.senza_limiti
+    if argomenti.cattura:
+        cattura_traffico = cattura.Cattura(argomenti.cattura)
+        print(f"CATTURA DEL TRAFFICO IN {argomenti.cattura}")
+    if argomenti.traccia:
+        tracce.attiva()
+    if argomenti.porta_metriche:
+        metriche_server.avvia_http(INDIRIZZO_METRICHE, argomenti.porta_metriche, {
+            "/tracce": ("application/json", tracce.esporta_json),
+            "/tracce/chrome": ("application/json", tracce.esporta_chrome),
+        })
+    if tracce.ATTIVO and hasattr(signal, "SIGUSR1"):
+        cartella_tracce = pathlib.Path(argomenti.dati)
+
+        def salva_tracce(*_):
+            cartella_tracce.mkdir(parents=True, exist_ok=True)
+            percorso = cartella_tracce / f"tracce-{time.strftime('%Y%m%d-%H%M%S')}.json"
+            print(f"TRACCE SALVATE IN {tracce.salva(percorso)}")
+
+        signal.signal(signal.SIGUSR1, salva_tracce)
+
+    bus_eventi.iscrivi(eventi.LogConsole())
+    if not argomenti.senza_archivio:
+        archivio_partite = archivio.ArchivioPGN(argomenti.dati)
+    if not argomenti.senza_giornale:
+        giornale_partite = giornale.GiornaleMosse(pathlib.Path(argomenti.dati) / "giornale.log")
+
+    if argomenti.headless or os.environ.get("SERVER_HEADLESS") == "1":
+        esegui_server(argomenti.host, argomenti.port, argomenti.modalita)
+    else:
+        avvia_con_pannello(argomenti.host, argomenti.port, argomenti.modalita)
@@ -0,0 +1,200 @@
+"""
+Sessioni di gioco e registro delle sessioni attive.
+
+Una Sessione raccoglie giocatori, scacchiera e stato dell'orologio in un oggetto
+compatto (__slots__) con un lock dedicato: i thread dei due giocatori, l'orologio
+centrale e i pulsanti dell'admin si sincronizzano solo sulla partita che toccano.
+Il RegistroSessioni indicizza le sessioni per id, con ricerca e rimozione in O(1);
+lo stesso id è usato dalla UI di amministrazione. Ogni giocatore riceve anche un
+token di ripresa, con cui può tornare nella sua partita (es. dopo un riavvio del
+server, vedi giornale.py).
+
+La fine partita viene decisa con uno stato aggiornato a ogni mossa invece di
+scacchiera.is_game_over(), che per la quintupla ripetizione ripercorre la pila
+delle mosse: la sessione conta le occorrenze di ogni posizione (chiave Zobrist)
+dall'ultima mossa irreversibile e ricalcola il materiale insufficiente solo dopo
+catture e promozioni. Il costo per mossa non dipende dalla lunghezza della
+partita e gli esiti sono quelli di scacchiera.outcome().
+"""
+
+import itertools
+import secrets
+import threading
+import time
+
+import chess
+
+import cache_mosse
+
+_contatore_id = itertools.count(1)
+
+
+def riserva_id(id_usato):
+    """Fa partire i nuovi id dopo id_usato (sessioni ripristinate dal giornale)."""
+    global _contatore_id
+    prossimo = next(_contatore_id)
+    _contatore_id = itertools.count(max(prossimo, id_usato + 1))
+
+
+class ConnessioneAssente:
+    """Segnaposto per il socket di un giocatore non (ancora) riconnesso: scarta i messaggi."""
+
+    __slots__ = ()
+
+    def send(self, dati):
+        return len(dati)
+
+    def close(self):
+        pass
+
+
+class Sessione:
+    __slots__ = (
+        "id",
+        "durata",
+        "giocatori",
+        "scacchiera",
+        "mosse_legali",
+        "chiave",
+        "ripetizioni",
+        "materiale_insufficiente",
+        "tempo_bianco",
+        "tempo_nero",
+        "ultimo_tick",
+        "evento_scadenza",
+        "evento_tempo",
+        "token",
+        "sospesa",
+        "scadenze_ripresa",
+        "limiti",
+        "lock",
+    )
+
+    def __init__(self, giocatore):
+        self.id = next(_contatore_id)
+        self.durata = giocatore[2]  # secondi per lato, 0 = nessun timer
+        # Tuple (socket, nickname, durata_timer): indice 0 = Bianco, 1 = Nero
+        self.giocatori = [giocatore]
+        self.scacchiera = None  # chess.Board, creata quando arriva il secondo giocatore
+        self.mosse_legali = None  # TabellaMosse della posizione corrente (vedi cache_mosse.py)
+        self.chiave = None  # cache_mosse.chiave_posizione() della posizione corrente
+        self.ripetizioni = {}  # chiave -> occorrenze dall'ultima mossa irreversibile
+        self.materiale_insufficiente = False
+        self.tempo_bianco = float(self.durata)
+        self.tempo_nero = float(self.durata)
+        self.ultimo_tick = 0.0  # time.monotonic() dell'ultimo aggiornamento dell'orologio
+        self.evento_scadenza = None  # eventi sull'orologio centrale (vedi orologio.py)
+        self.evento_tempo = None
+        self.token = None  # token di ripresa [Bianco, Nero], assegnati all'avvio
+        self.sospesa = False  # True finché un giocatore di una partita ripristinata non torna
+        self.scadenze_ripresa = [None, None]  # eventi di fine finestra di ripresa, per giocatore
+        self.limiti = [None, None]  # limiti.LimitiConnessione per giocatore, sopravvivono a una ripresa
+        self.lock = threading.RLock()
+
+    @property
+    def iniziata(self) -> bool:
+        return self.scacchiera is not None
+
+    @property
+    def con_timer(self) -> bool:
+        return self.durata > 0
+
+    def assenti(self) -> list:
+        """Indici dei giocatori senza connessione (disconnessi o partita ripristinata)."""
+        return [i for i, g in enumerate(self.giocatori) if isinstance(g[0], ConnessioneAssente)]
+
+    def avvia(self, giocatore):
+        """Aggiunge il secondo giocatore (Nero), crea la scacchiera e fa partire l'orologio."""
+        self.giocatori.append(giocatore)
+        self.scacchiera = chess.Board()
+        self.chiave = cache_mosse.chiave_posizione(self.scacchiera)
+        self.ripetizioni = {self.chiave: 1}
+        self.materiale_insufficiente = False
+        self.token = [secrets.token_hex(8), secrets.token_hex(8)]
+        self.ultimo_tick = time.monotonic()
+
+    def gioca(self, mossa):
+        """
+        Esegue la mossa sulla scacchiera, invalida la tabella delle mosse legali e
+        aggiorna chiave, ripetizioni e materiale insufficiente.
+        """
+        scacchiera = self.scacchiera
+        # Dopo una mossa irreversibile nessuna posizione precedente può ripetersi
+        irreversibile = scacchiera.is_irreversible(mossa)
+        cambia_materiale = mossa.promotion is not None or scacchiera.is_capture(mossa)
+        scacchiera.push(mossa)
+        self.mosse_legali = None
+        self.chiave = cache_mosse.chiave_posizione(scacchiera)
+        if irreversibile:
+            self.ripetizioni.clear()
+        self.ripetizioni[self.chiave] = self.ripetizioni.get(self.chiave, 0) + 1
+        if cambia_materiale:
+            self.materiale_insufficiente = scacchiera.is_insufficient_material()
+
+    def esito(self, ha_mosse_legali):
+        """
+        chess.Outcome della posizione corrente o None, come scacchiera.outcome()
+        (stesso ordine dei controlli) ma senza ripercorrere la partita.
+        ha_mosse_legali: se il giocatore al tratto ha almeno una mossa legale.
+        """
+        scacchiera = self.scacchiera
+        if not ha_mosse_legali and scacchiera.is_check():
+            return chess.Outcome(chess.Termination.CHECKMATE, not scacchiera.turn)
+        if self.materiale_insufficiente:
+            return chess.Outcome(chess.Termination.INSUFFICIENT_MATERIAL, None)
+        if not ha_mosse_legali:
+            return chess.Outcome(chess.Termination.STALEMATE, None)
+        if scacchiera.halfmove_clock >= 150:
+            return chess.Outcome(chess.Termination.SEVENTYFIVE_MOVES, None)
+        if self.ripetizioni.get(self.chiave, 0) >= 5:
+            return chess.Outcome(chess.Termination.FIVEFOLD_REPETITION, None)
+        return None
+
+
+class RegistroSessioni:
+    """Sessioni attive indicizzate per id e per token di ripresa."""
+
+    def __init__(self):
+        self._sessioni = {}
+        self._token = {}  # token -> (sessione, indice_giocatore)
+        self._lock = threading.Lock()
+
+    def aggiungi(self, sessione):
+        with self._lock:
+            self._sessioni[sessione.id] = sessione
+        if sessione.token:
+            self.indicizza_token(sessione)
+
+    def indicizza_token(self, sessione):
+        """Rende la sessione raggiungibile dai token dei giocatori (dopo Sessione.avvia)."""
+        with self._lock:
+            for indice, token in enumerate(sessione.token):
+                self._token[token] = (sessione, indice)
+
+    def get(self, id_sessione):
+        return self._sessioni.get(id_sessione)
+
+    def per_token(self, token):
+        """Ritorna (sessione, indice_giocatore) per un token di ripresa, o None."""
+        return self._token.get(token)
+
+    def rimuovi(self, sessione) -> bool:
+        """Rimuove la sessione. Ritorna False se era già stata rimossa."""
+        with self._lock:
+            if self._sessioni.get(sessione.id) is not sessione:
+                return False
+            del self._sessioni[sessione.id]
+            for token in sessione.token or ():
+                self._token.pop(token, None)
+            return True
+
+    def attive(self) -> list:
+        """Copia della lista delle sessioni attive, da scorrere senza lock."""
+        with self._lock:
+            return list(self._sessioni.values())
+
+    def __contains__(self, sessione):
+        return self._sessioni.get(sessione.id) is sessione
+
+    def __len__(self):
+        return len(self._sessioni)
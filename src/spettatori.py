@@ -0,0 +1,192 @@
+"""
+Spettatori delle partite in corso.
+
+Uno spettatore si aggancia a una sessione con l'handshake "WATCH|id_sessione[|BIN1]",
+riceve una fotografia della partita e poi le mosse, gli orologi e la chat in diretta.
+
+Il thread di gioco non scrive mai sui socket degli spettatori: accoda il messaggio
+una sola volta (e solo se la sessione ha spettatori) sulla coda della Tribuna.
+Un unico thread diffusore lo codifica una volta per formato (testo e binario) e
+mette gli stessi byte nella coda limitata di ogni spettatore; chi non svuota la
+propria coda abbastanza in fretta viene disconnesso (può riagganciarsi e ricevere
+una nuova fotografia), così la latenza dei giocatori non dipende dal pubblico.
+
+Messaggi inviati agli spettatori:
+  WATCH|id|bianco|nero|durata|uci,uci,...   fotografia iniziale
+  <uci> oppure record binario               mossa
+  TIME|bianco|nero oppure record binario    orologi
+  CHAT|mittente|messaggio
+  GAMEOVER|risultato|terminazione           es. "GAMEOVER|1-0|normal", poi chiusura
+"""
+
+import queue
+import socket
+import threading
+
+import protocollo
+
+CAPACITA_SPETTATORE = 256  # messaggi in coda per spettatore prima della disconnessione
+LIMITE_BUFFER_ASYNC = 64 * 1024  # byte non ancora inviati prima della disconnessione (asyncio)
+
+
+class Spettatore:
+    """Spettatore nella modalità "thread": il suo thread svuota la coda sul socket."""
+
+    __slots__ = ("connessione", "binario", "coda", "attivo")
+
+    def __init__(self, connessione, binario, capacita=CAPACITA_SPETTATORE):
+        self.connessione = connessione
+        self.binario = binario
+        self.coda = queue.Queue(capacita)
+        self.attivo = True
+
+    def accoda(self, dati) -> bool:
+        """Accoda senza bloccare; False se lo spettatore è rimasto indietro."""
+        try:
+            self.coda.put_nowait(dati)
+            return True
+        except queue.Full:
+            return False
+
+    def termina(self):
+        """Chiude dopo aver inviato quanto già in coda."""
+        if not self.accoda(None):
+            self.disconnetti()
+
+    def disconnetti(self):
+        self.attivo = False
+        try:
+            self.connessione.shutdown(socket.SHUT_RDWR)  # sblocca una sendall() in corso
+        except:
+            pass
+        try:
+            self.connessione.close()
+        except:
+            pass
+
+    def invia_in_coda(self):
+        """Ciclo del thread dello spettatore: ritorna a fine partita o a connessione persa."""
+        try:
+            while True:
+                dati = self.coda.get()
+                if dati is None:
+                    return
+                self.connessione.sendall(dati)
+        except OSError:
+            pass
+
+
+class SpettatoreAsync:
+    """
+    Spettatore nella modalità "asyncio": le scritture vengono rimandate all'event loop
+    e il limite è sui byte ancora nel buffer del trasporto.
+    """
+
+    __slots__ = ("writer", "loop", "binario", "attivo")
+
+    def __init__(self, writer, loop, binario):
+        self.writer = writer
+        self.loop = loop
+        self.binario = binario
+        self.attivo = True
+
+    def _scrivi(self, dati):
+        if not self.writer.is_closing():
+            self.writer.write(dati)
+
+    def accoda(self, dati) -> bool:
+        # Lettura indicativa dal thread diffusore: basta a riconoscere chi non legge più
+        if self.writer.transport.get_write_buffer_size() > LIMITE_BUFFER_ASYNC:
+            return False
+        self.loop.call_soon_threadsafe(self._scrivi, dati)
+        return True
+
+    def termina(self):
+        self.loop.call_soon_threadsafe(self.writer.close)
+
+    def disconnetti(self):
+        # abort e non close: close aspetterebbe di svuotare un buffer che nessuno legge
+        self.attivo = False
+        self.loop.call_soon_threadsafe(self.writer.transport.abort)
+
+
+class Tribuna:
+    """Spettatori di tutte le sessioni e thread che diffonde loro i messaggi."""
+
+    def __init__(self):
+        self._spettatori = {}  # id_sessione -> tupla di spettatori (sostituita, mai modificata)
+        self._lock = threading.Lock()
+        self._coda = queue.Queue()
+        self._thread = None
+        self.disconnessi_lenti = 0
+
+    # --- Registrazione (con il lock della sessione preso) ---
+
+    def aggiungi(self, id_sessione, spettatore):
+        with self._lock:
+            self._spettatori[id_sessione] = self._spettatori.get(id_sessione, ()) + (spettatore,)
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._ciclo, name="tribuna", daemon=True)
+                self._thread.start()
+
+    def rimuovi(self, id_sessione, spettatore):
+        with self._lock:
+            rimasti = tuple(s for s in self._spettatori.get(id_sessione, ()) if s is not spettatore)
+            if rimasti:
+                self._spettatori[id_sessione] = rimasti
+            else:
+                self._spettatori.pop(id_sessione, None)
+
+    def quanti(self, id_sessione) -> int:
+        return len(self._spettatori.get(id_sessione, ()))
+
+    # --- Messaggi dalla partita (thread di gioco: solo una put, niente codifica) ---
+
+    def _trasmetti(self, id_sessione, tipo, *dati):
+        # La tupla è quella del momento della mossa: chi si aggancia dopo ha già
+        # questa mossa nella fotografia e non la riceve due volte
+        spettatori = self._spettatori.get(id_sessione)
+        if spettatori:
+            self._coda.put((spettatori, tipo, dati))
+
+    def mossa(self, sessione, mossa):
+        self._trasmetti(sessione.id, "mossa", mossa)
+
+    def tempo(self, sessione):
+        self._trasmetti(sessione.id, "tempo", sessione.tempo_bianco, sessione.tempo_nero)
+
+    def chat(self, sessione, mittente, messaggio):
+        self._trasmetti(sessione.id, "testo", f"CHAT|{mittente}|{messaggio}")
+
+    def fine(self, sessione, risultato, terminazione):
+        """Esito agli spettatori, che poi vengono chiusi e tolti dalla sessione."""
+        with self._lock:
+            spettatori = self._spettatori.pop(sessione.id, None)
+        if spettatori:
+            self._coda.put((spettatori, "fine", (f"GAMEOVER|{risultato}|{terminazione}",)))
+
+    # --- Thread diffusore ---
+
+    def _codifica(self, tipo, dati):
+        """Byte per i client testuali e per quelli binari, calcolati una sola volta."""
+        if tipo == "mossa":
+            return protocollo.codifica(dati[0].uci()), protocollo.codifica_mossa(dati[0])
+        if tipo == "tempo":
+            tempo_bianco, tempo_nero = dati
+            testo = protocollo.codifica(f"TIME|{max(0, int(tempo_bianco))}|{max(0, int(tempo_nero))}")
+            return testo, protocollo.codifica_tempo(tempo_bianco * 1000, tempo_nero * 1000)
+        testo = protocollo.codifica(dati[0])
+        return testo, testo
+
+    def _ciclo(self):
+        while True:
+            spettatori, tipo, dati = self._coda.get()
+            testo, binario = self._codifica(tipo, dati)
+            for spettatore in spettatori:
+                if not spettatore.attivo:
+                    continue
+                if not spettatore.accoda(binario if spettatore.binario else testo):
+                    self.disconnessi_lenti += 1
+                    spettatore.disconnetti()
+                elif tipo == "fine":
+                    spettatore.termina()
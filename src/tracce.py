@@ -0,0 +1,99 @@
+"""
+Tracciamento opzionale delle mosse: dove passa il tempo una mossa lenta.
+
+Con il tracciamento attivo (TRACCIA_MOSSE=1 o --traccia) ogni mossa ricevuta
+produce una Traccia con l'istante di fine di ogni tappa del percorso (ricezione e
+decodifica, attesa del lock, orologio, controllo del turno, legalità, push,
+giornale, inoltro all'avversario, eventi, controllo di fine partita, invio degli
+orologi). Le tracce complete finiscono in un buffer circolare di dimensione fissa
+ed esportabili in JSON o nel formato Chrome trace (chrome://tracing, Perfetto).
+
+Spento, il costo sul percorso della mossa è un controllo "traccia is not None"
+per tappa: la Traccia non viene nemmeno creata.
+"""
+
+import collections
+import json
+import os
+import time
+
+ATTIVO = os.environ.get("TRACCIA_MOSSE") == "1"
+CAPACITA = 10_000  # tracce tenute nel buffer circolare
+
+_anello = collections.deque(maxlen=CAPACITA)
+
+
+def attiva(capacita=CAPACITA):
+    global ATTIVO, _anello
+    _anello = collections.deque(_anello, maxlen=capacita)
+    ATTIVO = True
+
+
+class Traccia:
+    """Tappe di una mossa: (nome, istante di fine in ns), a partire da inizio."""
+
+    __slots__ = ("sessione", "nickname", "mossa", "inizio", "tappe")
+
+    def __init__(self, sessione, nickname, inizio=None):
+        self.sessione = sessione
+        self.nickname = nickname
+        self.mossa = None
+        self.inizio = inizio or time.perf_counter_ns()
+        self.tappe = []
+
+    def tappa(self, nome):
+        self.tappe.append((nome, time.perf_counter_ns()))
+
+
+def registra(traccia):
+    """Traccia completa nel buffer circolare (append su deque: nessun lock)."""
+    _anello.append(traccia)
+
+
+def _intervalli(traccia):
+    """(nome, inizio_ns, durata_ns) per ogni tappa."""
+    precedente = traccia.inizio
+    for nome, fine in traccia.tappe:
+        yield nome, precedente, fine - precedente
+        precedente = fine
+
+
+def esporta_json() -> str:
+    tracce = []
+    for traccia in list(_anello):
+        tracce.append({
+            "sessione": traccia.sessione,
+            "nickname": traccia.nickname,
+            "mossa": traccia.mossa,
+            "inizio_ns": traccia.inizio,
+            "totale_us": (traccia.tappe[-1][1] - traccia.inizio) / 1000 if traccia.tappe else 0,
+            "tappe": [
+                {"nome": nome, "durata_us": durata / 1000} for nome, _, durata in _intervalli(traccia)
+            ],
+        })
+    return json.dumps(tracce)
+
+
+def esporta_chrome() -> str:
+    """Formato "Trace Event" di Chrome: una riga (tid) per sessione, un evento per tappa."""
+    eventi = []
+    for traccia in list(_anello):
+        argomenti = {"nickname": traccia.nickname, "mossa": traccia.mossa}
+        fine = traccia.tappe[-1][1] if traccia.tappe else traccia.inizio
+        eventi.append({
+            "name": f"mossa {traccia.mossa}", "ph": "X", "pid": 1, "tid": traccia.sessione,
+            "ts": traccia.inizio / 1000, "dur": (fine - traccia.inizio) / 1000, "args": argomenti,
+        })
+        for nome, inizio, durata in _intervalli(traccia):
+            eventi.append({
+                "name": nome, "ph": "X", "pid": 1, "tid": traccia.sessione,
+                "ts": inizio / 1000, "dur": durata / 1000,
+            })
+    return json.dumps({"traceEvents": eventi, "displayTimeUnit": "ms"})
+
+
+def salva(percorso, formato="chrome"):
+    testo = esporta_chrome() if formato == "chrome" else esporta_json()
+    with open(percorso, "w", encoding="utf-8") as f:
+        f.write(testo)
+    return percorso
@@ -0,0 +1,263 @@
+"""
+Coda di uscita per le connessioni della modalità "thread".
+
+Chi invia un messaggio (thread del giocatore che muove, orologio centrale,
+pannello admin...) non scrive mai sul socket: accoda i byte nella coda limitata
+della connessione e torna subito. Un unico thread di scrittura (Scrittore) serve
+le code di tutte le connessioni: raccoglie i messaggi pronti in un solo invio e
+scrive senza mai bloccarsi (MSG_DONTWAIT, che non cambia la modalità del socket
+letto dal thread del giocatore). Se il client non legge, il resto aspetta che il
+socket torni scrivibile (selectors), quindi un client lento non ferma gli altri
+e la modalità thread resta a un solo thread per client.
+
+Dove MSG_DONTWAIT non esiste (Windows) ogni connessione ha il proprio thread di
+scrittura con sendall(), come prima: due thread per client.
+
+Un client che accumula più di CAPACITA_USCITA messaggi non inviati viene
+disconnesso: il suo thread di lettura vede la connessione chiusa e il server lo
+tratta come una normale disconnessione (con la finestra di ripresa).
+"""
+
+import queue
+import selectors
+import socket
+import threading
+
+CAPACITA_USCITA = 1024  # messaggi in coda prima di disconnettere il client
+MAX_BYTE_PER_SCRITTURA = 64 * 1024  # byte raccolti in un solo invio
+# Modalità "asyncio": byte non ancora inviati dal trasporto prima di disconnettere
+LIMITE_BUFFER_ASYNC = 256 * 1024
+# Un solo thread di scrittura per tutte le connessioni (serve l'invio non bloccante per chiamata)
+SCRITTORE_UNICO = hasattr(socket, "MSG_DONTWAIT")
+
+# Client disconnessi perché troppo lenti a leggere
+disconnessi_lenti = 0
+
+
+class Scrittore:
+    """Thread unico che svuota le code di uscita di tutte le ConnessioneThread."""
+
+    def __init__(self):
+        self._selettore = selectors.DefaultSelector()
+        self._pronte = []  # connessioni con nuovi messaggi o da chiudere
+        self._lock = threading.Lock()
+        self._thread = None
+        # Socketpair per svegliare il select() quando arriva qualcosa da inviare
+        self._sveglia, self._svegliatore = socket.socketpair()
+        self._sveglia.setblocking(False)
+        self._svegliatore.setblocking(False)
+        self._selettore.register(self._sveglia, selectors.EVENT_READ)
+
+    def segnala(self, connessione):
+        with self._lock:
+            if connessione._segnalata:
+                return
+            connessione._segnalata = True
+            self._pronte.append(connessione)
+            sveglia = len(self._pronte) == 1
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._ciclo, name="uscita", daemon=True)
+                self._thread.start()
+        if sveglia:
+            try:
+                self._svegliatore.send(b"\0")
+            except OSError:
+                pass  # socketpair pieno: il thread è già stato svegliato
+
+    def _ciclo(self):
+        while True:
+            for chiave, _ in self._selettore.select():
+                if chiave.fileobj is self._sveglia:
+                    try:
+                        self._sveglia.recv(4096)
+                    except OSError:
+                        pass
+                else:
+                    self._servi(chiave.data)
+            with self._lock:
+                pronte, self._pronte = self._pronte, []
+                for connessione in pronte:
+                    connessione._segnalata = False
+            for connessione in pronte:
+                self._servi(connessione)
+
+    def _servi(self, connessione):
+        esito = connessione._svuota()
+        if esito and not connessione._in_attesa:
+            # Socket pieno: si riprende quando torna scrivibile
+            self._selettore.register(connessione.socket, selectors.EVENT_WRITE, connessione)
+            connessione._in_attesa = True
+        elif not esito and connessione._in_attesa:
+            self._selettore.unregister(connessione.socket)
+            connessione._in_attesa = False
+        if esito is None:
+            # Solo questo thread chiude il socket, dopo averlo tolto dal selettore
+            connessione._chiudi_socket()
+
+
+_scrittore = Scrittore() if SCRITTORE_UNICO else None
+
+
+class ConnessioneThread:
+    """
+    Socket con coda di uscita: espone send/close come un socket (e recv_into per il
+    Decodificatore), così le funzioni di gioco restano identiche nelle due modalità.
+    """
+
+    __slots__ = (
+        "socket", "_coda", "_thread", "_lock", "chiusa", "cattura",
+        "_avviata", "_segnalata", "_in_attesa", "_in_uscita", "_interrotta",
+    )
+
+    def __init__(self, sock, capacita=CAPACITA_USCITA):
+        self.socket = sock
+        self._coda = queue.Queue(capacita)
+        self._thread = None  # thread di scrittura proprio, solo senza SCRITTORE_UNICO
+        self._lock = threading.Lock()
+        self.chiusa = False
+        self.cattura = None  # cattura.Canale se il server registra il traffico
+        # Stato usato dallo Scrittore
+        self._avviata = False  # ha inviato qualcosa: la chiusura passa dallo Scrittore
+        self._segnalata = False  # già tra le connessioni pronte dello Scrittore
+        self._in_attesa = False  # registrata nel selettore in attesa di poter scrivere
+        self._in_uscita = None  # memoryview dei byte di un invio rimasto a metà
+        self._interrotta = False
+
+    def recv_into(self, buffer):
+        return self.socket.recv_into(buffer)
+
+    def in_coda(self) -> int:
+        return self._coda.qsize()
+
+    def send(self, dati):
+        """Accoda senza bloccare; un client rimasto troppo indietro viene disconnesso."""
+        global disconnessi_lenti
+        if self.chiusa:
+            return 0
+        if self.cattura is not None:
+            self.cattura.inviato(dati)
+        if _scrittore is None and self._thread is None:
+            with self._lock:
+                # Thread di scrittura solo per chi riceve qualcosa (non per gli spettatori)
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._ciclo, name="uscita", daemon=True)
+                    self._thread.start()
+        try:
+            self._coda.put_nowait(dati)
+        except queue.Full:
+            disconnessi_lenti += 1
+            self.interrompi()
+            return len(dati)
+        if _scrittore is not None:
+            self._avviata = True
+            _scrittore.segnala(self)
+        return len(dati)
+
+    def close(self):
+        """Chiude dopo aver inviato i messaggi già in coda (es. GAMEOVER)."""
+        if self.chiusa:
+            return
+        self.chiusa = True
+        if self.cattura is not None:
+            self.cattura.chiuso()
+        if self._thread is None and not self._avviata:
+            self._chiudi_socket()
+            return
+        try:
+            self._coda.put_nowait(None)
+        except queue.Full:
+            self.interrompi()
+            return
+        if _scrittore is not None:
+            _scrittore.segnala(self)
+
+    def interrompi(self):
+        """Chiude subito, scartando quanto non ancora inviato."""
+        if self.cattura is not None and not self.chiusa:
+            self.cattura.chiuso()
+        self.chiusa = True
+        if self._avviata:
+            # Il socket può essere nel selettore: lo chiude lo Scrittore
+            self._interrotta = True
+            try:
+                self.socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+            _scrittore.segnala(self)
+            return
+        self._chiudi_socket()
+
+    def shutdown(self, modo):
+        self.socket.shutdown(modo)
+
+    def _chiudi_socket(self):
+        try:
+            # shutdown sblocca anche la recv() del thread di lettura
+            self.socket.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+        self.socket.close()
+
+    def _svuota(self):
+        """
+        Invia dallo Scrittore quanto possibile senza bloccare. Ritorna True se il
+        socket è pieno, False se la coda è vuota, None se la connessione va chiusa.
+        """
+        coda = self._coda
+        while not self._interrotta:
+            if not self._in_uscita:
+                blocco = []
+                dimensione = 0
+                while dimensione < MAX_BYTE_PER_SCRITTURA:
+                    try:
+                        dati = coda.get_nowait()
+                    except queue.Empty:
+                        break
+                    if dati is None:
+                        self._interrotta = True  # chiusura ordinata: dopo quanto già raccolto
+                        break
+                    blocco.append(dati)
+                    dimensione += len(dati)
+                if not blocco:
+                    return None if self._interrotta else False
+                self._in_uscita = memoryview(b"".join(blocco))
+            try:
+                inviati = self.socket.send(self._in_uscita, socket.MSG_DONTWAIT)
+            except BlockingIOError:
+                return True
+            except OSError:
+                self.chiusa = True
+                return None
+            self._in_uscita = self._in_uscita[inviati:]
+        return None
+
+    def _ciclo(self):
+        """Thread di scrittura proprio della connessione (senza SCRITTORE_UNICO)."""
+        coda = self._coda
+        while True:
+            dati = coda.get()
+            if dati is None:
+                self._chiudi_socket()
+                return
+            # Raccoglie gli altri messaggi già pronti (es. mossa + TIME) in una sola scrittura
+            blocco = [dati]
+            dimensione = len(dati)
+            fine = False
+            while dimensione < MAX_BYTE_PER_SCRITTURA:
+                try:
+                    dati = coda.get_nowait()
+                except queue.Empty:
+                    break
+                if dati is None:
+                    fine = True
+                    break
+                blocco.append(dati)
+                dimensione += len(dati)
+            try:
+                self.socket.sendall(b"".join(blocco) if len(blocco) > 1 else blocco[0])
+            except OSError:
+                self.interrompi()
+                return
+            if fine:
+                self._chiudi_socket()
+                return